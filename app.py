@@ -1,159 +1,648 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, Response
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context
+from sqlalchemy import update
 from datetime import datetime, timezone, timedelta
 import ipaddress
-from snmp_operations import scan_ip, check_device_status, get_device_name, find_active_ips, get_system_metrics
+from snmp_operations import scan_ip, get_device_name, session_pool
+from async_poller import poll_devices
+from discovery import BoundedStage, Sweeper, address_family, count_hosts, discover_snmp_agents, probe_snmp_agents
 import threading
+import collections
 import time
 import json
 import os
 import logging
-import queue
+import uuid
 from flask_sse import sse
+from models import db, Device, pack_ip, upgrade_schema
+import metrics_store
+import device_query
+import device_profile
+import device_io
+import event_log
+from scheduler import PollScheduler
+from interface_rates import CounterStore
+from event_bus import EventBus
+from poll_cache import PollCache
+import instrumentation
+from instrumentation import DB_FLUSH_SECONDS, POLL_CYCLE_SECONDS, POLLED_DEVICES, SCAN_ADDRESSES, SCAN_FOUND, SSE_STREAMS
+from sharded_poller import merge_reports
 
-# Konfiguracja logowania
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),  # Wyjście do konsoli
-        logging.FileHandler('app.log')  # Wyjście do pliku
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Ustaw poziom logowania Flask na INFO
-logging.getLogger('werkzeug').setLevel(logging.INFO)
+def configure_logging():
+    """Konfiguracja logowania procesu (serwer WWW, poller) - wywoływana przy starcie, nie przy imporcie"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),  # Wyjście do konsoli
+            logging.FileHandler('app.log')  # Wyjście do pliku
+        ]
+    )
+    # Ustaw poziom logowania Flask na INFO
+    logging.getLogger('werkzeug').setLevel(logging.INFO)
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///devices.db'
+# Adres bazy danych można nadpisać zmienną środowiskową (np. osobna baza dla benchmarków)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('NYO_DATABASE_URI', 'sqlite:///devices.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+db.init_app(app)
 
 # Ścieżka do pliku konfiguracyjnego
 CONFIG_FILE = 'config.json'
 
 # Domyślna konfiguracja
 DEFAULT_CONFIG = {
-    'check_interval': 300  # 5 minut w sekundach
+    'check_interval': 300,  # 5 minut w sekundach
+    'poll_concurrency': 100,  # maksymalna liczba jednocześnie odpytywanych urządzeń
+    'poll_deadline': 5,  # maksymalny czas odpytania jednego urządzenia w sekundach
+    'db_batch_size': 500,  # liczba wyników odpytań zapisywanych w jednej transakcji
+    'device_intervals': {},  # interwały poszczególnych urządzeń: {"adres IP": sekundy}
+    'poll_groups': {},  # interwały grup urządzeń: {"podsieć CIDR": sekundy}
+    'interface_rates': False,  # odczyt liczników interfejsów i wyliczanie przepływności (kilkukrotnie zwiększa koszt odpytania)
+    'poll_workers': 0,  # liczba procesów roboczych pollera (0 - odpytania w procesie pollera)
+    'poll_cache_ttl': 10,  # sekundy, przez które wynik odpytania urządzenia jest współdzielony (0 - tylko łączenie odpytań w toku)
+    'embedded_poller': True,  # python app.py uruchamia także poller (odpytuje, jeśli nie działa inny poller)
+    'trap_port': None,  # port UDP odbiornika pułapek SNMP w pollerze (np. 162; None - wyłączony)
+    'trap_community': None  # wymagana społeczność pułapek (None - dowolna)
 }
 
 # Zmienne globalne
 current_check_interval = None
-last_check_time = datetime.now(timezone.utc)
 checking_active = True
-check_cycle_complete = False
-interval_changed = False
+last_cycle_report = None
+
+# Szyna zdarzeń: osobny kanał dla każdego skanowania ('scan/<id zadania>') i sprawdzenia wszystkich
+# urządzeń ('check/<id zadania>') oraz kanał zmian statusu urządzeń
+event_bus = EventBus()
+DEVICE_CHANNEL = 'devices'
+# Ostatnio uruchomione skanowanie (dla /scan_progress bez parametru job)
+latest_scan_job = None
+# Zadania sprawdzenia wszystkich urządzeń: id -> stan (dla /jobs/<id>); pamiętanych jest MAX_JOBS ostatnich
+check_jobs = collections.OrderedDict()
+check_jobs_lock = threading.Lock()
+MAX_JOBS = 20
+# Trwające sprawdzenie wszystkich urządzeń - kolejne zlecenie dostaje jego id zamiast uruchamiać drugie
+running_check_job = None
+# Identyfikator uruchomienia procesu - numeracja zdarzeń zaczyna się od nowa po restarcie
+BOOT_ID = uuid.uuid4().hex[:8]
+# Zapis zdarzeń urządzeń tego procesu w dzienniku zdarzeń (event_log), z którego odczytują je pozostałe
+# procesy: inne procesy WSGI i serwer WWW przy samodzielnym pollerze
+event_forwarder = event_log.EventForwarder(app, DEVICE_CHANNEL, BOOT_ID)
+
+# Co ile sekund strumień SSE wysyła heartbeat, gdy nie ma zdarzeń
+SSE_HEARTBEAT = 30
+
+# Rozmiar partii zapisu wyników skanowania do bazy danych
+SCAN_BATCH_SIZE = 100
+
+# Liczba urządzeń odpytywanych w jednej partii sprawdzenia wszystkich urządzeń (postęp po każdej partii)
+CHECK_BATCH_SIZE = 500
+
+# Co ile sekund harmonogram uzgadnia listę urządzeń z bazą danych
+SCHEDULER_SYNC_INTERVAL = 10
 
-# Globalna kolejka postępu dla aktualizacji skanowania
-scan_progress_queue = queue.Queue()
+# Co ile sekund sprawdzany jest czas modyfikacji pliku konfiguracyjnego (zmiany zapisane przez inny proces)
+CONFIG_RECHECK_INTERVAL = 5
+
+# Wczytana konfiguracja: (czas modyfikacji pliku, zawartość, czas ostatniego sprawdzenia pliku)
+config_cache = None
+config_lock = threading.Lock()
+
+def config_mtime():
+    try:
+        return os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def cached_config():
+    """
+    Konfiguracja wczytana raz i przechowywana w pamięci (nie wolno jej modyfikować). Plik jest wczytywany
+    ponownie po zapisie przez save_config, a gdy zmieni go inny proces (poller, inne procesy WSGI) -
+    najpóźniej po CONFIG_RECHECK_INTERVAL sekundach
+    """
+    global config_cache
+    now = time.monotonic()
+    with config_lock:
+        if config_cache is None or now - config_cache[2] >= CONFIG_RECHECK_INTERVAL:
+            mtime = config_mtime()
+            if config_cache is None or mtime != config_cache[0]:
+                config = DEFAULT_CONFIG
+                if mtime is not None:
+                    with open(CONFIG_FILE, 'r') as f:
+                        config = json.load(f)
+                config_cache = (mtime, config, now)
+            else:
+                config_cache = (config_cache[0], config_cache[1], now)
+        return config_cache[1]
 
 def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
-    return DEFAULT_CONFIG
+    """Kopia konfiguracji (do modyfikacji i zapisu przez save_config)"""
+    return dict(cached_config())
 
 def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f)
+    global config_cache
+    with config_lock:
+        with open(CONFIG_FILE, 'w') as f:
+            json.dump(config, f)
+        config_cache = (config_mtime(), dict(config), time.monotonic())
+
+def get_config_value(key):
+    """Zwraca wartość z pliku konfiguracyjnego lub wartość domyślną"""
+    return cached_config().get(key, DEFAULT_CONFIG[key])
+
+def poll_cache_key(device, counters):
+    """Klucz wyniku odpytania w poll_cache: adres, społeczność i zestaw OID (z licznikami interfejsów lub bez)"""
+    return (device.ip_address, device.snmp_community, counters)
+
+def poll_targets(devices):
+    """
+    Odpytuje urządzenia równolegle i zwraca (wyniki wg id urządzenia, raport cyklu).
+    Urządzenie odpytywane właśnie przez inny wątek lub odpytane przed mniej niż poll_cache_ttl
+    sekundami nie jest odpytywane ponownie (klucz: adres, społeczność, zestaw OID). Taki wynik
+    ma 'cached': True - zapisał go już (lub zapisze) ten, kto odpytywał.
+    Odpytanie w bieżącym procesie korzysta z profilu możliwości urządzenia (device_profile)
+    """
+    counters = get_config_value('interface_rates')
+    keys = {device.id: poll_cache_key(device, counters) for device in devices}
+    device_ids = {key: device_id for device_id, key in keys.items()}
+    profiles = {device.id: capability_profile(device.id, device.snmp_profile) for device in devices}
+    report = None
+
+    def poll(claimed):
+        nonlocal report
+        ids = [device_ids[key] for key in claimed]
+        results = {}
+        if poll_backend is not None:
+            results, report = poll_backend.poll(ids)
+        # Bez procesów roboczych - wszystkie; z nimi urządzenia jeszcze im nieprzydzielone (dodane po ostatniej
+        # synchronizacji harmonogramu) i te, których proces roboczy uległ awarii w trakcie odpytania
+        local = [device_id for device_id in ids if device_id not in results]
+        if local:
+            local_results, local_report = poll_devices(
+                [(device_id, *keys[device_id][:2], profiles[device_id]) for device_id in local],
+                concurrency=get_config_value('poll_concurrency'),
+                deadline=get_config_value('poll_deadline'),
+                counters=counters
+            )
+            results.update(local_results)
+            report = local_report if report is None else merge_reports(
+                [report, local_report], report['duration'] + local_report['duration'])
+        for device_id, result in results.items():
+            if result.get('profile') is not None:
+                device_profiles[device_id] = (device_profile.dumps(result['profile']), result['profile'])
+        return {keys[device_id]: result for device_id, result in results.items()}
+
+    poll_cache.ttl = get_config_value('poll_cache_ttl')
+    results, shared = poll_cache.fetch(list(keys.values()), poll)
+    if report is None:
+        report = {'devices': 0, 'duration': 0, 'p50_latency': None, 'p99_latency': None,
+                  'timeouts': 0, 'errors': 0, 'concurrency': 0}
+    report['cached'] = len(shared)
+    return {device_id: dict(results[key], cached=True) if key in shared else results[key]
+            for device_id, key in keys.items() if key in results}, report
+
+# Profile możliwości SNMP urządzeń odpytywanych w tym procesie: {id: (JSON z bazy, profil)}.
+# Profil w pamięci pamięta ostatni sysUpTime (wykrywanie restartu) bez zapisu do bazy
+device_profiles = {}
+
+def capability_profile(device_id, text):
+    """Profil urządzenia z pamięci; odczytywany ponownie z JSON, gdy kolumna snmp_profile się zmieniła"""
+    cached = device_profiles.get(device_id)
+    if cached is not None and cached[0] == text:
+        return cached[1]
+    try:
+        profile = device_profile.loads(text)
+    except ValueError:
+        logger.warning(f"Nieprawidłowy profil SNMP urządzenia {device_id} - zostanie utworzony ponownie")
+        profile = None
+    device_profiles[device_id] = (text, profile)
+    return profile
 
 # Inicjalizacja current_check_interval z konfiguracji
-config = load_config()
-current_check_interval = config['check_interval']
-logger.info(f"Zainicjalizowano interwał sprawdzania na {current_check_interval} sekund z konfiguracji")
-
-class Device(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    ip_address = db.Column(db.String(15), unique=True, nullable=False)
-    name = db.Column(db.String(100))
-    status = db.Column(db.String(20))
-    last_checked = db.Column(db.DateTime, default=datetime.now(timezone.utc))
-    snmp_community = db.Column(db.String(50), default='public')
-    uptime = db.Column(db.String(50))
-    cpu_usage = db.Column(db.Float)
-    memory_used = db.Column(db.Integer)  # w MB
-    memory_total = db.Column(db.Integer)  # w MB
-
-def check_all_devices():
-    """Sprawdza status wszystkich urządzeń w bazie danych"""
-    global last_check_time, check_cycle_complete
+current_check_interval = get_config_value('check_interval')
+
+# Wyniki odpytań współdzielone przez wątki: odpytanie w toku i wyniki sprzed poll_cache_ttl sekund
+poll_cache = PollCache(get_config_value('poll_cache_ttl'))
+
+# Odpytywanie w procesach roboczych (sharded_poller.ShardedPoller), gdy poller ma poll_workers > 0;
+# None - odpytania w bieżącym procesie
+poll_backend = None
+
+def schedule_config():
+    """Interwały z pliku konfiguracyjnego: (domyślny, {adres IP: sekundy}, {podsieć CIDR: sekundy})"""
+    return (get_config_value('check_interval'), get_config_value('device_intervals'), get_config_value('poll_groups'))
+
+def configure_scheduler(intervals):
+    global applied_schedule_config
+    scheduler.configure(*intervals)
+    applied_schedule_config = intervals
+
+# Harmonogram odpytań: każde urządzenie ma własny termin kolejnego sprawdzenia
+applied_schedule_config = schedule_config()
+scheduler = PollScheduler(*applied_schedule_config)
+# Budzi wątek w tle przed czasem (np. po zmianie interwału)
+scheduler_wakeup = threading.Event()
+# Stan harmonogramu w /metrics (w procesie, który odpytuje urządzenia)
+instrumentation.REGISTRY.gauge('nyo_scheduled_devices', 'Devices in the poll schedule of this process',
+                               function=lambda: len(scheduler))
+instrumentation.REGISTRY.gauge('nyo_devices_overdue', 'Scheduled devices past their due time and not being polled',
+                               function=lambda: scheduler.overdue())
+
+# Poprzednie próbki liczników interfejsów (tylko w pamięci)
+counter_store = CounterStore()
+
+def poll_result_values(device, result):
+    """Zamienia wynik poll_device (status, nazwa, metryki) na wartości kolumn urządzenia"""
+    values = {'status': 'active' if result['active'] else 'inactive'}
+    if not result['active']:
+        return values
+    
+    # Uzupełnij nazwę urządzenia jeśli jest nieznana
+    if (not device.name or device.name == 'Unknown') and result['name']:
+        values['name'] = result['name']
+        logger.info(f"Zaktualizowano nazwę urządzenia dla {device.ip_address}: {result['name']}")
+    
+    metrics = result['metrics']
+    values['uptime'] = metrics.get('uptime')
+    values['cpu_usage'] = metrics.get('cpu_usage')
+    values['memory_used'] = metrics.get('memory_used')
+    values['memory_total'] = metrics.get('memory_total')
+    if result.get('profile') is not None:
+        # Nowo poznany profil możliwości - zapisywany tylko po zmianie (restart, nowe oprogramowanie)
+        values['snmp_profile'] = device_profile.dumps(result['profile'])
+    return values
+
+def device_delta(values):
+    """Zamienia wartości kolumn urządzenia na postać JSON (last_checked jako sekundy epoki, bez profilu SNMP)"""
+    delta = {column: value for column, value in values.items() if column in device_query.FIELDS}
+    if delta.get('last_checked') is not None:
+        delta['last_checked'] = delta['last_checked'].timestamp()
+    return delta
+
+def device_values(device):
+    return {column: getattr(device, column) for column in device_query.FIELDS}
+
+def publish_device_event(event):
+    """
+    Publikuje zdarzenie urządzeń w lokalnej szynie (panele podłączone do tego procesu) i przekazuje je
+    do dziennika zdarzeń, skąd trafia do pozostałych procesów
+    """
+    event_bus.publish(DEVICE_CHANNEL, event)
+    event_forwarder.forward(event)
+
+def publish_device_deltas(rows):
+    """Publikuje zmienione kolumny urządzeń (słowniki z kluczem 'id') - panel podmienia tylko te wiersze"""
+    if rows:
+        publish_device_event({'type': 'devices', 'devices': [device_delta(row) for row in rows]})
+
+def apply_poll_result(device, result):
+    """Przepisuje wynik poll_device do rekordu urządzenia"""
+    for column, value in poll_result_values(device, result).items():
+        setattr(device, column, value)
+
+class ResultWriter:
+    """
+    Zbiera wyniki odpytań i zapisuje je partiami: jeden zbiorczy UPDATE (executemany)
+    i jeden commit na partię zamiast commita po każdym urządzeniu
+    """
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.rows = []
+        self.written = 0
+    
+    def add(self, device, result, checked_at):
+        row = poll_result_values(device, result)
+        row['id'] = device.id
+        row['last_checked'] = checked_at
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        if not self.rows:
+            return
+        try:
+            start = time.perf_counter()
+            db.session.execute(update(Device), self.rows)
+            db.session.commit()
+            DB_FLUSH_SECONDS.observe(time.perf_counter() - start, 'poll_results')
+            self.written += len(self.rows)
+            publish_device_deltas(self.rows)
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            self.rows = []
+
+def record_metrics_history(results, checked_at):
+    """Dopisuje metryki aktywnych urządzeń (wyniki wg id urządzenia) do historii"""
+    ts = int(checked_at.timestamp())
+    samples = [
+        {
+            'device_id': device_id,
+            'ts': ts,
+            'cpu_usage': result['metrics'].get('cpu_usage'),
+            'memory_used': result['metrics'].get('memory_used'),
+            'memory_total': result['metrics'].get('memory_total')
+        }
+        for device_id, result in results.items() if result['active']
+    ]
+    try:
+        start = time.perf_counter()
+        metrics_store.record_samples(samples)
+        DB_FLUSH_SECONDS.observe(time.perf_counter() - start, 'metrics_history')
+    except Exception as e:
+        logger.error(f"Błąd zapisu historii metryk: {str(e)}")
+        db.session.rollback()
+
+def record_interface_rates(results, checked_at):
+    """Wylicza przepływności interfejsów z liczników w wynikach odpytań i zapisuje je do historii"""
+    ts = int(checked_at.timestamp())
+    now = checked_at.timestamp()
+    try:
+        for device_id, result in results.items():
+            if result.get('counters'):
+                rates = counter_store.update(device_id, result['counters'], now)
+                metrics_store.record_interface_rates(device_id, rates, ts)
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Błąd zapisu przepływności interfejsów: {str(e)}")
+        db.session.rollback()
+
+def poll_and_store(devices, check_start_time):
+    """
+    Odpytuje urządzenia, zapisuje wyniki i historię metryk oraz przekazuje je do harmonogramu.
+    Zwraca (raport, liczba zapisanych wyników, liczba urządzeń, które zmieniły status);
+    report['failed'] to liczba urządzeń, które nie odpowiedziały lub nie zostały odpytane
+    """
+    start = time.perf_counter()
+    # Status, nazwa i metryki wszystkich urządzeń odpytywane równolegle
+    results, report = poll_targets(devices)
+    report['failed'] = sum(1 for device in devices if device.id not in results or not results[device.id]['active'])
+    # Urządzenia bez wyniku (np. po awarii procesu roboczego) wracają do harmonogramu bez zmian
+    devices = [device for device in devices if device.id in results]
+    # Wyniki współdzielone (cached) zapisał już ten, kto odpytywał
+    polled = {device.id: results[device.id] for device in devices if not results[device.id].get('cached')}
+    
+    writer = ResultWriter(get_config_value('db_batch_size'))
+    for device in devices:
+        if device.id in polled:
+            writer.add(device, polled[device.id], check_start_time)
+    writer.flush()
+    
+    # Historia metryk: próbki surowe + agregaty, przepływności interfejsów
+    record_metrics_history(polled, check_start_time)
+    record_interface_rates(polled, check_start_time)
+    
+    changed = [device for device in devices if scheduler.complete(device.id, results[device.id]['active'])]
+    publish_status_changes(changed, results, check_start_time)
+    
+    POLL_CYCLE_SECONDS.observe(time.perf_counter() - start)
+    active = sum(1 for result in polled.values() if result['active'])
+    POLLED_DEVICES.inc('active', amount=active)
+    POLLED_DEVICES.inc('inactive', amount=len(polled) - active)
+    POLLED_DEVICES.inc('shared', amount=len(devices) - len(polled))
+    return report, writer.written, len(changed)
+
+def publish_status_changes(devices, results, checked_at):
+    """Publikuje na szynie zdarzeń zmiany statusu urządzeń"""
+    for device in devices:
+        publish_device_event({
+            'type': 'status',
+            'id': device.id,
+            'ip_address': device.ip_address,
+            'name': device.name,
+            'status': 'active' if results[device.id]['active'] else 'inactive',
+            'last_checked': checked_at.strftime('%Y-%m-%d %H:%M:%S')
+        })
+
+# Pułapki, na które reaguje poller; pozostałe są tylko liczone w /metrics
+TRAP_EVENTS = ('coldStart', 'warmStart', 'linkDown', 'linkUp')
+
+def handle_trap(trap):
+    """
+    Obsługuje pułapkę z trap_receiver: urządzenie, które ją wysłało, odpowiada, więc od razu dostaje
+    status 'active', panel otrzymuje zdarzenie 'trap', a urządzenie jest odpytywane poza kolejnością
+    (wynik współdzielony z poll_cache jest pomijany - np. po restarcie jest już nieaktualny).
+    Urządzenie to nadawca datagramu; adresowi agenta z treści pułapki SNMPv1 (np. pułapka przekazana
+    przez proxy) można ufać tylko przy sprawdzonej społeczności (trap_community)
+    """
+    if trap['type'] not in TRAP_EVENTS:
+        logger.debug(f"Pominięto pułapkę {trap['type']} od {trap['ip']}")
+        return
+    trap_community = get_config_value('trap_community')
+    if trap_community is not None and trap['community'] != trap_community:
+        logger.warning(f"Odrzucono pułapkę {trap['type']} od {trap['ip']}: nieprawidłowa społeczność")
+        return
+    ip = trap['ip']
+    if trap_community is not None and trap['agent_address'] is not None:
+        ip = trap['agent_address']
+    with app.app_context():
+        device = (db.session.query(Device.id, Device.ip_address, Device.name, Device.status, Device.snmp_community)
+                  .filter(Device.ip_packed == pack_ip(ip)).first())
+        if device is None:
+            logger.debug(f"Pominięto pułapkę {trap['type']} od nieznanego urządzenia {ip}")
+            return
+        if device.status != 'active':
+            db.session.execute(update(Device), [{'id': device.id, 'status': 'active'}])
+            db.session.commit()
+            publish_device_deltas([{'id': device.id, 'status': 'active'}])
+    interface = f" (interfejs {trap['if_index']})" if trap['if_index'] is not None else ''
+    logger.info(f"Pułapka {trap['type']} od {device.ip_address}{interface}")
+    publish_device_event({
+        'type': 'trap',
+        'id': device.id,
+        'ip_address': device.ip_address,
+        'name': device.name,
+        'trap': trap['type'],
+        'if_index': trap['if_index'],
+        'timestamp': time.time()
+    })
+    poll_cache.invalidate([poll_cache_key(device, get_config_value('interface_rates'))])
+    if scheduler.poll_now(device.id):
+        scheduler_wakeup.set()
+
+def poll_query():
+    # Wystarczą kolumny potrzebne do odpytania - bez ładowania pełnych obiektów ORM
+    return db.session.query(Device.id, Device.ip_address, Device.snmp_community, Device.name, Device.snmp_profile)
+
+def evict_metrics_history():
+    """Usuwa historię metryk starszą niż okres retencji"""
+    try:
+        metrics_store.evict_expired()
+    except Exception as e:
+        logger.error(f"Błąd usuwania przeterminowanej historii metryk: {str(e)}")
+        db.session.rollback()
+
+def check_channel(job_id):
+    return f'check/{job_id}'
+
+def check_job_status(job):
+    """Stan zadania sprawdzenia: liczniki completed/failed/remaining oraz szacowany czas do końca (eta, sekundy)"""
+    done = job['completed'] + job['failed']
+    elapsed = (job['finished'] or time.time()) - job['started']
+    remaining = job['total'] - done
+    return dict(job, remaining=remaining, elapsed=round(elapsed, 1),
+                eta=round(elapsed / done * remaining, 1) if done and job['status'] == 'running' else None)
+
+def create_check_job(job_type='check_all'):
+    """
+    Rejestruje nowe zadanie sprawdzenia urządzeń (check_all - wszystkich, import - zaimportowanych)
+    i zwraca jego id (wywoływane pod check_jobs_lock)
+    """
+    job_id = uuid.uuid4().hex
+    check_jobs[job_id] = {'id': job_id, 'type': job_type, 'status': 'running', 'total': 0,
+                          'completed': 0, 'failed': 0, 'started': time.time(), 'finished': None, 'error': None}
+    while len(check_jobs) > MAX_JOBS:
+        check_jobs.popitem(last=False)
+    return job_id
+
+def device_batches(device_ids):
+    """Urządzenia o podanych id do odpytania, partiami po CHECK_BATCH_SIZE"""
+    for start in range(0, len(device_ids), CHECK_BATCH_SIZE):
+        yield poll_query().filter(Device.id.in_(device_ids[start:start + CHECK_BATCH_SIZE])).all()
+
+def check_all_devices(job_id=None, device_ids=None):
+    """
+    Sprawdza status wszystkich urządzeń w bazie danych (albo tylko device_ids, np. po imporcie)
+    partiami po CHECK_BATCH_SIZE. Postęp zadania job_id (completed/failed/remaining, ETA) jest
+    aktualizowany w check_jobs i publikowany w kanale zadania na szynie zdarzeń
+    """
+    global last_cycle_report
+    check_all = device_ids is None
+    with check_jobs_lock:
+        if job_id is None:
+            job_id = create_check_job()
+        job = check_jobs[job_id]
+    channel = check_channel(job_id)
     logger.info("[check_all_devices] Rozpoczynanie cyklu sprawdzania urządzeń")
     with app.app_context():
-        devices = Device.query.all()
-        logger.info(f"[check_all_devices] Sprawdzanie {len(devices)} urządzeń")
-        
-        # Ustaw czas rozpoczęcia sprawdzania
-        check_start_time = get_local_time()
-        
-        for device in devices:
-            try:
-                # Sprawdź czy urządzenie odpowiada na SNMP
-                is_active = check_device_status(device.ip_address, device.snmp_community)
-                device.status = 'active' if is_active else 'inactive'
-                logger.info(f"[check_all_devices] Status urządzenia {device.ip_address}: {device.status}")
-                
-                # Jeśli urządzenie jest aktywne, spróbuj pobrać jego nazwę i metryki
-                if is_active:
-                    # Pobierz nazwę urządzenia jeśli jest nieznana
-                    if device.name == 'Unknown':
-                        try:
-                            device_name = get_device_name(device.ip_address, device.snmp_community)
-                            if device_name:
-                                device.name = device_name
-                                logger.info(f"[check_all_devices] Zaktualizowano nazwę urządzenia dla {device.ip_address}: {device_name}")
-                        except Exception as e:
-                            logger.error(f"[check_all_devices] Błąd pobierania nazwy urządzenia dla {device.ip_address}: {str(e)}")
-                    
-                    # Pobierz metryki systemowe
-                    try:
-                        metrics = get_system_metrics(device.ip_address, device.snmp_community)
-                        if metrics:
-                            device.uptime = metrics.get('uptime')
-                            device.cpu_usage = metrics.get('cpu_usage')
-                            device.memory_used = metrics.get('memory_used')
-                            device.memory_total = metrics.get('memory_total')
-                            logger.info(f"[check_all_devices] Zaktualizowano metryki dla {device.ip_address}")
-                    except Exception as e:
-                        logger.error(f"[check_all_devices] Błąd pobierania metryk dla {device.ip_address}: {str(e)}")
-                
-                device.last_checked = check_start_time
-                db.session.commit()
-            except Exception as e:
-                logger.error(f"[check_all_devices] Błąd sprawdzania urządzenia {device.ip_address}: {str(e)}")
-                device.status = 'inactive'
-                device.last_checked = check_start_time
-                db.session.commit()
-        
-        # Aktualizuj czas ostatniego sprawdzenia i ustaw flagę zakończenia cyklu
-        last_check_time = check_start_time
-        check_cycle_complete = True
-        logger.info(f"[check_all_devices] Zakończono cykl sprawdzania urządzeń o {last_check_time}, check_cycle_complete ustawiono na True")
-        # Dodaj małe opóźnienie aby upewnić się, że flaga zostanie zauważona
-        time.sleep(0.1)
-
-def background_checker():
-    """Wątek w tle, który okresowo sprawdza wszystkie urządzenia"""
-    global current_check_interval
-    logger.info(f"[background_checker] Uruchomiono z interwałem: {current_check_interval} sekund")
-    while True:
         try:
-            logger.info("[background_checker] Rozpoczynanie nowego cyklu sprawdzania")
-            check_all_devices()
-            logger.info(f"[background_checker] Cykl sprawdzania zakończony, oczekiwanie {current_check_interval} sekund")
-            # Śpij w mniejszych interwałach aby być bardziej responsywnym
-            for _ in range(current_check_interval):
-                time.sleep(1)
+            if check_all:
+                device_ids = [device_id for (device_id,) in db.session.query(Device.id).order_by(Device.id)]
+            job['total'] = len(device_ids)
+            logger.info(f"[check_all_devices] Sprawdzanie {job['total']} urządzeń")
+            event_bus.publish(channel, dict(check_job_status(job), type='progress'))
+            
+            # Ustaw czas rozpoczęcia sprawdzania
+            check_start_time = get_local_time()
+            reports, written = [], 0
+            for batch in device_batches(device_ids):
+                report, batch_written, _ = poll_and_store(batch, check_start_time)
+                reports.append(report)
+                written += batch_written
+                job['failed'] += report['failed']
+                job['completed'] += len(batch) - report['failed']
+                event_bus.publish(channel, dict(check_job_status(job), type='progress'))
+            evict_metrics_history()
+            
+            report = merge_reports(reports, time.time() - job['started'])
+            report['cached'] = sum(batch_report['cached'] for batch_report in reports)
+            job.update(status='complete', finished=time.time())
+            event_bus.publish(channel, dict(check_job_status(job), type='complete'))
+            
+            if check_all:
+                last_cycle_report = report
+            logger.info(f"[check_all_devices] Raport cyklu: {job['total']} urządzeń w {report['duration']:.2f}s, "
+                        f"p50 {_format_latency(report['p50_latency'])}, p99 {_format_latency(report['p99_latency'])}, "
+                        f"timeouty: {report['timeouts']}, błędy: {report['errors']}, współdzielone: {report['cached']}, zapisano: {written}")
         except Exception as e:
-            logger.error(f"[background_checker] Błąd: {str(e)}")
-            time.sleep(30)  # Poczekaj 30 sekund przed ponowną próbą w przypadku błędu
+            logger.error(f"Błąd sprawdzania wszystkich urządzeń: {str(e)}")
+            db.session.rollback()
+            job.update(status='error', finished=time.time(), error=str(e))
+            event_bus.publish(channel, dict(check_job_status(job), type='error'))
+        finally:
+            event_bus.finish(channel)
 
-# Uruchom wątek sprawdzania w tle
-checking_thread = threading.Thread(target=background_checker, daemon=True)
-checking_thread.start()
+def check_all_worker(job_id):
+    global running_check_job
+    try:
+        check_all_devices(job_id)
+    finally:
+        with check_jobs_lock:
+            running_check_job = None
 
-with app.app_context():
-    db.create_all()
+def _format_latency(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.0f}ms"
+
+def sync_scheduler():
+    """
+    Uzgadnia harmonogram z listą urządzeń w bazie (nowe urządzenia, usunięte urządzenia) i z interwałami
+    z pliku konfiguracyjnego (zmienionymi np. przez serwer WWW, gdy poller działa w osobnym procesie)
+    """
+    global current_check_interval
+    with app.app_context():
+        rows = db.session.query(Device.id, Device.ip_address, Device.status, Device.snmp_community,
+                                Device.snmp_profile).all()
+    intervals = schedule_config()
+    if intervals != applied_schedule_config:
+        configure_scheduler(intervals)
+        current_check_interval = intervals[0]
+    scheduler.sync((device_id, ip, status == 'active') for device_id, ip, status, *_ in rows)
+    if poll_backend is not None:
+        moved = poll_backend.assign((device_id, ip, community, profile)
+                                    for device_id, ip, _, community, profile in rows)
+        if moved:
+            logger.info(f"[background_checker] Przydzielono procesom roboczym {moved} zmian urządzeń")
+
+def poll_due_devices():
+    """Odpytuje urządzenia, których termin sprawdzenia już minął"""
+    global last_cycle_report
+    due = scheduler.pop_due()
+    if not due:
+        return
+    try:
+        with app.app_context():
+            devices = poll_query().filter(Device.id.in_(due)).all()
+            check_start_time = get_local_time()
+            report, written, changed = poll_and_store(devices, check_start_time)
+    finally:
+        # Urządzenia, których nie udało się odpytać, wracają do harmonogramu
+        scheduler.release(due)
+    last_cycle_report = report
+    logger.info(f"[background_checker] Odpytano {len(devices)} urządzeń w {report['duration']:.2f}s, "
+                f"p50 {_format_latency(report['p50_latency'])}, p99 {_format_latency(report['p99_latency'])}, "
+                f"timeouty: {report['timeouts']}, błędy: {report['errors']}, współdzielone: {report['cached']}, zmiany statusu: {changed}")
+
+db_ready = False
+db_ready_lock = threading.Lock()
+
+def init_db():
+    """Tworzy tabele; baza z poprzedniej wersji (adresy jako tekst, bez indeksów) jest najpierw migrowana"""
+    global db_ready
+    with db_ready_lock:
+        if not db_ready:
+            with app.app_context():
+                upgrade_schema()
+                db.create_all()
+            db_ready = True
+
+@app.before_request
+def ensure_database():
+    # Import modułu niczego nie tworzy - tabele powstają przy starcie procesu albo przy pierwszym żądaniu
+    if not db_ready:
+        init_db()
+    ensure_event_relay()
+
+event_relay = None
+event_relay_lock = threading.Lock()
+
+def ensure_event_relay():
+    """
+    Uruchamia (przy pierwszym żądaniu) zapis zdarzeń urządzeń tego procesu w dzienniku zdarzeń i
+    przekazywanie zdarzeń zapisanych tam przez inne procesy (poller, pozostałe procesy WSGI); leniwie,
+    bo app importuje także sam proces pollera, który zdarzenia zapisuje, a nie czyta
+    """
+    global event_relay
+    if event_relay is not None:
+        return
+    with event_relay_lock:
+        if event_relay is None:
+            event_forwarder.start()
+            relay = event_log.EventRelay(app, event_bus, origin=BOOT_ID)
+            relay.start()
+            event_relay = relay
 
 def get_local_time():
     """Konwertuje czas UTC na czas lokalny"""
@@ -161,46 +650,16 @@ def get_local_time():
 
 @app.route('/')
 def index():
-    devices = Device.query.all()
+    # Tabela i panel powiadomień pobierają urządzenia stronami przez /api/devices
     config = load_config()
     return render_template('index.html', 
-                         devices=devices, 
                          check_interval=config['check_interval'],
-                         last_check_time=get_local_time())
-
-@app.route('/get_last_check_time')
-def get_last_check_time():
-    global last_check_time, check_cycle_complete, interval_changed
-    logger.info(f"[get_last_check_time] Wywołano - Ostatnie sprawdzenie: {last_check_time}, Cykl zakończony: {check_cycle_complete}, Interwał zmieniony: {interval_changed}")
-    
-    # Zapisz aktualny stan check_cycle_complete przed resetowaniem
-    current_cycle_complete = check_cycle_complete
-    
-    # Oblicz czas od ostatniego sprawdzenia
-    current_time = get_local_time()
-    time_since_last_check = (current_time - last_check_time).total_seconds()
-    
-    # Jeśli sprawdzenie zostało zakończone w ciągu ostatnich 10 sekund, uznaj je za zakończone
-    if time_since_last_check < 10 and not current_cycle_complete:
-        logger.info(f"[get_last_check_time] Wykryto niedawne sprawdzenie ({time_since_last_check:.1f} sekund temu)")
-        current_cycle_complete = True
-    
-    response = {
-        'last_check_time': current_time.strftime('%Y-%m-%d %H:%M:%S'),
-        'check_cycle_complete': current_cycle_complete,
-        'interval_changed': interval_changed
-    }
-    
-    # Resetuj flagi po zapisaniu ich w odpowiedzi
-    check_cycle_complete = False
-    interval_changed = False
-    
-    logger.info(f"[get_last_check_time] Odpowiedź: {response}")
-    return jsonify(response)
+                         last_check_time=get_local_time(),
+                         device_event_id=event_bus.last_id(DEVICE_CHANNEL))
 
 @app.route('/update_check_interval', methods=['POST'])
 def update_check_interval():
-    global current_check_interval, interval_changed
+    global current_check_interval
     try:
         interval = int(request.form.get('interval', 300))
         if interval < 30:  # Minimum 30 sekund
@@ -210,9 +669,11 @@ def update_check_interval():
         config['check_interval'] = interval
         save_config(config)
         
-        # Aktualizuj globalną zmienną interwału natychmiast
+        # Aktualizuj globalną zmienną interwału i harmonogram natychmiast
         current_check_interval = interval
-        interval_changed = True
+        configure_scheduler(schedule_config())
+        scheduler_wakeup.set()
+        publish_device_event({'type': 'interval', 'interval': interval})
         logger.info(f"Zaktualizowano interwał sprawdzania na {interval} sekund")
         
         return jsonify({'message': 'Interwał sprawdzania zaktualizowany pomyślnie'})
@@ -228,8 +689,8 @@ def add_device():
         # Sprawdź poprawność adresu IP
         ipaddress.ip_address(ip)
         
-        # Sprawdź czy urządzenie istnieje
-        existing_device = Device.query.filter_by(ip_address=ip).first()
+        # Sprawdź czy urządzenie istnieje (po spakowanym adresie - ta sama postać dla każdego zapisu IPv6)
+        existing_device = Device.query.filter_by(ip_packed=pack_ip(ip)).first()
         if existing_device:
             return jsonify({'error': 'Urządzenie już istnieje'}), 400
         
@@ -250,6 +711,7 @@ def add_device():
             )
             db.session.add(device)
             db.session.commit()
+            publish_device_event({'type': 'added', 'devices': [device_delta(device_values(device))]})
             return redirect(url_for('index'))
         else:
             return jsonify({'error': 'Nie można połączyć się z urządzeniem przez SNMP'}), 400
@@ -257,166 +719,306 @@ def add_device():
     except ValueError:
         return jsonify({'error': 'Nieprawidłowy adres IP'}), 400
 
-def scan_range_worker(ip_range, community):
+def save_scan_batch(results, community):
+    """Zapisuje partię wyników skanowania jednym zapytaniem o istniejące adresy i jednym commitem"""
+    agents = {ip: info for ip, info in results if info is not None}
+    if not agents:
+        return []
+    
+    # Sprawdź które urządzenia już istnieją (jedno zapytanie dla całej partii)
+    packed = {pack_ip(ip): ip for ip in agents}
+    existing = {packed[key] for (key,) in db.session.query(Device.ip_packed).filter(Device.ip_packed.in_(list(packed)))}
+    new_ips = [ip for ip in agents if ip not in existing]
+    devices = [
+        Device(
+            ip_address=ip,
+            snmp_community=community,
+            status='active',
+            name=agents[ip]['name'] or 'Unknown'
+        )
+        for ip in new_ips
+    ]
+    db.session.add_all(devices)
+    # flush nadaje id - wartości do zdarzenia zbierane przed commitem, który wygasza obiekty
+    db.session.flush()
+    added = [device_delta(device_values(device)) for device in devices]
+    db.session.commit()
+    if added:
+        publish_device_event({'type': 'added', 'devices': added})
+    return new_ips
+
+def scan_channel(job_id):
+    return f'scan/{job_id}'
+
+def scan_range_worker(ip_range, community, scan_mode='snmp', job_id=None):
+    """
+    Skanuje zakres strumieniowo: adresy -> sprawdzenie dostępności -> SNMP -> zapis partiami.
+    Etapy połączone są ograniczonymi kolejkami, więc pamięć nie rośnie z rozmiarem zakresu,
+    a pierwsze urządzenia pojawiają się w bazie zanim zakończy się cały przebieg.
+    Postęp publikowany jest w kanale zadania na szynie zdarzeń.
+    """
+    channel = scan_channel(job_id)
     # Utwórz kontekst aplikacji dla wątku w tle
     with app.app_context():
         try:
             network = ipaddress.ip_network(ip_range, strict=False)
-            total_ips = sum(1 for _ in network.hosts())
-            
-            # Znajdź aktywne adresy IP
-            active_ips = find_active_ips(ip_range)
-            scan_progress_queue.put({
-                'type': 'active_ips',
-                'count': len(active_ips),
-                'total': total_ips
-            })
+            total_ips = count_hosts(network)
             
+            # Liczniki poszczególnych etapów potoku
+            stages = {'swept': 0, 'alive': 0, 'probed': 0, 'found': 0}
             found_devices = []
-            scanned_count = 0
-            
-            for ip in active_ips:
-                try:
-                    # Sprawdź czy urządzenie już istnieje
-                    existing_device = Device.query.filter_by(ip_address=ip).first()
-                    if existing_device:
-                        continue
-                        
-                    # Spróbuj przeskanować urządzenie
-                    if scan_ip(ip, community):
-                        # Spróbuj pobrać nazwę urządzenia
-                        name = None
-                        try:
-                            name = get_device_name(ip, community)
-                        except Exception as e:
-                            logger.error(f"Błąd pobierania nazwy urządzenia dla {ip}: {str(e)}")
-                        
-                        device = Device(
-                            ip_address=ip,
-                            snmp_community=community,
-                            status='active',
-                            name=name or 'Unknown'
-                        )
-                        db.session.add(device)
-                        found_devices.append(ip)
-                    
-                    scanned_count += 1
-                    scan_progress_queue.put({
-                        'type': 'progress',
-                        'scanned': scanned_count,
-                        'total': len(active_ips),
-                        'found': len(found_devices)
-                    })
-                    
-                except Exception as e:
-                    logger.error(f"Błąd skanowania {ip}: {str(e)}")
-                    continue
             
-            try:
-                db.session.commit()
-                scan_progress_queue.put({
-                    'type': 'complete',
-                    'message': f'Znaleziono {len(found_devices)} nowych urządzeń',
-                    'devices': found_devices,
-                    'total_ips': total_ips,
-                    'active_ips': len(active_ips),
-                    'scanned': scanned_count
+            def report_progress(sent=None):
+                if sent is not None:
+                    SCAN_ADDRESSES.inc(amount=sent - stages['swept'])
+                    stages['swept'] = sent
+                event_bus.publish(channel, {
+                    'type': 'progress',
+                    'scanned': stages['swept'],
+                    'total': total_ips,
+                    'found': stages['found'],
+                    'stages': dict(stages)
                 })
-            except Exception as e:
-                logger.error(f"Błąd bazy danych: {str(e)}")
-                db.session.rollback()
-                scan_progress_queue.put({
-                    'type': 'error',
-                    'error': f'Błąd bazy danych: {str(e)}'
+            
+            if scan_mode == 'snmp':
+                # Jeden przebieg UDP/161: odpowiedź agenta oznacza dostępność i obsługę SNMP jednocześnie
+                agents = BoundedStage(discover_snmp_agents(network.hosts(), community, progress_callback=report_progress,
+                                                           family=address_family(network)))
+                
+                def scan_results():
+                    for batch in agents.batches(SCAN_BATCH_SIZE):
+                        stages['alive'] += len(batch)
+                        stages['probed'] += len(batch)
+                        yield batch
+            else:
+                sweeper = Sweeper(progress_callback=report_progress, family=address_family(network))
+                live_ips = BoundedStage(sweeper.sweep(network.hosts()))
+                
+                def scan_results():
+                    for batch in live_ips.batches(SCAN_BATCH_SIZE):
+                        stages['alive'] += len(batch)
+                        results = list(probe_snmp_agents([batch], community))
+                        stages['probed'] += len(batch)
+                        yield results
+            
+            for batch in scan_results():
+                start = time.perf_counter()
+                new_ips = save_scan_batch(batch, community)
+                DB_FLUSH_SECONDS.observe(time.perf_counter() - start, 'scan')
+                SCAN_FOUND.inc(amount=len(new_ips))
+                found_devices.extend(new_ips)
+                stages['found'] += len(new_ips)
+                event_bus.publish(channel, {
+                    'type': 'active_ips',
+                    'count': stages['alive'],
+                    'total': total_ips
                 })
+                report_progress()
+            
+            event_bus.publish(channel, {
+                'type': 'complete',
+                'message': f'Znaleziono {len(found_devices)} nowych urządzeń',
+                'devices': found_devices,
+                'total_ips': total_ips,
+                'active_ips': stages['alive'],
+                'scanned': stages['probed'],
+                'stages': dict(stages)
+            })
                 
         except Exception as e:
             logger.error(f"Nieoczekiwany błąd w scan_range_worker: {str(e)}")
-            scan_progress_queue.put({
+            db.session.rollback()
+            event_bus.publish(channel, {
                 'type': 'error',
                 'error': f'Nieoczekiwany błąd: {str(e)}'
             })
+        finally:
+            event_bus.finish(channel)
 
 @app.route('/scan_range', methods=['POST'])
 def scan_range():
+    global latest_scan_job
     try:
         ip_range = request.form.get('ip_range')
         community = request.form.get('snmp_community', 'public')
+        scan_mode = request.form.get('scan_mode', 'snmp')
         
         if not ip_range:
             return jsonify({'error': 'Zakres IP jest wymagany'}), 400
+        if scan_mode not in ('snmp', 'ping'):
+            return jsonify({'error': 'Nieprawidłowy tryb skanowania'}), 400
             
-        # Rozpocznij skanowanie w wątku w tle
-        thread = threading.Thread(target=scan_range_worker, args=(ip_range, community))
+        # Rozpocznij skanowanie w wątku w tle; postęp trafia do kanału zadania
+        job_id = uuid.uuid4().hex
+        event_bus.publish(scan_channel(job_id), {'type': 'started', 'ip_range': ip_range, 'scan_mode': scan_mode})
+        latest_scan_job = job_id
+        thread = threading.Thread(target=scan_range_worker, args=(ip_range, community, scan_mode, job_id))
         thread.daemon = True
         thread.start()
         
-        return jsonify({'message': 'Skanowanie rozpoczęte'})
+        return jsonify({'message': 'Skanowanie rozpoczęte', 'job_id': job_id})
             
     except Exception as e:
         logger.error(f"Błąd rozpoczynania skanowania: {str(e)}")
         return jsonify({'error': f'Błąd rozpoczynania skanowania: {str(e)}'}), 500
 
+def last_event_id():
+    """Id ostatniego odebranego zdarzenia przy ponownym połączeniu EventSource (nagłówek Last-Event-ID)"""
+    try:
+        return int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        return None
+
+def event_stream(subscription, until=()):
+    """Strumień SSE z subskrypcji szyny zdarzeń; kończy się po zdarzeniu typu z until lub zamknięciu kanału"""
+    stream = subscription.channel.split('/')[0]
+    
+    def generate():
+        SSE_STREAMS.inc(stream)
+        try:
+            with subscription:
+                while True:
+                    item = subscription.get(timeout=SSE_HEARTBEAT)
+                    if item is None:
+                        if subscription.closed:
+                            break
+                        # Brak zdarzeń przez SSE_HEARTBEAT sekund, wyślij heartbeat
+                        yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
+                        continue
+                    event_id, event = item
+                    yield f"id: {event_id}\ndata: {json.dumps(event)}\n\n"
+                    if event['type'] in until:
+                        break
+        finally:
+            SSE_STREAMS.dec(stream)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/scan_progress')
 def scan_progress():
-    def generate():
-        while True:
-            try:
-                # Pobierz aktualizację postępu z kolejki
-                progress = scan_progress_queue.get(timeout=30)
-                yield f"data: {json.dumps(progress)}\n\n"
-                
-                # Jeśli skanowanie jest zakończone lub wystąpił błąd, zatrzymaj wysyłanie aktualizacji
-                if progress['type'] in ['complete', 'error']:
-                    break
-                    
-            except queue.Empty:
-                # Brak aktualizacji przez 30 sekund, wyślij heartbeat
-                yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-                
-    return Response(generate(), mimetype='text/event-stream')
+    """Postęp skanowania ?job=<id zadania> (domyślnie ostatniego) - każdy subskrybent dostaje wszystkie zdarzenia"""
+    job_id = request.args.get('job', latest_scan_job)
+    if job_id is None or scan_channel(job_id) not in event_bus:
+        return jsonify({'error': 'Nieznane zadanie skanowania'}), 404
+    subscription = event_bus.subscribe(scan_channel(job_id), last_event_id())
+    return event_stream(subscription, until=('complete', 'error'))
+
+@app.route('/device_events')
+def device_events():
+    """
+    Strumień zdarzeń urządzeń dla panelu: devices (zmienione kolumny), status (zmiana statusu),
+    added, deleted, interval. Tylko nowe zdarzenia, chyba że klient wznawia połączenie
+    (nagłówek Last-Event-ID) albo podaje ?after=<id> - id zdarzenia z chwili wyrenderowania strony
+    """
+    last_id = last_event_id()
+    if last_id is None:
+        last_id = request.args.get('after', type=int)
+    return event_stream(event_bus.subscribe(DEVICE_CHANNEL, last_id, replay=False))
 
 @app.route('/check_status/<int:device_id>')
 def check_status(device_id):
     """Sprawdza status konkretnego urządzenia"""
     device = Device.query.get_or_404(device_id)
     try:
-        is_active = check_device_status(device.ip_address, device.snmp_community)
-        device.status = 'active' if is_active else 'inactive'
-        
-        # Jeśli urządzenie jest aktywne, spróbuj pobrać jego nazwę i metryki
-        if is_active:
-            # Pobierz nazwę urządzenia jeśli jest nieznana
-            if device.name == 'Unknown':
-                try:
-                    device_name = get_device_name(device.ip_address, device.snmp_community)
-                    if device_name:
-                        device.name = device_name
-                except Exception as e:
-                    logging.error(f"Błąd pobierania nazwy urządzenia dla {device.ip_address}: {str(e)}")
-            
-            # Pobierz metryki systemowe
-            try:
-                metrics = get_system_metrics(device.ip_address, device.snmp_community)
-                if metrics:
-                    device.uptime = metrics.get('uptime')
-                    device.cpu_usage = metrics.get('cpu_usage')
-                    device.memory_used = metrics.get('memory_used')
-                    device.memory_total = metrics.get('memory_total')
-            except Exception as e:
-                logging.error(f"Błąd pobierania metryk dla {device.ip_address}: {str(e)}")
+        # Wynik sprzed chwili (np. zapisany przez poller w osobnym procesie) - bez ponownego odpytania
+        if device.last_checked is not None:
+            age = (datetime.now() - device.last_checked.replace(tzinfo=None)).total_seconds()
+            if 0 <= age < get_config_value('poll_cache_ttl'):
+                return jsonify({'status': 'success', 'message': f'Urządzenie {device.ip_address} jest {device.status}'})
         
-        device.last_checked = get_local_time()
-        db.session.commit()
-        return jsonify({'status': 'success', 'message': f'Urządzenie {device.ip_address} jest {device.status}'})
+        results, _ = poll_targets([device])
+        result = results[device.id]
+        checked_at = get_local_time()
+        if not result.get('cached'):
+            apply_poll_result(device, result)
+            device.last_checked = checked_at
+            db.session.commit()
+            publish_device_deltas([device_values(device)])
+            record_metrics_history(results, checked_at)
+            record_interface_rates(results, checked_at)
+        if scheduler.complete(device.id, result['active']):
+            publish_status_changes([device], results, checked_at)
+        status = 'active' if result['active'] else 'inactive'
+        return jsonify({'status': 'success', 'message': f'Urządzenie {device.ip_address} jest {status}'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
+def fleet_etag():
+    """
+    ETag stanu urządzeń: każda zmiana urządzeń, w którymkolwiek procesie, trafia do dziennika zdarzeń,
+    więc id ostatniego zdarzenia jest wspólnym dla wszystkich procesów licznikiem zmian floty. Proces zna
+    je bez odpytywania bazy: to nowsze z id odczytanego przez event_relay (zmiany innych procesów, z
+    opóźnieniem do RELAY_INTERVAL) i id ostatniego zdarzenia zapisanego przez event_forwarder.
+    Dopóki zdarzenia tego procesu czekają na zapis, ETag jest jednorazowy (odpowiedź nie może być 304);
+    zdarzenia utracone przy przepełnieniu kolejki zapisu zmieniają ETag tego procesu na stałe
+    """
+    etag = str(max(event_relay.position, event_forwarder.written))
+    if event_forwarder.dropped:
+        etag += f'-{BOOT_ID}.{event_forwarder.dropped}'
+    if event_forwarder.pending:
+        etag += f'-{BOOT_ID}-{event_bus.last_id(DEVICE_CHANNEL)}'
+    return etag
+
+@app.route('/api/devices')
+def api_devices():
+    """
+    Strona urządzeń w JSON: ?limit= (domyślnie 100, maks. 1000), &after=<kursor 'next' poprzedniej strony>,
+    &sort=ip_address|name|status|cpu_usage|last_checked|id, &order=asc|desc, filtry &status=, &name=
+    (prefiks), &ip= (prefiks), &subnet= (CIDR), &cpu_min=, &fields= (lista kolumn), &count=1 (liczba wszystkich).
+    Gdy od poprzedniego odczytu nic się nie zmieniło, odpowiedź 304 nie odpytuje bazy (If-None-Match)
+    """
+    etag = fleet_etag()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        try:
+            result = device_query.query_devices(request.args)
+        except ValueError as e:
+            return jsonify({'error': f'Nieprawidłowy parametr: {e}'}), 400
+        result['devices'] = [device_delta(row) for row in result['devices']]
+        response = jsonify(result)
+    response.set_etag(etag)
+    # Przeglądarka zawsze pyta serwer o ważność (tanie 304 zamiast nieaktualnych danych z cache)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/device/<int:device_id>/metrics')
+def device_metrics(device_id):
+    """Historia metryk urządzenia: ?from=&to= (sekundy epoki, domyślnie ostatnie 24h), &step= (sekundy)"""
+    Device.query.get_or_404(device_id)
+    try:
+        end = int(request.args.get('to', time.time()))
+        start = int(request.args.get('from', end - 24 * 3600))
+        step = int(request.args['step']) if request.args.get('step') else None
+    except ValueError:
+        return jsonify({'error': 'Parametry from, to i step muszą być liczbami całkowitymi'}), 400
+    if start >= end or (step is not None and step <= 0):
+        return jsonify({'error': 'Nieprawidłowy zakres czasu'}), 400
+    return jsonify(metrics_store.query_metrics(device_id, start, end, step))
+
+@app.route('/device/<int:device_id>/interfaces')
+def device_interfaces(device_id):
+    """Przepływności interfejsów urządzenia (b/s, pakiety/s): ?from=&to= (sekundy epoki, domyślnie ostatnia godzina)"""
+    Device.query.get_or_404(device_id)
+    try:
+        end = int(request.args.get('to', time.time()))
+        start = int(request.args.get('from', end - 3600))
+    except ValueError:
+        return jsonify({'error': 'Parametry from i to muszą być liczbami całkowitymi'}), 400
+    if start >= end:
+        return jsonify({'error': 'Nieprawidłowy zakres czasu'}), 400
+    return jsonify(metrics_store.query_interface_rates(device_id, start, end))
+
 @app.route('/delete_device/<int:device_id>', methods=['POST'])
 def delete_device(device_id):
     device = Device.query.get_or_404(device_id)
     db.session.delete(device)
+    metrics_store.delete_history([device_id])
     db.session.commit()
+    counter_store.forget([device_id])
+    device_profiles.pop(device_id, None)
+    session_pool.invalidate(device.ip_address)
+    publish_device_event({'type': 'deleted', 'ids': [device_id]})
     return jsonify({'message': 'Urządzenie zostało usunięte pomyślnie'})
 
 @app.route('/delete_devices', methods=['POST'])
@@ -425,34 +1027,127 @@ def delete_devices():
     if not device_ids:
         return jsonify({'error': 'Nie wybrano żadnych urządzeń'}), 400
     
+    ips = [ip for (ip,) in db.session.query(Device.ip_address).filter(Device.id.in_(device_ids))]
     Device.query.filter(Device.id.in_(device_ids)).delete(synchronize_session=False)
+    metrics_store.delete_history(device_ids)
     db.session.commit()
+    counter_store.forget(device_ids)
+    for device_id in device_ids:
+        device_profiles.pop(device_id, None)
+    for ip in ips:
+        session_pool.invalidate(ip)
+    publish_device_event({'type': 'deleted', 'ids': device_ids})
     return jsonify({'message': f'Pomyślnie usunięto {len(device_ids)} urządzeń'})
 
-@app.route('/check_all_devices_now')
-def check_all_devices_now():
-    devices = Device.query.all()
-    for device in devices:
-        try:
-            status = check_device_status(device.ip_address, device.snmp_community)
-            device.status = 'active' if status else 'inactive'
-            device.last_checked = get_local_time()
-            
-            # Spróbuj pobrać nazwę urządzenia jeśli status jest aktywny
-            if status and (not device.name or device.name == 'Unknown'):
-                try:
-                    name = get_device_name(device.ip_address, device.snmp_community)
-                    if name:
-                        device.name = name
-                except Exception as e:
-                    logger.error(f"Błąd pobierania nazwy urządzenia: {str(e)}")
-        except Exception as e:
-            logger.error(f"Błąd sprawdzania urządzenia {device.ip_address}: {str(e)}")
-            device.status = 'inactive'
-            device.last_checked = get_local_time()
+@app.route('/devices/import', methods=['POST'])
+def import_devices():
+    """
+    Import urządzeń strumieniowo z treści żądania: CSV z nagłówkiem (ip_address, name, snmp_community)
+    lub NDJSON (?format=csv|ndjson albo Content-Type). Wiersze są sprawdzane, adresy powtórzone
+    i już istniejące pomijane, a nowe urządzenia zapisywane partiami po db_batch_size.
+    ?community= - społeczność wierszy bez własnej (domyślnie public); ?verify=1 - sprawdzenie
+    dostępności nowych urządzeń w tle (stan: /jobs/<job_id>, postęp SSE: /check_progress?job=<job_id>)
+    """
+    fmt = device_io.detect_format(request.args.get('format'), request.content_type)
+    if fmt is None:
+        return jsonify({'error': 'Nieobsługiwany format - użyj CSV lub NDJSON (?format=csv|ndjson)'}), 415
+    importer = device_io.DeviceImport(request.args.get('community', 'public'), get_config_value('db_batch_size'))
+    added_ids = []
+    try:
+        for added in importer.batches(device_io.read_records(request.stream, fmt)):
+            added_ids.extend(row['id'] for row in added)
+            publish_device_event({'type': 'added', 'devices': [device_delta(row) for row in added]})
+    except ValueError as e:
+        # Zapisane wcześniej partie zostają w bazie - odpowiedź podaje, ile ich było
+        logger.error(f"Przerwano import urządzeń: {str(e)}")
+        return jsonify(dict(importer.summary(), error=f'Nieprawidłowe dane wejściowe: {e}')), 400
+    summary = importer.summary()
+    logger.info(f"Import urządzeń: odczytano {summary['received']}, dodano {summary['added']}, "
+                f"pominięto powtórzone: {summary['duplicates']}, błędne: {summary['invalid']}")
     
-    db.session.commit()
-    return redirect(url_for('index'))
+    job_id = None
+    if added_ids and request.args.get('verify') in ('1', 'true'):
+        with check_jobs_lock:
+            job_id = create_check_job('import')
+        thread = threading.Thread(target=check_all_devices, args=(job_id, added_ids))
+        thread.daemon = True
+        thread.start()
+    return jsonify(dict(summary, job_id=job_id)), 202 if job_id else 200
+
+@app.route('/devices/export')
+def export_devices():
+    """
+    Eksport urządzeń strumieniowo (partiami z bazy, bez wczytywania całej tabeli): ?format=csv|ndjson
+    (domyślnie csv), filtry &status=, &subnet= (CIDR). Wynik CSV można ponownie zaimportować
+    """
+    fmt = request.args.get('format', 'csv')
+    status = request.args.get('status')
+    subnet = request.args.get('subnet')
+    if fmt not in device_io.FORMATS:
+        return jsonify({'error': 'Nieprawidłowy parametr: format'}), 400
+    if status is not None and status not in device_query.STATUSES:
+        return jsonify({'error': 'Nieprawidłowy parametr: status'}), 400
+    if subnet is not None:
+        try:
+            device_query.subnet_condition(subnet)
+        except ValueError:
+            return jsonify({'error': 'Nieprawidłowy parametr: subnet'}), 400
+    chunks = device_io.export_chunks(device_io.export_rows(status=status, subnet=subnet), fmt)
+    response = Response(stream_with_context(chunks), content_type=device_io.FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=devices.{fmt}'
+    return response
+
+@app.route('/check_all_devices_now', methods=['POST'])
+def check_all_devices_now():
+    """
+    Uruchamia sprawdzenie wszystkich urządzeń w tle i od razu zwraca id zadania.
+    Jeśli sprawdzenie już trwa, zwraca id trwającego zadania
+    """
+    global running_check_job
+    with check_jobs_lock:
+        if running_check_job is not None:
+            return jsonify({'message': 'Sprawdzanie urządzeń już trwa', 'job_id': running_check_job}), 202
+        job_id = running_check_job = create_check_job()
+    event_bus.publish(check_channel(job_id), {'type': 'started'})
+    thread = threading.Thread(target=check_all_worker, args=(job_id,))
+    thread.daemon = True
+    thread.start()
+    return jsonify({'message': 'Sprawdzanie urządzeń rozpoczęte', 'job_id': job_id}), 202
+
+@app.route('/check_progress')
+def check_progress():
+    """Postęp sprawdzenia wszystkich urządzeń ?job=<id zadania> - zdarzenia progress, complete lub error"""
+    job_id = request.args.get('job')
+    if job_id is None or check_channel(job_id) not in event_bus:
+        return jsonify({'error': 'Nieznane zadanie'}), 404
+    subscription = event_bus.subscribe(check_channel(job_id), last_event_id())
+    return event_stream(subscription, until=('complete', 'error'))
+
+@app.route('/metrics')
+def metrics():
+    """Liczniki i histogramy pollera, skanowania, zapisów do bazy i strumieni SSE w formacie tekstowym Prometheusa"""
+    return Response(instrumentation.REGISTRY.render(), content_type=instrumentation.CONTENT_TYPE)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Stan zadania sprawdzenia: status, total, completed, failed, remaining, elapsed i eta (sekundy)"""
+    with check_jobs_lock:
+        job = check_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Nieznane zadanie'}), 404
+    return jsonify(check_job_status(job))
+
+def main():
+    configure_logging()
+    init_db()
+    # Reloader trybu debug uruchamia skrypt w dwóch procesach - poller startuje tylko w procesie obsługującym żądania.
+    # Jeśli działa już samodzielny poller (python -m poller), ten czeka na przejęcie blokady lidera
+    if get_config_value('embedded_poller') and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        import poller
+        poller.start_embedded()
+    app.run(debug=True)
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    # Uruchom moduł zaimportowany pod własną nazwą - poller importuje "app" i musi widzieć te same obiekty
+    import app as web
+    web.main() 
\ No newline at end of file
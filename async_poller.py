@@ -0,0 +1,414 @@
+import asyncio
+import collections
+import logging
+import socket
+import time
+
+import device_profile
+import snmp_operations
+from instrumentation import POLL_ERRORS, SNMP_REQUEST_SECONDS, SNMP_TIMEOUTS
+from snmp_operations import (COUNTER_COLUMNS, HC_COUNTER_COLUMNS, METRIC_COLUMNS, POLL_MAX_REPETITIONS,
+                             POLL_SCALARS, STATUS_OIDS, NO_VALUE_TYPES, UPTIME_OID, TableWalk, build_poll_result,
+                             decode_response, encode_get_request, error_status_name,
+                             inactive_poll_result, interface_counters, next_request_id,
+                             resolve_names, walk_result)
+
+logger = logging.getLogger(__name__)
+
+# pysnmp 4.4's asyncio hlapi still uses @asyncio.coroutine and cannot be
+# imported on Python 3.11+, so requests are encoded with the raw codec from
+# snmp_operations and sent over a plain asyncio datagram endpoint instead.
+
+# Receive buffer large enough to absorb a burst of responses from many devices
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Requests in flight start at MIN_IN_FLIGHT and are then capped by the
+# measured CPU cost of an exchange, so that the responses of all requests
+# in flight can be handled within LOAD_FACTOR of the timeout
+MIN_IN_FLIGHT = 8
+LOAD_FACTOR = 0.5
+
+# Exchanges per CPU cost sample
+COST_WINDOW = 16
+
+class SnmpEndpoint:
+    """
+    Non-blocking UDP socket matching incoming responses to pending requests by request-id
+
+    The socket is read until it is empty on every wakeup (asyncio's datagram
+    transport reads one datagram per loop iteration) and drained again
+    before a request is expired, so a response that has already arrived is
+    never counted as a timeout just because the loop was busy.
+    """
+    def __init__(self, family, loop):
+        self.loop = loop
+        self.pending = {}
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        self.sock.setblocking(False)
+        self.sock.bind(('::' if family == socket.AF_INET6 else '0.0.0.0', 0))
+        loop.add_reader(self.sock, self.drain)
+
+    def drain(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.debug(f"SNMP socket error: {e}")
+                return
+            self._dispatch(data, addr)
+
+    def _dispatch(self, data, addr):
+        try:
+            request_id, error_status, var_binds = decode_response(data)
+        except Exception as e:
+            logger.debug(f"Dropping undecodable datagram from {addr[0]}: {str(e)}")
+            return
+        entry = self.pending.get(request_id)
+        if entry is None:
+            return
+        future, address = entry
+        if addr[:2] != address or future.done():
+            return
+        future.set_result((error_status, var_binds))
+
+    def _expire(self, future):
+        self.drain()
+        if not future.done():
+            future.set_result(None)
+
+    async def exchange(self, request_id, data, address, timeout):
+        """
+        Send one request and wait for its response: (error_status, var_binds),
+        or None on timeout. The timeout runs from the moment the kernel takes the datagram
+        """
+        future = self.loop.create_future()
+        self.pending[request_id] = (future, address)
+        try:
+            try:
+                await self.loop.sock_sendto(self.sock, data, address)
+            except OSError as e:
+                logger.debug(f"Could not send to {address[0]}: {e}")
+                return None
+            timer = self.loop.call_later(timeout, self._expire, future)
+            try:
+                return await future
+            finally:
+                timer.cancel()
+        finally:
+            self.pending.pop(request_id, None)
+
+    def close(self):
+        self.loop.remove_reader(self.sock)
+        self.sock.close()
+
+class LoadLimit:
+    """
+    Async context manager admitting a number of tasks adapted to their CPU cost
+
+    The limit starts at MIN_IN_FLIGHT and is recomputed every COST_WINDOW
+    exchanges from the process CPU time they took: no more tasks run than
+    the loop can serve within budget seconds if all their responses arrive
+    at once, and never more than maximum.
+    """
+    def __init__(self, maximum, budget):
+        self.maximum = maximum
+        self.budget = budget
+        self.limit = min(MIN_IN_FLIGHT, maximum)
+        self.active = self.peak = 0
+        self._waiters = collections.deque()
+        self._exchanges = 0
+        self._sampled = 0
+        self._cpu = time.process_time()
+
+    async def __aenter__(self):
+        while self.active >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done():
+                    self._wake()  # pass the wakeup on
+                else:
+                    self._waiters.remove(waiter)
+                raise
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        free = self.limit - self.active
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def update(self, exchanges):
+        """
+        Account for the client's total exchange count so far and adapt the limit
+        """
+        if exchanges - self._sampled < COST_WINDOW:
+            return
+        now = time.process_time()
+        cost = (now - self._cpu) / (exchanges - self._sampled)
+        self._cpu, self._sampled = now, exchanges
+        self.limit = max(1, min(self.maximum, int(self.budget / cost) if cost > 0 else self.maximum))
+        self._wake()
+
+class AsyncSnmpClient:
+    """
+    Non-blocking SNMPv2c GET client sharing one UDP socket per address family
+    """
+    def __init__(self, timeout=1, retries=0, port=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.port = port
+        self.exchanges = 0
+        self._endpoints = {}
+
+    def _endpoint(self, family):
+        endpoint = self._endpoints.get(family)
+        if endpoint is None:
+            endpoint = self._endpoints[family] = SnmpEndpoint(family, asyncio.get_running_loop())
+        return endpoint
+
+    def close(self):
+        for endpoint in self._endpoints.values():
+            endpoint.close()
+        self._endpoints.clear()
+
+    async def _exchange(self, ip, encode, group):
+        """
+        Send encode(request_id) with retries; returns (error_status, var_binds) or None on timeout.
+        Latency and timeouts are recorded under the request's OID group
+        """
+        address = (ip, self.port or snmp_operations.SNMP_PORT)
+        endpoint = self._endpoint(socket.AF_INET6 if ':' in ip else socket.AF_INET)
+
+        for _ in range(self.retries + 1):
+            request_id = next_request_id()
+            data = encode(request_id)
+            start = time.perf_counter()
+            response = await endpoint.exchange(request_id, data, address, self.timeout)
+            self.exchanges += 1
+            if response is not None:
+                SNMP_REQUEST_SECONDS.observe(time.perf_counter() - start, group)
+                return response
+            SNMP_TIMEOUTS.inc(group)
+        return None
+
+    async def get_values(self, ip, community, oids, group='get'):
+        """
+        Asynchronous counterpart of snmp_operations.snmp_get_values
+        """
+        object_names = {oid: name for oid, name in resolve_names(oids).items() if name}
+        response = await self._exchange(
+            ip, lambda request_id: encode_get_request(request_id, community, object_names.values()), group)
+        if response is None:
+            return 'No SNMP response received before timeout', None
+
+        error_status, var_binds = response
+        if error_status:
+            POLL_ERRORS.inc(error_status_name(error_status))
+            return error_status_name(error_status), {}
+        values = dict.fromkeys(oids)
+        for oid, (_, value) in zip(object_names, var_binds):
+            if not isinstance(value, NO_VALUE_TYPES):
+                values[oid] = value
+        return None, values
+
+    async def _run_walk(self, ip, community, walk, group):
+        """
+        Drive a TableWalk; returns (error_indication, error_status) like snmp_operations.run_walk
+        """
+        while not walk.done:
+            response = await self._exchange(ip, lambda request_id: walk.request(request_id, community), group)
+            if response is None:
+                return 'No SNMP response received before timeout', None
+            if response[0]:
+                error_status = error_status_name(response[0])
+                POLL_ERRORS.inc(error_status)
+                return None, error_status
+            walk.feed(response[1])
+        return None, None
+
+    async def walk(self, ip, community, columns, scalars=(), max_repetitions=snmp_operations.MAX_REPETITIONS,
+                   bulk=True, group='walk'):
+        """
+        Asynchronous counterpart of snmp_operations.snmp_walk
+        """
+        column_names, scalar_names = resolve_names(columns), resolve_names(scalars)
+        walk = TableWalk([name for name in column_names.values() if name],
+                         [name for name in scalar_names.values() if name], max_repetitions, bulk)
+        error_indication, error_status = await self._run_walk(ip, community, walk, group)
+        return walk_result(error_indication, error_status, walk, column_names, scalar_names)
+
+    async def poll_device(self, ip, community='public', counters=False, profile=None):
+        """
+        Asynchronous counterpart of snmp_operations.poll_device
+
+        With a usable capability profile (see device_profile) only the
+        profiled instances and the working counter table are fetched, so no
+        request is spent on MIBs the device lacks. Without one, or when the
+        device no longer matches it (reboot, firmware change, missing rows),
+        the full walk runs and the profile learned from it is returned in
+        result['profile']. The profile's last seen uptime is updated in place.
+        """
+        if device_profile.usable(profile, counters):
+            result = await self._poll_profiled(ip, community, counters, profile)
+            if result is not None:
+                return result
+        return await self._poll_learning(ip, community, counters)
+
+    async def _poll_profiled(self, ip, community, counters, profile):
+        """
+        Poll with a profile; returns None if the profile no longer matches the device
+        """
+        if not profile['walk']:
+            error, values = await self.get_values(ip, community, STATUS_OIDS, group='status')
+            return inactive_poll_result() if error else build_poll_result(ip, values)
+        instances, columns = device_profile.request(profile, counters)
+        column_names = resolve_names(columns)
+        walk = TableWalk([name for name in column_names.values() if name], list(instances), POLL_MAX_REPETITIONS)
+        error_indication, error_status = await self._run_walk(ip, community, walk, 'profiled')
+        if error_indication:
+            return inactive_poll_result()
+        if error_status:
+            return None
+        rows = {column: walk.rows.get(name, {}) for column, name in column_names.items()}
+        values, rows = device_profile.values_and_rows(instances, walk.values, rows)
+        if not device_profile.matches(profile, values, rows):
+            logger.debug(f"Capability profile of {ip} is stale, learning it again")
+            return None
+        if values.get(UPTIME_OID) is not None:
+            profile['uptime'] = int(values[UPTIME_OID])
+        result = build_poll_result(ip, values, rows)
+        if counters:
+            result['counters'] = None
+            if columns:
+                result['counters'] = interface_counters(values, rows, device_profile.COUNTER_TABLES[profile['counters']])
+                if result['counters'] is None:
+                    return None
+        return result
+
+    async def _poll_learning(self, ip, community, counters):
+        """
+        Full poll walk (every supported MIB and counter table) that also learns the device's profile
+        """
+        columns = METRIC_COLUMNS + (list(HC_COUNTER_COLUMNS) if counters else [])
+        error, values, rows = await self.walk(ip, community, columns, POLL_SCALARS + [device_profile.SYS_OBJECT_ID],
+                                              max_repetitions=POLL_MAX_REPETITIONS, group='poll')
+        if error and values is None:
+            return inactive_poll_result()
+        if error:
+            # Some agents reject the walk as a whole - fall back to a plain status probe
+            error, values = await self.get_values(ip, community, STATUS_OIDS, group='status')
+            if error:
+                return inactive_poll_result()
+            result = build_poll_result(ip, values)
+            result['profile'] = device_profile.learn(values, {}, 'none' if counters else None, walk=False)
+            return result
+        result = build_poll_result(ip, values, rows)
+        counter_table = None
+        if counters:
+            result['counters'] = interface_counters(values, rows, HC_COUNTER_COLUMNS)
+            counter_table = 'hc'
+            if result['counters'] is None:
+                # No ifXTable - fall back to the 32-bit ifTable counters
+                counter_table = None  # unknown until the fallback walk answers
+                error, _, counter_rows = await self.walk(ip, community, COUNTER_COLUMNS, group='counters')
+                if not error:
+                    result['counters'] = interface_counters(values, counter_rows, COUNTER_COLUMNS)
+                    counter_table = 'none' if result['counters'] is None else 'if'
+        result['profile'] = device_profile.learn(values, rows, counter_table)
+        return result
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class AsyncPoller:
+    """
+    Poll many devices concurrently with a bounded number of requests in flight
+
+    Each device has at most one request in flight. concurrency is the upper
+    bound; the number actually polled at once follows the CPU cost of the
+    exchanges (see LoadLimit), so responses are not left waiting behind the
+    decoding of others until their requests time out.
+    """
+    def __init__(self, concurrency=100, deadline=5, timeout=1, retries=0, port=None, counters=False):
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.counters = counters
+        self.client = AsyncSnmpClient(timeout=timeout, retries=retries, port=port)
+        self.limit = LoadLimit(concurrency, timeout * LOAD_FACTOR)
+
+    async def _poll_one(self, key, ip, community, profile, results, latencies, counters):
+        async with self.limit:
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(self.client.poll_device(ip, community, self.counters, profile),
+                                              self.deadline)
+                if not result['active']:
+                    counters['timeouts'] += 1
+                    POLL_ERRORS.inc('timeout')
+            except asyncio.TimeoutError:
+                logger.debug(f"Poll deadline exceeded for {ip}")
+                result = inactive_poll_result()
+                counters['timeouts'] += 1
+                POLL_ERRORS.inc('deadline')
+            except Exception as e:
+                logger.error(f"Error polling {ip}: {str(e)}")
+                result = inactive_poll_result()
+                counters['errors'] += 1
+                POLL_ERRORS.inc(type(e).__name__)
+            latencies.append(time.perf_counter() - start)
+            results[key] = result
+            self.limit.update(self.client.exchanges)
+
+    async def poll(self, targets):
+        """
+        Poll (key, ip, community[, profile]) targets and return (results, cycle_report)
+
+        results maps each key to a poll_device()-style dict; profile is the
+        device's capability profile (see device_profile), if known.
+        """
+        results, latencies = {}, []
+        counters = {'timeouts': 0, 'errors': 0}
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(
+                self._poll_one(key, ip, community, profile[0] if profile else None,
+                               results, latencies, counters)
+                for key, ip, community, *profile in targets
+            ))
+        finally:
+            self.client.close()
+
+        latencies.sort()
+        report = {
+            'devices': len(results),
+            'duration': time.perf_counter() - start,
+            'p50_latency': _percentile(latencies, 0.5),
+            'p99_latency': _percentile(latencies, 0.99),
+            'timeouts': counters['timeouts'],
+            'errors': counters['errors'],
+            'concurrency': self.limit.peak,
+        }
+        return results, report
+
+def poll_devices(targets, concurrency=100, deadline=5, timeout=1, retries=0, port=None, counters=False):
+    """
+    Blocking entry point: poll all targets on a private event loop
+    """
+    poller = AsyncPoller(concurrency=concurrency, deadline=deadline,
+                         timeout=timeout, retries=retries, port=port, counters=counters)
+    return asyncio.run(poller.poll(targets))
@@ -0,0 +1,233 @@
+"""
+Minimal SNMPv2c agent on loopback used by the benchmarks
+"""
+import bisect
+import socket
+import threading
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api, rfc1902
+
+HR_STORAGE_RAM = '1.3.6.1.2.1.25.2.1.2'
+HR_STORAGE_VIRTUAL_MEMORY = '1.3.6.1.2.1.25.2.1.3'
+HR_STORAGE_FIXED_DISK = '1.3.6.1.2.1.25.2.1.4'
+
+DEFAULT_OIDS = {
+    '1.3.6.1.2.1.1.1.0': api.v2c.OctetString('Linux bench-agent 6.1.0 x86_64'),
+    '1.3.6.1.2.1.1.2.0': api.v2c.ObjectIdentifier('1.3.6.1.4.1.8072.3.2.10'),
+    '1.3.6.1.2.1.1.3.0': api.v2c.TimeTicks(123456789),
+    '1.3.6.1.2.1.1.5.0': api.v2c.OctetString('bench-agent'),
+    '1.3.6.1.2.1.1.6.0': api.v2c.OctetString('loopback'),
+    '1.3.6.1.4.1.2021.4.5.0': api.v2c.Integer(16318440),
+    '1.3.6.1.4.1.2021.4.6.0': api.v2c.Integer(9542180),
+    '1.3.6.1.4.1.2021.11.9.0': api.v2c.Integer(12),
+    '1.3.6.1.4.1.2021.11.10.0': api.v2c.Integer(4),
+}
+
+def host_tables(processors=2, disks=1):
+    """
+    hrProcessorTable and hrStorageTable rows laid out like net-snmp's
+    (processors indexed from 196608, RAM at index 1, disks from 31)
+    """
+    oids = {}
+    for n in range(processors):
+        oids[f'1.3.6.1.2.1.25.3.3.1.2.{196608 + n}'] = api.v2c.Integer(17 + 6 * (n % 2))
+    storage = [(1, HR_STORAGE_RAM, 'Physical memory', 1024, 16318440, 9542180),
+               (3, HR_STORAGE_VIRTUAL_MEMORY, 'Virtual memory', 1024, 20512740, 9842180)]
+    storage += [(31 + n, HR_STORAGE_FIXED_DISK, f'/data{n}' if n else '/', 4096, 61202432, 20480000)
+                for n in range(disks)]
+    for index, storage_type, descr, units, size, used in storage:
+        oids[f'1.3.6.1.2.1.25.2.3.1.1.{index}'] = api.v2c.Integer(index)
+        oids[f'1.3.6.1.2.1.25.2.3.1.2.{index}'] = api.v2c.ObjectIdentifier(storage_type)
+        oids[f'1.3.6.1.2.1.25.2.3.1.3.{index}'] = api.v2c.OctetString(descr)
+        oids[f'1.3.6.1.2.1.25.2.3.1.4.{index}'] = api.v2c.Integer(units)
+        oids[f'1.3.6.1.2.1.25.2.3.1.5.{index}'] = api.v2c.Integer(size)
+        oids[f'1.3.6.1.2.1.25.2.3.1.6.{index}'] = api.v2c.Integer(used)
+    return oids
+
+def interface_tables(interfaces=2):
+    """
+    ifTable and ifXTable rows for the given number of interfaces
+    """
+    oids = {}
+    for index in range(1, interfaces + 1):
+        name = 'lo' if index == 1 else f'eth{index - 2}'
+        octets = index * 1000003
+        columns = {
+            # ifTable
+            '1.3.6.1.2.1.2.2.1.1': api.v2c.Integer(index),
+            '1.3.6.1.2.1.2.2.1.2': api.v2c.OctetString(name),
+            '1.3.6.1.2.1.2.2.1.3': api.v2c.Integer(24 if index == 1 else 6),
+            '1.3.6.1.2.1.2.2.1.5': api.v2c.Gauge32(1000000000),
+            '1.3.6.1.2.1.2.2.1.8': api.v2c.Integer(1),
+            '1.3.6.1.2.1.2.2.1.10': api.v2c.Counter32(octets % 2 ** 32),
+            '1.3.6.1.2.1.2.2.1.11': api.v2c.Counter32(octets // 1000 % 2 ** 32),
+            '1.3.6.1.2.1.2.2.1.12': api.v2c.Counter32(index),
+            '1.3.6.1.2.1.2.2.1.14': api.v2c.Counter32(0),
+            '1.3.6.1.2.1.2.2.1.16': api.v2c.Counter32(octets * 3 % 2 ** 32),
+            '1.3.6.1.2.1.2.2.1.17': api.v2c.Counter32(octets * 3 // 1000 % 2 ** 32),
+            '1.3.6.1.2.1.2.2.1.18': api.v2c.Counter32(index),
+            '1.3.6.1.2.1.2.2.1.20': api.v2c.Counter32(0),
+            # ifXTable
+            '1.3.6.1.2.1.31.1.1.1.1': api.v2c.OctetString(name),
+            '1.3.6.1.2.1.31.1.1.1.6': api.v2c.Counter64(octets),
+            '1.3.6.1.2.1.31.1.1.1.7': api.v2c.Counter64(octets // 1000),
+            '1.3.6.1.2.1.31.1.1.1.8': api.v2c.Counter64(index),
+            '1.3.6.1.2.1.31.1.1.1.9': api.v2c.Counter64(index),
+            '1.3.6.1.2.1.31.1.1.1.10': api.v2c.Counter64(octets * 3),
+            '1.3.6.1.2.1.31.1.1.1.11': api.v2c.Counter64(octets * 3 // 1000),
+            '1.3.6.1.2.1.31.1.1.1.12': api.v2c.Counter64(index),
+            '1.3.6.1.2.1.31.1.1.1.13': api.v2c.Counter64(index),
+            '1.3.6.1.2.1.31.1.1.1.15': api.v2c.Gauge32(1000),
+        }
+        for column, value in columns.items():
+            oids[f'{column}.{index}'] = value
+    return oids
+
+DEFAULT_OIDS.update(host_tables())
+DEFAULT_OIDS.update(interface_tables())
+
+def _oid_key(oid):
+    return tuple(int(part) for part in str(oid).split('.'))
+
+p_mod = api.protoModules[api.protoVersion2c]
+
+NO_SUCH_INSTANCE = encoder.encode(api.v2c.NoSuchInstance())
+END_OF_MIB_VIEW = encoder.encode(api.v2c.EndOfMibView())
+
+def _tlv(tag, payload):
+    length = len(payload)
+    if length < 0x80:
+        return bytes((tag, length)) + payload
+    length = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((tag, 0x80 | len(length))) + length + payload
+
+def _integer(value):
+    return _tlv(0x02, value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True))
+
+class MibTable:
+    """
+    Sorted OID table answering GET, GETNEXT and GETBULK requests
+
+    Requests are decoded with pyasn1, but responses are assembled from cached
+    BER encodings of names and values, so a simulated agent is not the
+    bottleneck of a benchmark. Values of existing OIDs may be replaced in
+    .oids at any time (e.g. to advance counters); the set of OIDs is fixed
+    at construction.
+    """
+    def __init__(self, oids):
+        self.oids = oids
+        self._keys = sorted(_oid_key(oid) for oid in oids)
+        self._names = ['.'.join(map(str, key)) for key in self._keys]
+        self._positions = {name: position for position, name in enumerate(self._names)}
+        self._name_bytes = [None] * len(self._keys)
+        self._value_bytes = {}
+
+    def _encoded_name(self, position):
+        encoded = self._name_bytes[position]
+        if encoded is None:
+            encoded = self._name_bytes[position] = encoder.encode(rfc1902.ObjectName(self._keys[position]))
+        return encoded
+
+    def _encoded_value(self, name, values):
+        value = values.get(name)
+        if value is not None:
+            return encoder.encode(value)
+        value = self.oids[name]
+        cached = self._value_bytes.get(name)
+        if cached is None or cached[0] is not value:
+            cached = self._value_bytes[name] = (value, encoder.encode(value))
+        return cached[1]
+
+    def _var_bind(self, position, values):
+        return _tlv(0x30, self._encoded_name(position) + self._encoded_value(self._names[position], values))
+
+    def _next_position(self, oid):
+        return bisect.bisect_right(self._keys, _oid_key(oid))
+
+    def _next(self, position, name, values):
+        if position < len(self._keys):
+            return self._var_bind(position, values)
+        return _tlv(0x30, name + END_OF_MIB_VIEW)
+
+    def respond(self, data, values=None, community=None):
+        """
+        Encode the response to a request datagram, or return None if the
+        request is undecodable or (when community is given) uses another community
+
+        values maps OID strings to values overriding .oids for this response.
+        """
+        try:
+            request, _ = decoder.decode(data, asn1Spec=p_mod.Message())
+        except Exception:
+            return None
+        request_community = bytes(p_mod.apiMessage.getCommunity(request))
+        if community is not None and request_community != community.encode():
+            return None
+        values = values or {}
+        pdu = p_mod.apiMessage.getPDU(request)
+        names = [oid for oid, _ in p_mod.apiPDU.getVarBinds(pdu)]
+        var_binds = []
+        if pdu.isSameTypeWith(p_mod.GetBulkRequestPDU()):
+            non_repeaters = min(int(p_mod.apiBulkPDU.getNonRepeaters(pdu)), len(names))
+            max_repetitions = int(p_mod.apiBulkPDU.getMaxRepetitions(pdu))
+            for oid in names[:non_repeaters]:
+                var_binds.append(self._next(self._next_position(oid), encoder.encode(oid), values))
+            repeaters = [self._next_position(oid) for oid in names[non_repeaters:]]
+            last_names = [encoder.encode(oid) for oid in names[non_repeaters:]]
+            for _ in range(max_repetitions if repeaters else 0):
+                ended = 0
+                for column, position in enumerate(repeaters):
+                    var_binds.append(self._next(position, last_names[column], values))
+                    if position < len(self._keys):
+                        last_names[column] = self._encoded_name(position)
+                        repeaters[column] = position + 1
+                    else:
+                        ended += 1
+                if ended == len(repeaters):
+                    break
+        elif pdu.isSameTypeWith(p_mod.GetNextRequestPDU()):
+            for oid in names:
+                var_binds.append(self._next(self._next_position(oid), encoder.encode(oid), values))
+        else:
+            for oid in names:
+                position = self._positions.get(str(oid))
+                if position is None:
+                    var_binds.append(_tlv(0x30, encoder.encode(oid) + NO_SUCH_INSTANCE))
+                else:
+                    var_binds.append(self._var_bind(position, values))
+
+        response_pdu = _tlv(0xa2, _integer(int(p_mod.apiPDU.getRequestID(pdu))) + _integer(0) + _integer(0)
+                            + _tlv(0x30, b''.join(var_binds)))
+        return _tlv(0x30, _integer(1) + _tlv(0x04, request_community) + response_pdu)
+
+class LoopbackAgent:
+    """
+    Answer SNMP requests from an OID table (see MibTable) in a background thread
+    """
+    def __init__(self, oids=None, host='127.0.0.1', port=0):
+        self.oids = dict(DEFAULT_OIDS if oids is None else oids)
+        self.table = MibTable(self.oids)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+        self.requests = 0
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(65535)
+            except OSError:
+                return
+            self.requests += 1
+            response = self.table.respond(data)
+            if response is not None:
+                self.sock.sendto(response, address)
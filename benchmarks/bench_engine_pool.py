@@ -0,0 +1,71 @@
+"""
+Per-poll overhead: new SnmpEngine per GET vs the shared session pool vs one batched GET
+
+Usage: python -m benchmarks.bench_engine_pool [--polls N]
+"""
+import argparse
+import statistics
+import time
+
+from pysnmp.hlapi import (CommunityData, ContextData, ObjectIdentity, ObjectType,
+                          SnmpEngine, UdpTransportTarget, getCmd)
+
+import snmp_operations
+from benchmarks.agent import LoopbackAgent
+
+# OIDs of a single device poll (one GET each in legacy/pooled mode)
+POLL_OIDS = [
+    ('SNMPv2-MIB', 'sysDescr', 0),
+    ('SNMPv2-MIB', 'sysUpTime', 0),
+    ('UCD-SNMP-MIB', 'ssCpuUser', 0),
+    ('HOST-RESOURCES-MIB', 'hrStorageUsed', 1),
+    ('HOST-RESOURCES-MIB', 'hrStorageSize', 1),
+]
+
+def poll_legacy(ip, port):
+    for oid in POLL_OIDS:
+        next(getCmd(SnmpEngine(),
+                    CommunityData('public'),
+                    UdpTransportTarget((ip, port), timeout=1, retries=0),
+                    ContextData(),
+                    ObjectType(ObjectIdentity(*oid))))
+
+def poll_pooled(ip, port):
+    for oid in POLL_OIDS:
+        snmp_operations.snmp_get(ip, 'public', oid, timeout=1, port=port)
+
+def poll_batched(ip, port):
+    snmp_operations.snmp_get_values(ip, 'public', POLL_OIDS, timeout=1, port=port)
+
+def measure(poll, ip, port, polls):
+    samples = []
+    for _ in range(polls):
+        start = time.perf_counter()
+        poll(ip, port)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--polls', type=int, default=50)
+    args = parser.parse_args()
+
+    with LoopbackAgent() as agent:
+        ip, port = agent.address
+        results = {}
+        for name, poll in (('legacy', poll_legacy), ('pooled', poll_pooled), ('batched', poll_batched)):
+            poll(ip, port)  # warm-up (loads MIB modules)
+            results[name] = measure(poll, ip, port, args.polls)
+            print(f"{name:>8}: mean {results[name]['mean_ms']:.2f} ms, "
+                  f"p50 {results[name]['p50_ms']:.2f} ms, p99 {results[name]['p99_ms']:.2f} ms "
+                  f"({args.polls} polls)")
+        for name in ('pooled', 'batched'):
+            print(f"speedup ({name}): {results['legacy']['mean_ms'] / results[name]['mean_ms']:.1f}x")
+
+if __name__ == '__main__':
+    main()
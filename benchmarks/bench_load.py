@@ -0,0 +1,258 @@
+"""
+Load test against a simulated agent fleet: metrics polling, ICMP sweep, range scan, concurrent polling and a full check cycle
+
+Usage: python -m benchmarks.bench_load [--agents N] [--latency S] [--loss P] [--dead P] [--workers N]
+                                       [--json PATH] [--baseline PATH] [--tolerance F]
+
+Runs on any Linux box without a network (agents live on 127.0.0.0/8). Every
+scenario reports throughput, wall time, CPU time and RSS of this process
+(with --workers the check cycle polls in that many sharded worker processes,
+whose CPU time is not included); --json saves the results and --baseline compares against saved results and
+exits with status 1 if any throughput dropped by more than --tolerance.
+
+Polling scenarios also fail the run (status 1) on false timeouts: timeouts
+beyond the simulator's dead agents, i.e. live agents reported as inactive.
+Without --loss every live agent answers, so a false timeout means the
+poller itself dropped or starved a response (with --loss they are not
+counted). Results with false timeouts are not saved by --json, and a
+baseline that has them is rejected.
+"""
+import argparse
+import ipaddress
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import async_poller
+import snmp_operations
+from benchmarks.simulator import AgentSimulator
+from sharded_poller import ShardedPoller
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def _rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE / 2 ** 20
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def measure(name, items, run):
+    """
+    Run a scenario over items and return its stats
+
+    run() returns a dict of extra fields including 'ok', the number of items
+    that succeeded; throughput counts only those, so timeouts never look like
+    a speedup.
+    """
+    cpu, start = _cpu_seconds(), time.perf_counter()
+    extra = run()
+    wall = time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu
+    result = {
+        'scenario': name,
+        'items': items,
+        'wall_s': round(wall, 3),
+        'throughput': round(extra['ok'] / wall, 1),
+        'cpu_s': round(cpu, 3),
+        'cpu_ms_per_item': round(cpu * 1000 / items, 3),
+        'rss_mb': round(_rss_mb(), 1),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    result.update(extra)
+    print(f"{name:>20}: {extra['ok']}/{items} ok in {result['wall_s']:.2f}s ({result['throughput']:.0f}/s), "
+          f"CPU {result['cpu_s']:.2f}s ({result['cpu_ms_per_item']:.2f} ms/item), "
+          f"RSS {result['rss_mb']:.0f} MB (max {result['max_rss_mb']:.0f} MB)"
+          + ''.join(f", {key} {value}" for key, value in extra.items() if key != 'ok'))
+    return result
+
+def covering_network(simulator):
+    """
+    Smallest network containing every simulated agent
+    """
+    prefix = 32 - math.ceil(math.log2(simulator.count + 2))
+    return ipaddress.ip_network(f'{simulator.addresses[0]}/{prefix}', strict=False)
+
+def bench_system_metrics(simulator, samples):
+    ips = simulator.live_addresses[:samples]
+
+    def run():
+        ok = sum(snmp_operations.get_system_metrics(ip, timeout=1, retries=0)['uptime'] is not None for ip in ips)
+        return {'ok': ok}
+    return measure('get_system_metrics', len(ips), run)
+
+def bench_sweep(app_module, network):
+    from discovery import find_active_ips
+
+    hosts = network.num_addresses - 2
+
+    def run():
+        return {'ok': len(find_active_ips(str(network)))}
+    return measure('find_active_ips', hosts, run)
+
+def bench_scan(app_module, network):
+    hosts = network.num_addresses - 2
+
+    def run():
+        app_module.scan_range_worker(str(network), 'public', 'snmp', job_id='bench')
+        message = None
+        with app_module.event_bus.subscribe(app_module.scan_channel('bench')) as events:
+            for _, message in iter(events.get, None):
+                pass
+        if message is None or message['type'] != 'complete':
+            raise RuntimeError(f"scan did not complete: {message}")
+        return {'ok': len(message['devices'])}
+    return measure('scan_range_worker', hosts, run)
+
+def count_false_timeouts(simulator, timeouts):
+    """
+    Timeouts of live agents in a poll of the whole fleet; None if the simulator drops requests
+    """
+    return None if simulator.loss else max(0, timeouts - len(simulator.dead))
+
+def bench_poll_devices(simulator):
+    """
+    Poll every agent once, interface counters included, with the poller's default concurrency and timeout
+    """
+    targets = [(ip, ip, simulator.community) for ip in simulator.addresses]
+
+    def run():
+        results, report = async_poller.poll_devices(targets, port=simulator.port, counters=True)
+        return {'ok': sum(result['active'] for result in results.values()),
+                'timeouts': report['timeouts'], 'errors': report['errors'],
+                'false_timeouts': count_false_timeouts(simulator, report['timeouts']),
+                'concurrency': report['concurrency']}
+    return measure('poll_devices', len(targets), run)
+
+def bench_check_cycle(app_module, simulator, workers=0):
+    from models import db, Device
+
+    with app_module.app.app_context():
+        # The scan only stores agents that answered - add the dead ones too
+        known = {ip for (ip,) in db.session.query(Device.ip_address)}
+        db.session.add_all([Device(ip_address=ip, snmp_community='public', status='active', name='Unknown')
+                            for ip in simulator.addresses if ip not in known])
+        db.session.commit()
+        targets = db.session.query(Device.id, Device.ip_address, Device.snmp_community,
+                                   Device.snmp_profile).all()
+    devices = len(targets)
+
+    def run():
+        # Every run polls again instead of reusing the previous run's results
+        app_module.poll_cache.clear()
+        app_module.check_all_devices()
+        report = app_module.last_cycle_report
+        return {'ok': devices - report['timeouts'] - report['errors'],
+                'timeouts': report['timeouts'], 'errors': report['errors'],
+                'false_timeouts': count_false_timeouts(simulator, report['timeouts'])}
+    if not workers:
+        return measure('check_all_devices', devices, run)
+    with ShardedPoller(workers, concurrency=app_module.get_config_value('poll_concurrency'),
+                       deadline=app_module.get_config_value('poll_deadline'), port=simulator.port) as poller:
+        poller.assign(targets)
+        app_module.poll_backend = poller
+        try:
+            return measure(f'check_all_devices/{workers}', devices, run)
+        finally:
+            app_module.poll_backend = None
+
+def false_timeouts(results):
+    """
+    Return descriptions of scenarios that reported live agents as timed out
+    """
+    return [f"{result['scenario']} {result['false_timeouts']}" for result in results if result.get('false_timeouts')]
+
+def compare(results, baseline, tolerance):
+    """
+    Return descriptions of scenarios whose throughput regressed beyond tolerance
+    """
+    previous = {result['scenario']: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result['scenario'])
+        if old is None:
+            continue
+        change = result['throughput'] / old['throughput'] - 1
+        print(f"{result['scenario']:>20}: {old['throughput']:.0f}/s -> {result['throughput']:.0f}/s ({change:+.0%})")
+        if change < -tolerance:
+            regressions.append(f"{result['scenario']} {change:+.0%}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--agents', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--jitter', type=float, default=0.003)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--dead', type=float, default=0.05)
+    parser.add_argument('--samples', type=int, default=200, help='agents polled by get_system_metrics')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--deadline', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=0, help='poll the check cycle in N sharded processes')
+    parser.add_argument('--json', help='save results to this file')
+    parser.add_argument('--baseline', help='compare with results saved by --json')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed throughput drop (fraction)')
+    args = parser.parse_args()
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as workdir, \
+            AgentSimulator(args.agents, latency=args.latency, jitter=args.jitter, loss=args.loss,
+                           dead=args.dead) as simulator:
+        snmp_operations.SNMP_PORT = simulator.port
+        network = covering_network(simulator)
+        print(f"{args.agents} agents ({len(simulator.dead)} dead) in {network}, UDP port {simulator.port}")
+
+        # The application keeps its config, log and database in the working directory
+        os.chdir(workdir)
+        with open('config.json', 'w') as f:
+            json.dump({'check_interval': 86400, 'poll_concurrency': args.concurrency,
+                       'poll_deadline': args.deadline}, f)
+        os.environ['NYO_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'devices.db')}"
+        import app as app_module
+        app_module.init_db()
+        logging.getLogger().setLevel(logging.WARNING)
+        snmp_operations.get_system_metrics(simulator.live_addresses[0], retries=0)  # warm-up (loads MIB modules)
+
+        results = [
+            bench_system_metrics(simulator, args.samples),
+            bench_sweep(app_module, network),
+            bench_scan(app_module, network),
+            bench_poll_devices(simulator),
+            bench_check_cycle(app_module, simulator, args.workers),
+        ]
+        print(f"simulator served {simulator.requests} requests")
+        os.chdir(cwd)
+
+    starved = false_timeouts(results)
+    failed = bool(starved)
+    if starved:
+        print(f"false timeouts: {', '.join(starved)}")
+    if args.json:
+        if starved:
+            # Throughput that excludes starved agents must not become the reference
+            print(f"not saving {args.json}: a run with false timeouts is not a valid baseline")
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if false_timeouts(baseline):
+            print(f"baseline {args.baseline} has false timeouts ({', '.join(false_timeouts(baseline))}), record it again")
+            failed = True
+        else:
+            regressions = compare(results, baseline, args.tolerance)
+            if regressions:
+                print(f"throughput regressions: {', '.join(regressions)}")
+                failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Device table query times at fleet scale, with and without the secondary indexes
+
+Usage: python -m benchmarks.bench_schema [--devices N] [--repeat N] [--json PATH]
+
+Builds a database in the pre-upgrade schema (addresses as text, no indexes),
+times the migration (models.upgrade_schema), then times the dashboard's
+/api/devices queries and an address lookup, first with the indexes of the
+new schema and then with them dropped, so the two columns show what the
+indexes buy.
+"""
+import argparse
+import ipaddress
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+import device_query
+from models import db, Device, pack_ip, upgrade_schema
+
+LEGACY_SCHEMA = """
+CREATE TABLE device (
+    id INTEGER NOT NULL PRIMARY KEY,
+    ip_address VARCHAR(15) NOT NULL UNIQUE,
+    name VARCHAR(100),
+    status VARCHAR(20),
+    last_checked DATETIME,
+    snmp_community VARCHAR(50),
+    uptime VARCHAR(50),
+    cpu_usage FLOAT,
+    memory_used INTEGER,
+    memory_total INTEGER
+)
+"""
+
+SECONDARY_INDEXES = ('ix_device_ip_packed', 'ix_device_status_ip_packed', 'ix_device_status_last_checked',
+                     'ix_device_last_checked', 'ix_device_name')
+
+def fill_legacy(path, count, seed=1):
+    """
+    Create a pre-upgrade database with count devices spread over 10.0.0.0/8
+    (10% inactive) and return their addresses in insertion order
+    """
+    rng = random.Random(seed)
+    first = int(ipaddress.IPv4Address('10.0.0.0'))
+    addresses = [str(ipaddress.IPv4Address(first + value)) for value in rng.sample(range(1, 2 ** 24 - 1), count)]
+    now = datetime(2024, 1, 1)
+    rows = [(ip, f'host-{index:06d}', 'inactive' if rng.random() < 0.1 else 'active',
+             (now - timedelta(seconds=rng.uniform(0, 86400))).isoformat(sep=' '), 'public',
+             '1 day, 0:00:00', round(rng.uniform(0, 100), 1), 4096, 16384)
+            for index, ip in enumerate(addresses)]
+    connection = sqlite3.connect(path)
+    connection.execute(LEGACY_SCHEMA)
+    connection.executemany('INSERT INTO device (ip_address, name, status, last_checked, snmp_community, uptime, '
+                           'cpu_usage, memory_used, memory_total) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    connection.commit()
+    connection.close()
+    return addresses
+
+def scenarios(addresses):
+    """
+    (name, callable) pairs; every callable runs one query
+    """
+    middle = sorted(addresses, key=pack_ip)[len(addresses) // 2]
+    middle_id = addresses.index(middle) + 1
+    deep_cursor = device_query.encode_cursor('ip_address', pack_ip(middle), middle_id)
+    sample = addresses[len(addresses) // 3]
+    subnet_24 = str(ipaddress.ip_network(f'{sample}/24', strict=False))
+    subnet_16 = str(ipaddress.ip_network(f'{sample}/16', strict=False))
+    prefix = '.'.join(sample.split('.')[:2]) + '.1'
+
+    def page(**args):
+        return lambda: device_query.query_devices(args)
+    return [
+        ('first page by ip', page(limit='100')),
+        ('middle page by ip', page(limit='100', after=deep_cursor)),
+        ('inactive page', page(status='inactive', limit='100')),
+        ('inactive oldest first', page(status='inactive', sort='last_checked', limit='100')),
+        ('oldest checked', page(sort='last_checked', limit='100')),
+        ('page by name', page(sort='name', limit='100')),
+        (f'subnet {subnet_24}', page(subnet=subnet_24, limit='100')),
+        (f'count subnet {subnet_16}', page(subnet=subnet_16, limit='1', count='1')),
+        (f'ip prefix {prefix}', page(ip=prefix, limit='100')),
+        ('count inactive', page(status='inactive', limit='1', count='1')),
+        ('lookup by ip', lambda: Device.query.filter_by(ip_packed=pack_ip(sample)).first()),
+    ]
+
+def time_ms(run, repeat):
+    """
+    Median wall time of run() in milliseconds (after one untimed warm-up run)
+    """
+    run()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - start) * 1000)
+        db.session.rollback()
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='save results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'devices.db')
+        addresses = fill_legacy(path, args.devices)
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+        db.init_app(app)
+        with app.app_context():
+            start = time.perf_counter()
+            upgrade_schema()
+            db.create_all()
+            migration = time.perf_counter() - start
+            print(f"{args.devices} devices, migration {migration:.2f}s")
+
+            results = {'devices': args.devices, 'migration_s': round(migration, 3), 'queries': {}}
+            runs = scenarios(addresses)
+            for name, run in runs:
+                results['queries'][name] = {'indexed_ms': round(time_ms(run, args.repeat), 3)}
+            with db.engine.begin() as connection:
+                for index in SECONDARY_INDEXES:
+                    connection.exec_driver_sql(f'DROP INDEX {index}')
+            for name, run in runs:
+                results['queries'][name]['unindexed_ms'] = round(time_ms(run, args.repeat), 3)
+
+    print(f"{'query':>28}  {'indexed':>10}  {'no indexes':>10}")
+    for name, times in results['queries'].items():
+        print(f"{name:>28}  {times['indexed_ms']:>8.2f}ms  {times['unindexed_ms']:>8.2f}ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
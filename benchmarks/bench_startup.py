@@ -0,0 +1,68 @@
+"""
+Startup cost: import time and RSS of the main modules, and the cost of the first OID resolution
+
+Usage: python -m benchmarks.bench_startup [--runs N] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ['snmp_operations', 'async_poller', 'app', 'poller']
+
+# Run in a fresh interpreter per sample; prints import seconds, resolution seconds and max RSS (kB)
+CHILD = '''
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter() - start
+import snmp_operations
+if sys.argv[2] == 'mib':
+    snmp_operations.NUMERIC_OIDS.clear()
+oids = (snmp_operations.POLL_SCALARS + snmp_operations.METRIC_COLUMNS
+        + list(snmp_operations.HC_COUNTER_COLUMNS) + list(snmp_operations.COUNTER_COLUMNS))
+start = time.perf_counter()
+snmp_operations.resolve_names(oids)
+resolved = time.perf_counter() - start
+print(json.dumps({'import': imported, 'resolve': resolved,
+                  'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'pysnmp_hlapi': 'pysnmp.hlapi' in sys.modules}))
+'''
+
+def sample(module, resolution):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', CHILD, module, resolution], cwd=root,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def measure(module, resolution, runs):
+    samples = [sample(module, resolution) for _ in range(runs)]
+    return {
+        'scenario': f'{module}/{resolution}',
+        'import_ms': statistics.median(s['import'] for s in samples) * 1000,
+        'resolve_ms': statistics.median(s['resolve'] for s in samples) * 1000,
+        'rss_mb': statistics.median(s['rss_kb'] for s in samples) / 1024,
+        'pysnmp_hlapi': samples[0]['pysnmp_hlapi'],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per scenario')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    # 'table' resolves through oid_table; 'mib' forces the pysnmp MIB lookup the table replaces
+    results = [measure(module, resolution, args.runs)
+               for module in MODULES for resolution in ('table', 'mib')]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'scenario':<24} {'import':>10} {'resolve':>10} {'RSS':>9}  hlapi loaded")
+    for result in results:
+        print(f"{result['scenario']:<24} {result['import_ms']:>8.0f}ms {result['resolve_ms']:>8.1f}ms "
+              f"{result['rss_mb']:>7.1f}MB  {'yes' if result['pysnmp_hlapi'] else 'no'}")
+
+if __name__ == '__main__':
+    main()
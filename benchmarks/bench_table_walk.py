@@ -0,0 +1,63 @@
+"""
+Table walks: GETNEXT vs GETBULK (PDU count and latency) for ifTable/ifXTable, hrStorageTable and hrProcessorLoad
+
+Usage: python -m benchmarks.bench_table_walk [--walks N] [--interfaces N] [--repetitions N [N ...]]
+"""
+import argparse
+import statistics
+import time
+
+import snmp_operations
+from benchmarks.agent import DEFAULT_OIDS, LoopbackAgent, host_tables, interface_tables
+
+TABLES = {
+    'interfaces': snmp_operations.IF_COLUMNS + snmp_operations.IFX_COLUMNS,
+    'storage': snmp_operations.HR_STORAGE_COLUMNS,
+    'processors': snmp_operations.HR_PROCESSOR_COLUMNS,
+}
+
+def measure(agent, ip, columns, bulk, max_repetitions, walks):
+    samples = []
+    requests = agent.requests
+    for _ in range(walks):
+        start = time.perf_counter()
+        error, table = snmp_operations.walk_table(ip, 'public', columns, max_repetitions=max_repetitions,
+                                                  bulk=bulk, timeout=1)
+        samples.append(time.perf_counter() - start)
+        if error:
+            raise RuntimeError(error)
+    samples.sort()
+    return {
+        'rows': len(table['index']),
+        'pdus': (agent.requests - requests) / walks,
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--walks', type=int, default=20)
+    parser.add_argument('--interfaces', type=int, default=48)
+    parser.add_argument('--processors', type=int, default=8)
+    parser.add_argument('--disks', type=int, default=4)
+    parser.add_argument('--repetitions', type=int, nargs='+', default=[10, 25, 50])
+    args = parser.parse_args()
+
+    oids = dict(DEFAULT_OIDS)
+    oids.update(interface_tables(args.interfaces))
+    oids.update(host_tables(args.processors, args.disks))
+    with LoopbackAgent(oids) as agent:
+        ip, snmp_operations.SNMP_PORT = agent.address
+        snmp_operations.walk_table(ip, 'public', TABLES['interfaces'])  # warm-up (loads MIB modules)
+        for table, columns in TABLES.items():
+            modes = [('getnext', False, 0)] + [(f'getbulk/{n}', True, n) for n in args.repetitions]
+            baseline = None
+            for name, bulk, max_repetitions in modes:
+                result = measure(agent, ip, columns, bulk, max_repetitions, args.walks)
+                baseline = baseline or result
+                print(f"{table:>10} {name:>12}: {result['rows']} rows x {len(columns)} columns, "
+                      f"{result['pdus']:.0f} PDUs, mean {result['mean_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+                      f"speedup {baseline['mean_ms'] / result['mean_ms']:.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Simulated fleet of SNMPv2c agents on loopback addresses (Linux)
+
+Usage: python -m benchmarks.simulator [--agents N] [--network CIDR] [--latency S] [--loss P] [--dead P]
+"""
+import argparse
+import heapq
+import ipaddress
+import itertools
+import multiprocessing
+import random
+import select
+import socket
+import struct
+import time
+
+from pysnmp.proto import api
+
+from benchmarks.agent import DEFAULT_OIDS, MibTable, host_tables
+
+# Linux <netinet/in.h>, not exported by the socket module
+IP_PKTINFO = 8
+
+SYS_NAME = '1.3.6.1.2.1.1.5.0'
+SYS_UPTIME = '1.3.6.1.2.1.1.3.0'
+PROCESSOR_LOADS = ['1.3.6.1.2.1.25.3.3.1.2.196608', '1.3.6.1.2.1.25.3.3.1.2.196609']
+
+class AgentSimulator:
+    """
+    Thousands of virtual agents, one per address of a loopback network
+
+    All of 127.0.0.0/8 is routed to lo on Linux, so every agent gets its own
+    address while a single UDP socket (in a separate process, so it does not
+    compete for the GIL with the code under test) answers for all of them:
+    IP_PKTINFO tells which address a request was sent to and sets it as the
+    source of the response. Agents serve sysDescr/sysName/sysUpTime,
+    HOST-RESOURCES and UCD objects with per-agent names, uptimes and loads.
+
+    latency (+ uniform jitter) delays responses, loss drops requests at random
+    and dead is the fraction of agents that never answer.
+    """
+    def __init__(self, count=1000, network='127.1.0.0/16', latency=0.0, jitter=0.0, loss=0.0, dead=0.0,
+                 community='public', seed=1):
+        self.network = ipaddress.ip_network(network)
+        if count > self.network.num_addresses - 2:
+            raise ValueError(f"{network} cannot hold {count} agents")
+        self.count = count
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.community = community
+        self.seed = seed
+        self.dead = set(random.Random(seed).sample(range(count), int(count * dead)))
+        self.port = None
+        self._requests = multiprocessing.Value('Q', 0, lock=False)
+        self._process = None
+
+    @property
+    def addresses(self):
+        first = int(self.network.network_address) + 1
+        return [str(ipaddress.ip_address(first + index)) for index in range(self.count)]
+
+    @property
+    def live_addresses(self):
+        return [ip for index, ip in enumerate(self.addresses) if index not in self.dead]
+
+    @property
+    def requests(self):
+        return self._requests.value
+
+    def __enter__(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+        sock.bind(('0.0.0.0', 0))
+        self.port = sock.getsockname()[1]
+        context = multiprocessing.get_context('fork')
+        self._process = context.Process(target=self._serve, args=(sock,), daemon=True)
+        self._process.start()
+        sock.close()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        self._process.join()
+
+    def _agent_values(self, index, now):
+        values = {
+            SYS_NAME: api.v2c.OctetString(f'sim-{index}'),
+            SYS_UPTIME: api.v2c.TimeTicks(int((self._boot[index] + now) * 100) % 2 ** 32),
+        }
+        for n, oid in enumerate(PROCESSOR_LOADS):
+            values[oid] = api.v2c.Integer((index * 7 + n * 13 + int(now)) % 100)
+        return values
+
+    def _serve(self, sock):
+        oids = dict(DEFAULT_OIDS)
+        oids.update(host_tables())
+        table = MibTable(oids)
+        rng = random.Random(self.seed)
+        self._boot = [rng.uniform(3600, 100 * 86400) for _ in range(self.count)]
+        first = int(self.network.network_address) + 1
+        delayed, sequence = [], itertools.count()
+        sock.setblocking(False)
+        while True:
+            timeout = max(0, delayed[0][0] - time.monotonic()) if delayed else None
+            readable, _, _ = select.select([sock], [], [], timeout)
+            while readable:
+                try:
+                    data, ancdata, _, address = sock.recvmsg(65535, socket.CMSG_SPACE(12))
+                except BlockingIOError:
+                    break
+                self._requests.value += 1
+                destination = next((cmsg_data[8:12] for level, kind, cmsg_data in ancdata
+                                    if level == socket.IPPROTO_IP and kind == IP_PKTINFO), None)
+                if destination is None or not address[0].startswith('127.'):
+                    continue
+                index = int.from_bytes(destination, 'big') - first
+                if not 0 <= index < self.count or index in self.dead or rng.random() < self.loss:
+                    continue
+                response = table.respond(data, self._agent_values(index, time.monotonic()), self.community)
+                if response is None:
+                    continue
+                reply = (response, destination, address)
+                if self.latency or self.jitter:
+                    due = time.monotonic() + self.latency + rng.uniform(0, self.jitter)
+                    heapq.heappush(delayed, (due, next(sequence), reply))
+                else:
+                    _send(sock, *reply)
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                _send(sock, *heapq.heappop(delayed)[2])
+
+def _send(sock, response, source, address):
+    pktinfo = struct.pack('=I4s4s', 0, source, b'\0' * 4)
+    try:
+        sock.sendmsg([response], [(socket.IPPROTO_IP, IP_PKTINFO, pktinfo)], 0, address)
+    except OSError:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--agents', type=int, default=1000)
+    parser.add_argument('--network', default='127.1.0.0/16')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--dead', type=float, default=0.0)
+    args = parser.parse_args()
+
+    with AgentSimulator(args.agents, args.network, args.latency, args.jitter, args.loss, args.dead) as simulator:
+        print(f"{args.agents} agents ({len(simulator.dead)} dead) on {args.network}, UDP port {simulator.port}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from device_query import FIELDS, subnet_condition
+from models import db, Device, pack_ip, unpack_ip
+
+# Rows validated, deduplicated and inserted per transaction
+IMPORT_BATCH_SIZE = 1000
+
+# Rows per query of an export (keyset pagination on id)
+EXPORT_BATCH_SIZE = 1000
+
+# Rejected rows reported individually; the rest are only counted
+MAX_ERRORS = 100
+
+FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+# Column names accepted besides the Device column names
+ALIASES = {'ip': 'ip_address', 'community': 'snmp_community'}
+
+EXPORT_FIELDS = ('ip_address', 'name', 'snmp_community', 'status', 'uptime', 'cpu_usage',
+                 'memory_used', 'memory_total', 'last_checked')
+
+def detect_format(requested, content_type):
+    """
+    'csv' or 'ndjson' from an explicit ?format= or the Content-Type; None if unknown
+    """
+    if requested:
+        return requested if requested in FORMATS else None
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/json-lines'):
+        return 'ndjson'
+    return None
+
+def read_records(stream, fmt):
+    """
+    Yield (line number, record dict or None, error or None) from a binary
+    stream of CSV (with a header row) or NDJSON, one row at a time; input
+    that cannot be read further (not UTF-8, broken CSV) raises ValueError
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        yield from (_csv_records if fmt == 'csv' else _ndjson_records)(text)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValueError(f'unreadable input: {e}')
+
+def _csv_records(text):
+    reader = csv.DictReader(text)
+    for record in reader:
+        yield reader.line_num, record, None
+
+def _ndjson_records(text):
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, None, 'invalid JSON'
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, 'expected a JSON object'
+            continue
+        yield line_number, record, None
+
+def validate(record, default_community):
+    """
+    Device column values of an import record; raises ValueError with the reason
+    """
+    record = {ALIASES.get(key, key): value for key, value in record.items() if key is not None}
+    ip = record.get('ip_address')
+    if not isinstance(ip, str) or not ip.strip():
+        raise ValueError('missing ip_address')
+    try:
+        packed = pack_ip(ip.strip())
+    except ValueError:
+        raise ValueError(f'invalid ip_address {ip!r}')
+    community = record.get('snmp_community') or default_community
+    name = record.get('name') or None
+    if not isinstance(community, str) or len(community) > Device.snmp_community.type.length:
+        raise ValueError('invalid snmp_community')
+    if name is not None and (not isinstance(name, str) or len(name) > Device.name.type.length):
+        raise ValueError('invalid name')
+    return {'ip_address': unpack_ip(packed), 'ip_packed': packed, 'snmp_community': community, 'name': name}
+
+class DeviceImport:
+    """
+    Streaming device import: records are validated, deduplicated (within the
+    input and against the database) and inserted in batches of batch_size,
+    one IN query and one commit per batch, so memory stays bounded by the
+    batch plus the set of packed addresses seen so far (about 80 bytes per
+    address as a bytes object in a set, some 80 MB per million devices).
+
+    Imported devices have no status and no last_checked until their first poll.
+    """
+    def __init__(self, default_community='public', batch_size=IMPORT_BATCH_SIZE, max_errors=MAX_ERRORS):
+        self.default_community = default_community
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.received = self.added = self.duplicates = self.invalid = 0
+        self.errors = []
+        self._seen = set()
+
+    def summary(self):
+        return {'received': self.received, 'added': self.added, 'duplicates': self.duplicates,
+                'invalid': self.invalid, 'errors': self.errors}
+
+    def _reject(self, line, reason):
+        self.invalid += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': reason})
+
+    def batches(self, records):
+        """
+        Import (line, record, error) tuples from read_records; yields the
+        column values (device_query.FIELDS) of each committed batch of new devices
+        """
+        batch = []
+        for line, record, error in records:
+            self.received += 1
+            if error is None:
+                try:
+                    values = validate(record, self.default_community)
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                self._reject(line, error)
+                continue
+            if values['ip_packed'] in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen.add(values['ip_packed'])
+            batch.append(values)
+            if len(batch) >= self.batch_size:
+                yield self._insert(batch)
+                batch = []
+        if batch:
+            yield self._insert(batch)
+
+    def _existing(self, packed):
+        return {key for (key,) in db.session.query(Device.ip_packed).filter(Device.ip_packed.in_(packed))}
+
+    def _insert(self, batch):
+        """
+        Insert the addresses of batch that are not in the database yet
+
+        An address inserted concurrently (a scan, add_device) between the
+        check and the insert violates the unique index; the batch is then
+        checked again and retried, and such addresses count as duplicates.
+        """
+        packed = [values['ip_packed'] for values in batch]
+        existing = self._existing(packed)
+        while True:
+            devices = [Device(ip_address=values['ip_address'], snmp_community=values['snmp_community'],
+                              name=values['name'] or 'Unknown', status=None, last_checked=None)
+                       for values in batch if values['ip_packed'] not in existing]
+            try:
+                db.session.add_all(devices)
+                # flush assigns the ids; the values are read before commit() expires the objects
+                db.session.flush()
+                added = [{column: getattr(device, column) for column in FIELDS} for device in devices]
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                known, existing = existing, self._existing(packed)
+                if existing == known:
+                    # No address of the batch appeared meanwhile - not a concurrent insert
+                    raise
+            except Exception:
+                db.session.rollback()
+                raise
+        self.duplicates += len(batch) - len(devices)
+        self.added += len(added)
+        return added
+
+def export_rows(fields=EXPORT_FIELDS, batch_size=EXPORT_BATCH_SIZE, status=None, subnet=None):
+    """
+    Yield device column dicts in id order, batch_size rows per query; no
+    query holds more than one batch in memory. subnet (CIDR) raises
+    ValueError('subnet') when invalid, like device_query
+    """
+    columns = [Device.id] + [getattr(Device, field) for field in fields]
+    query = db.session.query(*columns)
+    if status is not None:
+        query = query.filter(Device.status == status)
+    if subnet is not None:
+        query = query.filter(subnet_condition(subnet))
+    last_id = 0
+    while True:
+        rows = query.filter(Device.id > last_id).order_by(Device.id).limit(batch_size).all()
+        if not rows:
+            return
+        for row in rows:
+            yield dict(zip(fields, row[1:]))
+        last_id = rows[-1][0]
+        db.session.rollback()  # end the read transaction between batches
+
+def _export_value(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime) else value
+
+def export_chunks(rows, fmt, fields=EXPORT_FIELDS, chunk_rows=EXPORT_BATCH_SIZE):
+    """
+    Serialize rows from export_rows as CSV (with a header) or NDJSON text chunks of chunk_rows rows
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator='\n') if fmt == 'csv' else None
+    if writer is not None:
+        writer.writeheader()
+    count = 0
+    for row in rows:
+        row = {field: _export_value(value) for field, value in row.items()}
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row) + '\n')
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,153 @@
+import json
+import time
+
+from snmp_operations import (COUNTER_COLUMNS, CPU_OIDS, HC_COUNTER_COLUMNS, HR_PROCESSOR_LOAD, HR_STORAGE_RAM,
+                             HR_STORAGE_SIZE, HR_STORAGE_TYPE, HR_STORAGE_UNITS, HR_STORAGE_USED, STATUS_OIDS,
+                             UCD_MEMORY_OIDS, UPTIME_OID, resolve_names)
+
+# Bumped when the profile layout changes; profiles of another version are relearned
+PROFILE_VERSION = 1
+
+# Profiles are relearned after this many seconds even without a reboot (e.g. to pick up added processors)
+PROFILE_MAX_AGE = 86400
+
+SYS_OBJECT_ID = ('SNMPv2-MIB', 'sysObjectID', 0)
+
+# Scalars of a learning poll: the regular poll scalars plus sysObjectID to detect firmware changes
+IDENTITY_OIDS = STATUS_OIDS + [UPTIME_OID, SYS_OBJECT_ID]
+
+RAM_COLUMNS = (HR_STORAGE_TYPE, HR_STORAGE_UNITS, HR_STORAGE_SIZE, HR_STORAGE_USED)
+
+COUNTER_TABLES = {'hc': HC_COUNTER_COLUMNS, 'if': COUNTER_COLUMNS}
+
+def learn(values, rows, counters=None, walk=True):
+    """
+    Capability profile of a device from a full poll walk (values and rows as
+    returned by snmp_walk)
+
+    Records which MIB answered for CPU and memory, the hrProcessorLoad rows,
+    the hrStorage index of the RAM row and, if the counters were probed,
+    which interface counter table works ('hc', 'if' or 'none'). walk is
+    False for agents that rejected the walk and only answer the status GET.
+    """
+    profile = {
+        'version': PROFILE_VERSION,
+        'learned_at': time.time(),
+        'sys_object_id': _text(values.get(SYS_OBJECT_ID)),
+        'uptime': _int(values.get(UPTIME_OID)),
+        'walk': walk,
+        'cpu': None,
+        'memory': None,
+    }
+    if counters is not None:
+        profile['counters'] = counters
+    if not walk:
+        return profile
+
+    processors = sorted(rows.get(HR_PROCESSOR_LOAD, {}))
+    if processors:
+        profile['cpu'] = 'host-resources'
+        profile['processors'] = [list(index) for index in processors]
+    else:
+        cpu_oid = next((oid for oid in CPU_OIDS if values.get(oid) is not None), None)
+        if cpu_oid is not None:
+            profile['cpu'] = 'ucd'
+            profile['cpu_oid'] = list(cpu_oid)
+
+    for index, storage_type in sorted(rows.get(HR_STORAGE_TYPE, {}).items()):
+        if str(storage_type) == HR_STORAGE_RAM and all(rows.get(column, {}).get(index) is not None
+                                                       for column in RAM_COLUMNS[1:]):
+            profile['memory'] = 'host-resources'
+            profile['ram_index'] = list(index)
+            break
+    else:
+        if all(values.get(oid) is not None for oid in UCD_MEMORY_OIDS):
+            profile['memory'] = 'ucd'
+    return profile
+
+def usable(profile, counters):
+    """
+    Whether a poll (with or without interface counters) can rely on profile
+    """
+    return (profile is not None and profile.get('version') == PROFILE_VERSION
+            and time.time() - profile['learned_at'] < PROFILE_MAX_AGE
+            and (not counters or 'counters' in profile))
+
+def loads(text):
+    return json.loads(text) if text else None
+
+def dumps(profile):
+    return json.dumps(profile, separators=(',', ':'))
+
+def request(profile, counters):
+    """
+    What a profiled poll fetches: (instances, columns)
+
+    instances maps the exact numeric instances to fetch (the identity
+    scalars, the profiled CPU and memory cells) to (symbolic oid, index),
+    where index is None for scalars; columns are the interface counter
+    columns to walk (empty without counters or a working counter table).
+    """
+    scalars = list(IDENTITY_OIDS)
+    cells = []
+    if profile['cpu'] == 'host-resources':
+        cells += [(HR_PROCESSOR_LOAD, tuple(index)) for index in profile['processors']]
+    elif profile['cpu'] == 'ucd':
+        scalars.append(tuple(profile['cpu_oid']))
+    if profile['memory'] == 'host-resources':
+        cells += [(column, tuple(profile['ram_index'])) for column in RAM_COLUMNS]
+    elif profile['memory'] == 'ucd':
+        scalars += UCD_MEMORY_OIDS
+
+    names = resolve_names(scalars + sorted({column for column, _ in cells}))
+    instances = {names[oid]: (oid, None) for oid in scalars if names[oid] is not None}
+    instances.update({names[column] + index: (column, index) for column, index in cells if names[column] is not None})
+    table = COUNTER_TABLES.get(profile.get('counters')) if counters else None
+    return instances, list(table or ())
+
+def values_and_rows(instances, fetched, rows):
+    """
+    Map fetched {numeric instance: value} and walked counter rows back to the
+    (values, rows) shape of a full poll walk, so the metric parsing is shared
+    """
+    values, cells = {}, {}
+    for name, (oid, index) in instances.items():
+        if index is None:
+            values[oid] = fetched.get(name)
+        else:
+            cells.setdefault(oid, {})[index] = fetched.get(name)
+    for column, column_cells in cells.items():
+        rows[column] = {index: value for index, value in column_cells.items() if value is not None}
+    return values, rows
+
+def matches(profile, values, rows):
+    """
+    Whether a profiled poll still describes the device
+
+    A different sysObjectID (firmware or device change), a sysUpTime below
+    the previous poll's (reboot) or a profiled instance without a value
+    means the profile has to be learned again.
+    """
+    if _text(values.get(SYS_OBJECT_ID)) != profile['sys_object_id']:
+        return False
+    uptime = _int(values.get(UPTIME_OID))
+    if profile['uptime'] is not None and (uptime is None or uptime < profile['uptime']):
+        return False
+    if profile['cpu'] == 'host-resources' and len(rows.get(HR_PROCESSOR_LOAD, {})) != len(profile['processors']):
+        return False
+    if profile['cpu'] == 'ucd' and values.get(tuple(profile['cpu_oid'])) is None:
+        return False
+    if profile['memory'] == 'host-resources':
+        index = tuple(profile['ram_index'])
+        if (str(rows.get(HR_STORAGE_TYPE, {}).get(index)) != HR_STORAGE_RAM
+                or any(rows.get(column, {}).get(index) is None for column in RAM_COLUMNS[1:])):
+            return False
+    if profile['memory'] == 'ucd' and any(values.get(oid) is None for oid in UCD_MEMORY_OIDS):
+        return False
+    return True
+
+def _text(value):
+    return None if value is None else str(value)
+
+def _int(value):
+    return None if value is None else int(value)
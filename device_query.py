@@ -0,0 +1,203 @@
+import base64
+import ipaddress
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, func, or_, tuple_
+
+from models import db, Device, pack_ip
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Columns a client may request (id is always included)
+FIELDS = ('id', 'ip_address', 'name', 'status', 'uptime', 'cpu_usage',
+          'memory_used', 'memory_total', 'last_checked')
+
+STATUSES = ('active', 'inactive')
+
+# Sort keys are plain indexed columns (ip_address sorts numerically by its
+# packed form); NULLs sort first ascending, see keyset_condition
+SORT_KEYS = {
+    'id': Device.id,
+    'ip_address': Device.ip_packed,
+    'name': Device.name,
+    'status': Device.status,
+    'cpu_usage': Device.cpu_usage,
+    'last_checked': Device.last_checked,
+}
+
+def _like_prefix(prefix):
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%'
+
+def _packed_range(first, last):
+    return Device.ip_packed.between(pack_ip(first), pack_ip(last))
+
+def subnet_condition(cidr):
+    """
+    Filter for addresses inside an IPv4 or IPv6 network: one range scan
+    over the packed address index
+    """
+    try:
+        network = ipaddress.ip_network(cidr, strict=False)
+    except ValueError:
+        raise ValueError('subnet')
+    return _packed_range(network.network_address, network.broadcast_address)
+
+def _octet_prefixes(group):
+    """
+    (low, high) ranges of octet values whose decimal form starts with group
+    """
+    value = int(group)
+    if value > 255 or len(group) > 1 and group.startswith('0'):
+        return []  # never the start of a normalized octet
+    if value == 0 or len(group) == 3:
+        return [(value, value)]
+    ranges = [(value, value)]
+    for scale in (10, 100)[:3 - len(group)]:
+        low = value * scale
+        if low <= 255:
+            ranges.append((low, min(low + scale - 1, 255)))
+    return ranges
+
+def ip_prefix_condition(prefix):
+    """
+    Filter for addresses whose text starts with prefix
+
+    A dotted-decimal IPv4 prefix ('10.0.', '10.0.1') becomes at most three
+    range scans over the packed address index ('10.0.1' matches 10.0.1.x,
+    10.0.10-19.x and 10.0.100-199.x); anything else falls back to LIKE on
+    the text column.
+    """
+    groups = prefix.split('.')
+    complete = groups[:-1]
+    last = groups[-1]
+    if (len(groups) > 4 or not all(group.isdigit() and len(group) <= 3 for group in complete)
+            or not (last.isdigit() and len(last) <= 3 or last == '' and complete)):
+        return Device.ip_address.like(_like_prefix(prefix), escape='\\')
+    fixed = [int(group) for group in complete]
+    if any(value > 255 for value in fixed):
+        return Device.ip_address.in_([])
+    ranges = _octet_prefixes(last) if last else [(0, 255)]
+    free = 4 - len(fixed) - 1
+    conditions = []
+    for low, high in ranges:
+        first = fixed + [low] + [0] * free
+        final = fixed + [high] + [255] * free
+        conditions.append(_packed_range(ipaddress.IPv4Address(bytes(first)),
+                                        ipaddress.IPv4Address(bytes(final))))
+    return or_(*conditions) if conditions else Device.ip_address.in_([])
+
+def keyset_condition(key, value, device_id, descending):
+    """
+    Rows after the cursor (value, device_id) in (key, id) order
+
+    Non-NULL cursors use a row-value comparison, which SQLite answers with
+    a seek on the (key, rowid) index instead of scanning from the start.
+    NULL keys sort before every value, so they come first ascending and
+    last descending.
+    """
+    after = tuple_(key, Device.id) < tuple_(value, device_id) if descending \
+        else tuple_(key, Device.id) > tuple_(value, device_id)
+    if value is None:
+        if descending:
+            return and_(key.is_(None), Device.id < device_id)
+        return or_(and_(key.is_(None), Device.id > device_id), key.isnot(None))
+    return or_(after, key.is_(None)) if descending else after
+
+def encode_cursor(sort, value, device_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, bytes):
+        value = value.hex()
+    raw = json.dumps([sort, value, device_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, device_id = json.loads(raw)
+        if cursor_sort != sort or not isinstance(device_id, int):
+            raise ValueError
+        if value is not None and sort == 'last_checked':
+            value = datetime.fromisoformat(value)
+        elif sort == 'ip_address':
+            value = bytes.fromhex(value)
+        return value, device_id
+    except (ValueError, TypeError):
+        raise ValueError('after')
+
+def _float_arg(args, name):
+    try:
+        return float(args[name])
+    except ValueError:
+        raise ValueError(name)
+
+def filter_conditions(args):
+    """
+    SQL conditions for the status, name (prefix), ip (prefix), subnet (CIDR)
+    and cpu_min filters present in args
+    """
+    conditions = []
+    if args.get('status'):
+        if args['status'] not in STATUSES:
+            raise ValueError('status')
+        conditions.append(Device.status == args['status'])
+    if args.get('name'):
+        conditions.append(Device.name.like(_like_prefix(args['name']), escape='\\'))
+    if args.get('ip'):
+        conditions.append(ip_prefix_condition(args['ip']))
+    if args.get('subnet'):
+        conditions.append(subnet_condition(args['subnet']))
+    if args.get('cpu_min'):
+        conditions.append(Device.cpu_usage >= _float_arg(args, 'cpu_min'))
+    return conditions
+
+def query_devices(args):
+    """
+    One page of devices for request args (a mapping of strings)
+
+    Pages are keyset-paginated: 'after' is the opaque cursor returned as
+    'next' by the previous page, so every page costs an index seek instead
+    of an OFFSET over all earlier rows. Returns {'devices': [...],
+    'next': cursor or None} plus 'total' (matching devices) if count=1.
+    Raises ValueError naming the invalid parameter.
+    """
+    sort = args.get('sort', 'ip_address')
+    if sort not in SORT_KEYS:
+        raise ValueError('sort')
+    descending = args.get('order', 'asc') == 'desc'
+    try:
+        limit = min(int(args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        raise ValueError('limit')
+    if limit <= 0:
+        raise ValueError('limit')
+    fields = [field for field in args.get('fields', ','.join(FIELDS)).split(',') if field]
+    if any(field not in FIELDS for field in fields):
+        raise ValueError('fields')
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+
+    key = SORT_KEYS[sort]
+    conditions = filter_conditions(args)
+    result = {}
+    if args.get('count') == '1':
+        result['total'] = db.session.query(func.count(Device.id)).filter(*conditions).scalar()
+
+    if args.get('after'):
+        value, device_id = decode_cursor(args['after'], sort)
+        conditions.append(keyset_condition(key, value, device_id, descending))
+    order = (key.desc(), Device.id.desc()) if descending else (key.asc(), Device.id.asc())
+    rows = (db.session.query(*[getattr(Device, field) for field in fields], key.label('sort_key'))
+            .filter(*conditions)
+            .order_by(*order)
+            .limit(limit + 1)
+            .all())
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    result['devices'] = [{field: getattr(row, field) for field in fields} for row in rows]
+    result['next'] = encode_cursor(sort, rows[-1].sort_key, rows[-1].id) if more else None
+    return result
@@ -0,0 +1,386 @@
+import asyncio
+import collections
+import ipaddress
+import logging
+import os
+import queue
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+import snmp_operations
+from async_poller import LOAD_FACTOR, AsyncSnmpClient, LoadLimit
+from snmp_operations import (NO_VALUE_TYPES, STATUS_OIDS, SYS_DESCR_OID, SYS_NAME_OID, decode_response,
+                             encode_get_request, next_request_id, oid_name)
+
+logger = logging.getLogger(__name__)
+
+# Default send rate of the sweeper (probes per second)
+SWEEP_RATE = 10000
+
+# Minimal interval between progress callbacks (seconds)
+PROGRESS_INTERVAL = 0.5
+
+# Capacity of the queues between scan pipeline stages
+STAGE_QUEUE_SIZE = 1000
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+# Probe methods in order of preference
+METHOD_RAW_ICMP = 'raw-icmp'
+METHOD_DGRAM_ICMP = 'dgram-icmp'
+METHOD_UDP_SNMP = 'udp-snmp'
+
+def count_hosts(network):
+    """
+    Number of addresses network.hosts() yields, without iterating over them
+    """
+    if network.version == 4 and network.prefixlen < 31:
+        return network.num_addresses - 2
+    if network.version == 6 and network.prefixlen < 127:
+        return network.num_addresses - 1
+    return network.num_addresses
+
+def address_family(network):
+    """
+    Socket address family for probing the hosts of network
+    """
+    return socket.AF_INET6 if network.version == 6 else socket.AF_INET
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+def _echo_request(identifier, sequence, family=socket.AF_INET):
+    payload = struct.pack('!d', time.time())
+    if family == socket.AF_INET6:
+        # The kernel fills in the ICMPv6 checksum (it covers the IPv6 pseudo-header)
+        return struct.pack('!BBHHH', ICMPV6_ECHO_REQUEST, 0, 0, identifier, sequence) + payload
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = _checksum(header + payload)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + payload
+
+class Sweeper:
+    """
+    Single-threaded liveness sweep of many hosts over one socket
+
+    Probes are sent at a fixed rate, replies are matched to in-flight probes
+    by source address and identifier/sequence (or SNMP request-id) and hits
+    are yielded as soon as they arrive. Memory is bounded by the number of
+    probes in flight (rate * timeout), not by the size of the range.
+    All addresses must belong to family (AF_INET, or AF_INET6 with ICMPv6 echo).
+    """
+    def __init__(self, rate=SWEEP_RATE, timeout=1, method=None, community='public',
+                 oids=(SYS_DESCR_OID,), progress_callback=None, family=socket.AF_INET):
+        self.rate = rate
+        self.family = family
+        self.timeout = timeout
+        self.community = community
+        self.method = method
+        self.oids = list(oids)
+        self.progress_callback = progress_callback
+        self.identifier = (os.getpid() ^ random.getrandbits(16)) & 0xffff
+        self.sent = 0
+
+    def _open(self):
+        """
+        Open the best available probe socket: raw ICMP (root/CAP_NET_RAW),
+        unprivileged datagram ICMP (Linux ping_group_range) or UDP/161
+        """
+        icmp = socket.IPPROTO_ICMPV6 if self.family == socket.AF_INET6 else socket.IPPROTO_ICMP
+        candidates = [
+            (METHOD_RAW_ICMP, socket.SOCK_RAW, icmp),
+            (METHOD_DGRAM_ICMP, socket.SOCK_DGRAM, icmp),
+            (METHOD_UDP_SNMP, socket.SOCK_DGRAM, socket.IPPROTO_UDP),
+        ]
+        for method, sock_type, proto in candidates:
+            if self.method and self.method != method:
+                continue
+            try:
+                sock = socket.socket(self.family, sock_type, proto)
+            except OSError as e:
+                logger.debug(f"Sweep method {method} unavailable: {str(e)}")
+                continue
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.setblocking(False)
+            logger.info(f"Sweeping with {method} at {self.rate} probes/s")
+            return method, sock
+        raise OSError(f"No usable sweep method (requested: {self.method})")
+
+    def _probe(self, method, sequence):
+        if method == METHOD_UDP_SNMP:
+            return self._snmp_probe
+        return _echo_request(self.identifier, sequence, self.family)
+
+    def _match(self, method, data, address, pending):
+        """
+        Return (ip, var_binds) if the datagram answers an in-flight probe
+
+        var_binds is only set for SNMP probes.
+        """
+        ip = address[0]
+        expected = pending.get(ip)
+        if expected is None:
+            return None
+        if method == METHOD_UDP_SNMP:
+            try:
+                request_id, error_status, var_binds = decode_response(data)
+            except Exception:
+                return None
+            if request_id != self._snmp_request_id or error_status:
+                return None
+            return ip, var_binds
+
+        if method == METHOD_RAW_ICMP and self.family == socket.AF_INET:
+            # Raw IPv4 sockets deliver the IP header as well (raw IPv6 sockets do not)
+            data = data[(data[0] & 0x0f) * 4:]
+        if len(data) < 8:
+            return None
+        icmp_type, _, _, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+        reply = ICMPV6_ECHO_REPLY if self.family == socket.AF_INET6 else ICMP_ECHO_REPLY
+        if icmp_type != reply or sequence != expected:
+            return None
+        # The kernel rewrites the identifier of datagram ICMP sockets
+        if method == METHOD_RAW_ICMP and identifier != self.identifier:
+            return None
+        return ip, None
+
+    def _send(self, sock, probe, address):
+        """
+        Send one probe; False if it could not be sent, and the host then counts as not answering
+        """
+        try:
+            sock.sendto(probe, address)
+            return True
+        except BlockingIOError:
+            # Send buffer full - wait for room once, then give up on this host
+            select.select([], [sock], [], self.timeout)
+        except OSError as e:
+            logger.debug(f"Could not probe {address[0]}: {str(e)}")
+            return False
+        try:
+            sock.sendto(probe, address)
+            return True
+        except OSError as e:
+            logger.debug(f"Could not probe {address[0]}: {str(e)}")
+            return False
+
+    def sweep(self, addresses):
+        """
+        Probe every address and yield the ones that answer, as they answer
+        """
+        for ip, _ in self.probe(addresses):
+            yield ip
+
+    def probe(self, addresses):
+        """
+        Probe every address and yield (ip, var_binds) for each answer
+        """
+        method, sock = self._open()
+        if method == METHOD_UDP_SNMP:
+            # One pre-encoded GetRequest serves every host
+            self._snmp_request_id = next_request_id()
+            self._snmp_probe = encode_get_request(
+                self._snmp_request_id, self.community,
+                [oid_name(oid) for oid in self.oids])
+            port = snmp_operations.SNMP_PORT
+        else:
+            port = 0
+
+        addresses = iter(addresses)
+        pending = {}
+        expiry = collections.deque()
+        interval = 1.0 / self.rate
+        sequence = 0
+        next_send = time.monotonic()
+        next_progress = next_send + PROGRESS_INTERVAL
+        exhausted = False
+        self.sent = 0
+        try:
+            while not exhausted or pending:
+                now = time.monotonic()
+                while not exhausted and now >= next_send:
+                    ip = next(addresses, None)
+                    if ip is None:
+                        exhausted = True
+                        break
+                    ip = str(ip)
+                    self.sent += 1
+                    sequence = (sequence + 1) & 0xffff
+                    sent = self._send(sock, self._probe(method, sequence), (ip, port))
+                    # Do not try to catch up with a backlog after a stall
+                    next_send = max(next_send + interval, now - interval)
+                    if not sent:
+                        continue
+                    pending[ip] = sequence
+                    expiry.append((now + self.timeout, ip))
+
+                if self.progress_callback and now >= next_progress:
+                    self.progress_callback(self.sent)
+                    next_progress = now + PROGRESS_INTERVAL
+
+                if exhausted:
+                    wait = max(0, expiry[0][0] - now) if expiry else 0
+                else:
+                    wait = max(0, next_send - now)
+                if self.progress_callback:
+                    wait = min(wait, PROGRESS_INTERVAL)
+                readable, _, _ = select.select([sock], [], [], wait)
+                while readable:
+                    try:
+                        data, address = sock.recvfrom(65535)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError as e:
+                        logger.debug(f"Sweep receive error: {str(e)}")
+                        break
+                    match = self._match(method, data, address, pending)
+                    if match is not None:
+                        del pending[match[0]]
+                        yield match
+
+                # Expire only after draining the socket, so replies that queued
+                # up while the consumer was busy are still matched
+                now = time.monotonic()
+                while expiry and expiry[0][0] <= now:
+                    pending.pop(expiry.popleft()[1], None)
+            if self.progress_callback:
+                self.progress_callback(self.sent)
+        finally:
+            sock.close()
+
+def discover_snmp_agents(addresses, community='public', rate=SWEEP_RATE, timeout=1,
+                         progress_callback=None, family=socket.AF_INET):
+    """
+    Find SNMP agents directly with a UDP/161 sweep (no ping pass)
+
+    Every address gets the same pre-encoded sysDescr/sysName GetRequest, so
+    agents behind ICMP filters are found too. Yields (ip, info) pairs where
+    info holds the 'name' and 'description' reported by the agent.
+    """
+    sweeper = Sweeper(rate=rate, timeout=timeout, method=METHOD_UDP_SNMP, community=community,
+                      oids=STATUS_OIDS, progress_callback=progress_callback, family=family)
+    for ip, var_binds in sweeper.probe(addresses):
+        yield ip, _agent_info(*(value for _, value in var_binds))
+
+def _agent_info(description, name):
+    info = {'name': None, 'description': None}
+    for key, value in (('description', description), ('name', name)):
+        if value is not None and not isinstance(value, NO_VALUE_TYPES) and str(value) and str(value) != '0':
+            info[key] = str(value)
+    return info
+
+async def _probe_batch(ips, community, concurrency, timeout):
+    client = AsyncSnmpClient(timeout=timeout)
+    limit = LoadLimit(concurrency, timeout * LOAD_FACTOR)
+
+    async def probe(ip):
+        async with limit:
+            error, values = await client.get_values(ip, community, STATUS_OIDS, group='probe')
+            limit.update(client.exchanges)
+            if error:
+                return ip, None
+            return ip, _agent_info(values[SYS_DESCR_OID], values[SYS_NAME_OID])
+
+    try:
+        return await asyncio.gather(*(probe(ip) for ip in ips))
+    finally:
+        client.close()
+
+def probe_snmp_agents(batches, community='public', concurrency=100, timeout=1):
+    """
+    SNMP-probe batches of live IPs concurrently
+
+    Yields (ip, info) for every probed IP; info is None if the host did not
+    answer SNMP, otherwise it holds the agent's 'name' and 'description'.
+    """
+    for batch in batches:
+        yield from asyncio.run(_probe_batch(batch, community, concurrency, timeout))
+
+class BoundedStage:
+    """
+    Run a producer generator in a background thread behind a bounded queue
+
+    When the consumer falls behind the queue fills up and the producer blocks,
+    so a fast stage (e.g. the sweep) cannot run arbitrarily far ahead of a
+    slow one (e.g. SNMP probing or DB inserts).
+    """
+    _DONE = object()
+
+    def __init__(self, iterable, maxsize=STAGE_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(iterable,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put(item):
+                    return
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(self._DONE)
+
+    def batches(self, max_size):
+        """
+        Yield lists of up to max_size items: wait for the first item, then take
+        whatever else is already queued (results are never held back to fill a batch)
+        """
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._DONE:
+                    break
+                batch = [item]
+                while len(batch) < max_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is self._DONE:
+                        self._queue.put(item)
+                        break
+                    batch.append(item)
+                yield batch
+            if self._error is not None:
+                raise self._error
+        finally:
+            self._stop.set()
+
+    def __iter__(self):
+        for batch in self.batches(1):
+            yield batch[0]
+
+def find_active_ips(ip_range, timeout=1, rate=SWEEP_RATE):
+    """
+    Find all active IPs in a range with an in-process ICMP sweep
+    """
+    try:
+        network = ipaddress.ip_network(ip_range, strict=False)
+        sweeper = Sweeper(rate=rate, timeout=timeout, family=address_family(network))
+        return list(sweeper.sweep(network.hosts()))
+    except Exception as e:
+        logger.error(f"Error finding active IPs: {str(e)}")
+        return []
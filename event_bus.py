@@ -0,0 +1,159 @@
+import collections
+import threading
+
+# Events kept per channel for subscribers that join late or reconnect
+REPLAY_SIZE = 200
+
+# Finished channels (e.g. completed scans) kept for late joiners
+FINISHED_CHANNELS = 16
+
+# Event types that are snapshots: only the newest undelivered one matters
+COALESCED_TYPES = frozenset({'progress', 'active_ips'})
+
+def _append(events, event_id, event, coalesced_types):
+    """
+    Append an event, dropping the older event of the same type if coalesced
+    (so at most one event of each coalesced type is ever queued)
+    """
+    if event['type'] in coalesced_types:
+        stale = next((item for item in events if item[1]['type'] == event['type']), None)
+        if stale is not None:
+            events.remove(stale)
+    events.append((event_id, event))
+
+class Subscription:
+    """
+    One subscriber's view of a channel: pending events in delivery order
+
+    A coalesced event replaces the pending event of its type, so a slow
+    reader gets the latest progress instead of a growing backlog; a reader
+    more than backlog (by default replay_size) events behind loses the oldest ones.
+    """
+    def __init__(self, bus, channel, events, backlog=None):
+        self.bus = bus
+        self.channel = channel
+        self._pending = collections.deque(events, maxlen=backlog or bus.replay_size)
+        self._ready = threading.Condition(bus._lock)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _push(self, event_id, event):
+        _append(self._pending, event_id, event, self.bus.coalesced_types)
+        self._ready.notify()
+
+    def get(self, timeout=None):
+        """
+        Next (event id, event) pair, or None after timeout or once the
+        subscription is closed and drained
+        """
+        with self._ready:
+            if not self._pending and not self.closed:
+                self._ready.wait(timeout)
+            return self._pending.popleft() if self._pending else None
+
+    def close(self):
+        self.bus._unsubscribe(self)
+
+class _Channel:
+    __slots__ = ('last_id', 'replay', 'subscribers', 'finished')
+
+    def __init__(self, replay_size):
+        self.last_id = 0
+        self.replay = collections.deque(maxlen=replay_size)
+        self.subscribers = set()
+        self.finished = False
+
+class EventBus:
+    """
+    Named event channels with fan-out to any number of subscribers
+
+    Every channel keeps a bounded replay buffer, so a subscriber that joins
+    late (or reconnects with the last event id it saw) first receives the
+    buffered events it missed. Coalesced event types keep only their newest
+    event in the replay buffer too. Events are dicts with at least a 'type' key.
+    """
+    def __init__(self, replay_size=REPLAY_SIZE, finished_channels=FINISHED_CHANNELS,
+                 coalesced_types=COALESCED_TYPES):
+        self.replay_size = replay_size
+        self.finished_channels = finished_channels
+        self.coalesced_types = coalesced_types
+        self._channels = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _channel(self, name):
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = _Channel(self.replay_size)
+        return channel
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._channels
+
+    def last_id(self, name):
+        """
+        Id of the newest event published to a channel (0 if none)
+        """
+        with self._lock:
+            channel = self._channels.get(name)
+            return channel.last_id if channel is not None else 0
+
+    def publish(self, name, event):
+        """
+        Append an event to a channel and wake its subscribers; returns the event id
+        """
+        with self._lock:
+            channel = self._channel(name)
+            event_id = channel.last_id = channel.last_id + 1
+            _append(channel.replay, event_id, event, self.coalesced_types)
+            for subscription in channel.subscribers:
+                subscription._push(event_id, event)
+            return event_id
+
+    def subscribe(self, name, last_id=None, replay=True, backlog=None):
+        """
+        Subscribe to a channel, replaying buffered events newer than last_id
+        (all buffered events if None, none if replay is False and last_id is None);
+        backlog bounds the pending events (replay_size by default)
+        """
+        with self._lock:
+            channel = self._channel(name)
+            if last_id is None and not replay:
+                events = []
+            else:
+                events = [item for item in channel.replay if last_id is None or item[0] > last_id]
+            subscription = Subscription(self, name, events, backlog)
+            subscription.closed = channel.finished
+            if not channel.finished:
+                channel.subscribers.add(subscription)
+            return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscription.closed = True
+            channel = self._channels.get(subscription.channel)
+            if channel is not None:
+                channel.subscribers.discard(subscription)
+            subscription._ready.notify()
+
+    def finish(self, name):
+        """
+        Mark a channel as finished: subscribers drain what is pending and stop,
+        and only the newest finished channels are kept for late joiners
+        """
+        with self._lock:
+            channel = self._channel(name)
+            channel.finished = True
+            for subscription in channel.subscribers:
+                subscription.closed = True
+                subscription._ready.notify()
+            channel.subscribers.clear()
+            self._channels.move_to_end(name)
+            finished = [key for key, value in self._channels.items() if value.finished]
+            for key in finished[:len(finished) - self.finished_channels]:
+                del self._channels[key]
@@ -0,0 +1,158 @@
+import collections
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import func
+
+from models import db, EventLog
+
+logger = logging.getLogger(__name__)
+
+# Events kept in the log table; older ones are trimmed by the writer
+RETENTION = 10000
+
+# How often a relay looks for new events (seconds)
+RELAY_INTERVAL = 0.5
+
+# Events read or written in one transaction
+BATCH_SIZE = 500
+
+# Events a forwarder may fall behind before it drops the oldest ones
+FORWARD_BACKLOG = 100000
+
+# How long a forwarder waits before writing a failed batch again (seconds)
+RETRY_INTERVAL = 1
+
+def last_id():
+    """
+    Id of the newest logged event (0 if the log is empty)
+    """
+    return db.session.query(func.max(EventLog.id)).scalar() or 0
+
+def read(after, limit=BATCH_SIZE):
+    """
+    Logged (id, channel, event, origin) tuples newer than the given id, oldest first
+    """
+    rows = (db.session.query(EventLog.id, EventLog.channel, EventLog.payload, EventLog.origin)
+            .filter(EventLog.id > after)
+            .order_by(EventLog.id)
+            .limit(limit)
+            .all())
+    return [(event_id, channel, json.loads(payload), origin) for event_id, channel, payload, origin in rows]
+
+def write(events, retention=RETENTION, origin=None):
+    """
+    Append (channel, event) pairs written by the given origin to the log and
+    trim it to the newest retention events, in one transaction; returns the
+    id of the last appended event
+    """
+    rows = [EventLog(channel=channel, payload=json.dumps(event), origin=origin) for channel, event in events]
+    db.session.add_all(rows)
+    db.session.flush()
+    newest = rows[-1].id
+    db.session.query(EventLog).filter(EventLog.id <= newest - retention).delete(synchronize_session=False)
+    db.session.commit()
+    return newest
+
+class EventForwarder(threading.Thread):
+    """
+    Copy the events a process publishes on a channel into the log, in batches
+
+    Every process that changes devices (web workers, a standalone poller)
+    hands its events over with forward(); the EventRelay of every other
+    process publishes them again on its own bus. Events are only queued
+    once the thread runs. A batch that cannot be written goes back to the
+    front of the queue and is retried; a forwarder more than backlog events
+    behind drops the oldest ones and counts them in dropped.
+    """
+    def __init__(self, app, channel, origin, backlog=FORWARD_BACKLOG):
+        super().__init__(name='event-forwarder', daemon=True)
+        self.app = app
+        self.channel = channel
+        self.origin = origin
+        self._queue = collections.deque()
+        self._backlog = backlog
+        self._ready = threading.Condition()
+        self._unwritten = 0
+        # Id of the last event written to the log
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def pending(self):
+        """
+        Whether forwarded events have not been written (committed) yet
+        """
+        with self._ready:
+            return self._unwritten > 0
+
+    def forward(self, event):
+        if not self.is_alive():
+            return
+        with self._ready:
+            self._queue.append(event)
+            self._unwritten += 1
+            self._trim()
+            self._ready.notify()
+
+    def _trim(self):
+        # Called with self._ready held
+        while len(self._queue) > self._backlog:
+            self._queue.popleft()
+            self._unwritten -= 1
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            with self._ready:
+                while not self._queue:
+                    self._ready.wait()
+                events = [self._queue.popleft() for _ in range(min(len(self._queue), BATCH_SIZE))]
+            try:
+                with self.app.app_context():
+                    written = write([(self.channel, event) for event in events], origin=self.origin)
+            except Exception as e:
+                logger.error(f"Failed to forward {len(events)} events, retrying in {RETRY_INTERVAL}s: {str(e)}")
+                with self._ready:
+                    self._queue.extendleft(reversed(events))
+                    self._trim()
+                time.sleep(RETRY_INTERVAL)
+                continue
+            with self._ready:
+                self.written = max(self.written, written)
+                self._unwritten -= len(events)
+
+class EventRelay(threading.Thread):
+    """
+    Publish events appended to the log by other processes on a local bus
+
+    Starts at the end of the log: a relay only delivers events logged after
+    it started (subscribers that need older state load it from the database).
+    Events logged by its own origin were published locally and are skipped.
+    position is the id of the newest logged event the relay has read.
+    """
+    def __init__(self, app, bus, origin=None, interval=RELAY_INTERVAL):
+        super().__init__(name='event-relay', daemon=True)
+        self.app = app
+        self.bus = bus
+        self.origin = origin
+        self.interval = interval
+        with app.app_context():
+            self.position = last_id()
+
+    def run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    events = read(self.position)
+                for event_id, channel, event, origin in events:
+                    if origin is None or origin != self.origin:
+                        self.bus.publish(channel, event)
+                    self.position = event_id
+                if len(events) == BATCH_SIZE:
+                    continue
+            except Exception as e:
+                logger.error(f"Event relay error: {str(e)}")
+            time.sleep(self.interval)
@@ -0,0 +1,258 @@
+import bisect
+import math
+import threading
+import weakref
+
+# Upper bounds (seconds) of the default latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Upper bounds (seconds) for whole poll batches and database flushes
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class _ThreadCells:
+    """
+    Per-thread cells of one metric, folded into the metric's retired cells
+    when the thread exits
+    """
+    __slots__ = ('cells', '__weakref__')
+
+    def __init__(self):
+        self.cells = {}
+
+class _Metric:
+    """
+    Base of the metrics: values are accumulated per thread without locking
+
+    Every thread records into its own dict of label values -> cell, so the
+    hot path is a thread-local lookup and an in-place add. Collection sums
+    the cells of the live threads and of the threads that already exited.
+    """
+    kind = None
+
+    def __init__(self, registry, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._live = {}  # id -> cell dict of a live thread
+        self._retired = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _cells(self):
+        try:
+            return self._local.holder.cells
+        except AttributeError:
+            holder = self._local.holder = _ThreadCells()
+            cells = holder.cells
+            with self._lock:
+                self._live[id(cells)] = cells
+            # threading.local drops the holder when the thread exits
+            weakref.finalize(holder, self._retire, cells)
+            return cells
+
+    def _retire(self, cells):
+        with self._lock:
+            del self._live[id(cells)]
+            for labels, cell in cells.items():
+                self._add(self._retired, labels, cell)
+
+    def _snapshot(self):
+        """
+        {label values: cell} summed over all threads
+        """
+        with self._lock:
+            sources = [self._retired, *self._live.values()]
+            total = {}
+            for cells in sources:
+                for labels, cell in cells.copy().items():
+                    self._add(total, labels, cell)
+        return total
+
+    def drain(self):
+        """
+        Take the accumulated values and reset them (only safe while no other
+        thread records into this metric)
+        """
+        total = self._snapshot()
+        with self._lock:
+            self._retired = {}
+            for cells in self._live.values():
+                cells.clear()
+        return total
+
+    def merge(self, values):
+        """
+        Add values taken with drain() (e.g. from a worker process)
+        """
+        cells = self._cells()
+        for labels, cell in values.items():
+            self._add(cells, tuple(labels), cell)
+
+    def _label_text(self, labels, extra=()):
+        pairs = list(zip(self.labels, labels)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+class Counter(_Metric):
+    """
+    Monotonic count, e.g. timeouts; inc(*label_values, amount=1)
+    """
+    kind = 'counter'
+
+    @staticmethod
+    def _add(cells, labels, value):
+        cells[labels] = cells.get(labels, 0) + value
+
+    def inc(self, *labels, amount=1):
+        cells = self._cells()
+        cells[labels] = cells.get(labels, 0) + amount
+
+    def _samples(self):
+        return [f'{self.name}{self._label_text(labels)} {_format(value)}'
+                for labels, value in sorted(self._snapshot().items())]
+
+class Gauge(Counter):
+    """
+    Value that goes up and down (inc/dec, e.g. open streams), or one read
+    from function() at collection time: a number or {label values: number}
+    """
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, labels=(), function=None):
+        self.function = function
+        super().__init__(registry, name, help, labels)
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def _samples(self):
+        if self.function is None:
+            return super()._samples()
+        value = self.function()
+        values = value if isinstance(value, dict) else {(): value}
+        return [f'{self.name}{self._label_text(labels)} {_format(value)}'
+                for labels, value in sorted(values.items())]
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets; observe(value, *label_values)
+    """
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, help, labels)
+
+    @staticmethod
+    def _add(cells, labels, cell):
+        current = cells.get(labels)
+        if current is None:
+            cells[labels] = list(cell)
+        else:
+            for index, value in enumerate(cell):
+                current[index] += value
+
+    def observe(self, value, *labels):
+        cells = self._cells()
+        cell = cells.get(labels)
+        if cell is None:
+            # One count per bucket (the last one is +Inf), then the sum
+            cell = cells[labels] = [0] * (len(self.buckets) + 2)
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def _samples(self):
+        lines = []
+        for labels, cell in sorted(self._snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), cell):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._label_text(labels, [("le", _format(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{self._label_text(labels)} {_format(cell[-1])}')
+            lines.append(f'{self.name}_count{self._label_text(labels)} {cumulative}')
+        return lines
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Registry:
+    """
+    Named metrics of one process, rendered in the Prometheus text format
+    """
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Duplicate metric {metric.name}')
+        self.metrics[metric.name] = metric
+
+    def counter(self, name, help, labels=()):
+        return Counter(self, name, help, labels)
+
+    def gauge(self, name, help, labels=(), function=None):
+        return Gauge(self, name, help, labels, function)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, help, labels, buckets)
+
+    def drain(self):
+        """
+        {metric name: values} accumulated since the last drain, for merge()
+        in another process; callback gauges are skipped
+        """
+        return {name: values for name, metric in self.metrics.items()
+                if not getattr(metric, 'function', None) and (values := metric.drain())}
+
+    def merge(self, snapshot):
+        for name, values in snapshot.items():
+            metric = self.metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# SNMP requests of the asyncio client; group names the OID set of the request:
+# poll (status, metrics and interface counters in one walk), profiled (the instances
+# of a device's capability profile), status (fallback GET), counters (32-bit ifTable
+# fallback), probe (scan discovery)
+SNMP_REQUEST_SECONDS = REGISTRY.histogram(
+    'nyo_snmp_request_seconds', 'Round-trip time of answered SNMP requests', ('group',))
+SNMP_TIMEOUTS = REGISTRY.counter(
+    'nyo_snmp_timeouts_total', 'SNMP request attempts without a response', ('group',))
+POLL_ERRORS = REGISTRY.counter(
+    'nyo_poll_errors_total', 'Failed device polls by cause (timeout, deadline, SNMP error status, exception)',
+    ('type',))
+POLLED_DEVICES = REGISTRY.counter(
+    'nyo_polled_devices_total', 'Device poll results by outcome (active, inactive, shared)', ('result',))
+POLL_CYCLE_SECONDS = REGISTRY.histogram(
+    'nyo_poll_cycle_seconds', 'Duration of one poll batch (due devices or a check-all batch)', buckets=DURATION_BUCKETS)
+DB_FLUSH_SECONDS = REGISTRY.histogram(
+    'nyo_db_flush_seconds', 'Duration of batched database writes', ('kind',), buckets=DURATION_BUCKETS)
+SCAN_ADDRESSES = REGISTRY.counter(
+    'nyo_scan_addresses_total', 'Addresses swept by range scans (rate() gives the sweep rate)')
+SCAN_FOUND = REGISTRY.counter('nyo_scan_found_total', 'New devices found by range scans')
+SSE_STREAMS = REGISTRY.gauge('nyo_sse_streams', 'Open server-sent event streams', ('channel',))
+TRAPS_RECEIVED = REGISTRY.counter(
+    'nyo_traps_received_total', 'SNMP traps and informs received by type (coldStart, warmStart, linkDown, linkUp, '
+    'other, invalid)', ('type',))
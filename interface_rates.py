@@ -0,0 +1,158 @@
+import threading
+from array import array
+
+from snmp_operations import COUNTER_FIELDS
+
+# sysUpTime is a 32-bit TimeTicks (hundredths of a second) value
+UPTIME_WRAP = 2 ** 32
+UPTIME_SLACK = 1.5
+
+# Rates above this multiple of the interface speed are treated as a counter
+# discontinuity (e.g. a counter reset that looks like a 32-bit wrap)
+MAX_SPEED_RATIO = 1.5
+
+# Marks a counter the agent did not report in the previous sample
+MISSING = 2 ** 64 - 1
+
+class CounterStore:
+    """
+    Previous interface counter sample per (device, ifIndex), kept in flat arrays
+
+    Each interface owns one slot: an int key maps to a slot number and every
+    counter field is a column array('Q') indexed by slot, so memory grows by a
+    few dozen bytes per interface and no Python object is kept per sample.
+    Rates are computed against sysUpTime (the agent's clock), which also
+    exposes agent restarts.
+
+    The poller, check jobs and request threads share one store, so update()
+    and forget() hold a lock: slots are allocated by appending to every
+    column, and two threads doing so at once would get the same slot.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._free = []
+        self._counters = {field: array('Q') for field in COUNTER_FIELDS}
+        self._uptime = array('Q')
+        self._time = array('d')
+        self._width = array('B')
+
+    def __len__(self):
+        return len(self._slots)
+
+    @staticmethod
+    def _key(device_id, if_index):
+        return device_id << 32 | if_index
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        for column in self._counters.values():
+            column.append(MISSING)
+        self._uptime.append(0)
+        self._time.append(0.0)
+        self._width.append(0)
+        return len(self._uptime) - 1
+
+    def _store(self, slot, sample, position, now):
+        for field, column in self._counters.items():
+            value = sample[field][position]
+            column[slot] = MISSING if value is None else value
+        self._uptime[slot] = sample['uptime']
+        self._time[slot] = now
+        self._width[slot] = sample['width']
+
+    def forget(self, device_ids):
+        """
+        Release the slots of deleted devices
+        """
+        device_ids = set(device_ids)
+        with self._lock:
+            for key in [key for key in self._slots if key >> 32 in device_ids]:
+                self._free.append(self._slots.pop(key))
+
+    def _elapsed(self, slot, uptime, now):
+        """
+        Seconds between the previous sample and this one by the agent's clock,
+        or None if the agent restarted (counters were reset)
+        """
+        ticks = uptime - self._uptime[slot]
+        if ticks < 0:
+            # A wrap only if the previous value was close enough to the limit
+            # (with some slack for clock skew), otherwise the agent restarted
+            if self._uptime[slot] + (now - self._time[slot]) * 100 * UPTIME_SLACK < UPTIME_WRAP:
+                return None
+            ticks += UPTIME_WRAP
+        return ticks / 100
+
+    def update(self, device_id, sample, now):
+        """
+        Store a sample from snmp_operations.interface_counters and return the rates
+
+        Returns (if_index, in_bps, out_bps, in_pps, out_pps) tuples for every
+        interface that has a usable previous sample; a rate is None where it
+        cannot be computed (missing counter, reset or implausible jump).
+        """
+        with self._lock:
+            rates = []
+            uptime, width = sample['uptime'], sample['width']
+            for position, if_index in enumerate(sample['index']):
+                if not isinstance(if_index, int) or sample['in_octets'][position] is None:
+                    continue
+                key = self._key(device_id, if_index)
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._slots[key] = self._allocate()
+                    self._store(slot, sample, position, now)
+                    continue
+
+                elapsed = self._elapsed(slot, uptime, now)
+                if elapsed == 0:
+                    continue
+                if elapsed is None or self._width[slot] != width:
+                    # Agent restarted or switched counter width - start over from this sample
+                    self._store(slot, sample, position, now)
+                    continue
+
+                deltas = {}
+                for field, column in self._counters.items():
+                    deltas[field] = _delta(column[slot], sample[field][position], width)
+                self._store(slot, sample, position, now)
+
+                in_bps = _rate(deltas['in_octets'], elapsed, 8)
+                out_bps = _rate(deltas['out_octets'], elapsed, 8)
+                speed = sample['speed'][position]
+                if speed:
+                    limit = speed * MAX_SPEED_RATIO
+                    in_bps = None if in_bps is not None and in_bps > limit else in_bps
+                    out_bps = None if out_bps is not None and out_bps > limit else out_bps
+                rates.append((
+                    if_index,
+                    in_bps,
+                    out_bps,
+                    _rate(_sum(deltas['in_ucast'], deltas['in_nucast']), elapsed),
+                    _rate(_sum(deltas['out_ucast'], deltas['out_nucast']), elapsed),
+                ))
+        return rates
+
+def _delta(previous, current, width):
+    """
+    Counter increase between two samples, accounting for one 32-bit wrap
+
+    A decreasing 64-bit counter cannot have wrapped in any realistic interval,
+    so it is treated as a reset (None).
+    """
+    if previous == MISSING or current is None:
+        return None
+    delta = current - previous
+    if delta < 0:
+        if width != 32:
+            return None
+        delta += 2 ** 32
+    return delta
+
+def _sum(*deltas):
+    return None if None in deltas else sum(deltas)
+
+def _rate(delta, elapsed, scale=1):
+    return None if delta is None else round(delta * scale / elapsed, 2)
@@ -0,0 +1,228 @@
+import time
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, InterfaceRate, MetricSample, MetricRollup
+
+# Resolution 0 means raw samples
+RAW = 0
+# Rollup resolutions in seconds (1m, 5m, 1h)
+RESOLUTIONS = (60, 300, 3600)
+# How long data of each resolution is kept, in seconds
+RETENTION = {
+    RAW: 24 * 3600,
+    60: 7 * 24 * 3600,
+    300: 30 * 24 * 3600,
+    3600: 365 * 24 * 3600,
+}
+# Number of points a query returns when no step is given
+DEFAULT_POINTS = 500
+
+def _rollup_row(sample, resolution):
+    cpu, memory = sample['cpu_usage'], sample['memory_used']
+    return {
+        'device_id': sample['device_id'],
+        'resolution': resolution,
+        'bucket': sample['ts'] - sample['ts'] % resolution,
+        'cpu_min': cpu,
+        'cpu_max': cpu,
+        'cpu_sum': cpu or 0,
+        'cpu_count': 0 if cpu is None else 1,
+        'memory_min': memory,
+        'memory_max': memory,
+        'memory_sum': memory or 0,
+        'memory_count': 0 if memory is None else 1,
+        'memory_total': sample['memory_total'],
+    }
+
+def _merge_min(column, new):
+    # SQLite's scalar min()/max() return NULL if any argument is NULL
+    return func.min(func.coalesce(column, new), func.coalesce(new, column))
+
+def _merge_max(column, new):
+    return func.max(func.coalesce(column, new), func.coalesce(new, column))
+
+def record_samples(samples):
+    """
+    Append raw samples and fold them into every rollup resolution
+
+    samples is a list of dicts with device_id, ts (epoch seconds), cpu_usage,
+    memory_used and memory_total. Rollups are updated incrementally with
+    upserts, so queries never have to aggregate raw rows. A sample whose
+    (device_id, ts) is already stored (a retried batch, two pollers during a
+    lease handover) is skipped and not counted in the rollups again.
+    Returns the number of samples recorded.
+    """
+    samples = [s for s in samples if s['cpu_usage'] is not None or s['memory_used'] is not None]
+    if not samples:
+        return 0
+
+    inserted = set(db.session.execute(
+        sqlite_insert(MetricSample).on_conflict_do_nothing().returning(MetricSample.device_id, MetricSample.ts),
+        samples))
+    fresh = []
+    for sample in samples:
+        key = (sample['device_id'], sample['ts'])
+        # Of repeated keys within the batch only the first one was inserted
+        if key in inserted:
+            inserted.discard(key)
+            fresh.append(sample)
+    samples = fresh
+    if not samples:
+        db.session.commit()
+        return 0
+
+    stmt = sqlite_insert(MetricRollup)
+    new = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MetricRollup.device_id, MetricRollup.resolution, MetricRollup.bucket],
+        set_={
+            'cpu_min': _merge_min(MetricRollup.cpu_min, new.cpu_min),
+            'cpu_max': _merge_max(MetricRollup.cpu_max, new.cpu_max),
+            'cpu_sum': MetricRollup.cpu_sum + new.cpu_sum,
+            'cpu_count': MetricRollup.cpu_count + new.cpu_count,
+            'memory_min': _merge_min(MetricRollup.memory_min, new.memory_min),
+            'memory_max': _merge_max(MetricRollup.memory_max, new.memory_max),
+            'memory_sum': MetricRollup.memory_sum + new.memory_sum,
+            'memory_count': MetricRollup.memory_count + new.memory_count,
+            'memory_total': func.coalesce(new.memory_total, MetricRollup.memory_total),
+        })
+    for resolution in RESOLUTIONS:
+        db.session.execute(stmt, [_rollup_row(sample, resolution) for sample in samples])
+    db.session.commit()
+    return len(samples)
+
+RATE_FIELDS = ('in_bps', 'out_bps', 'in_pps', 'out_pps')
+
+def record_interface_rates(device_id, rates, ts):
+    """
+    Append (if_index, in_bps, out_bps, in_pps, out_pps) rates of one device
+    (caller commits)
+    """
+    if rates:
+        db.session.execute(sqlite_insert(InterfaceRate).on_conflict_do_nothing(), [
+            dict(zip(RATE_FIELDS, rate[1:]), device_id=device_id, if_index=rate[0], ts=ts)
+            for rate in rates
+        ])
+    return len(rates)
+
+def query_interface_rates(device_id, start, end):
+    """
+    Interface rates of a device in [start, end), column-oriented per ifIndex
+    """
+    rows = db.session.query(
+        InterfaceRate.if_index, InterfaceRate.ts,
+        InterfaceRate.in_bps, InterfaceRate.out_bps, InterfaceRate.in_pps, InterfaceRate.out_pps
+    ).filter(
+        InterfaceRate.device_id == device_id,
+        InterfaceRate.ts >= start,
+        InterfaceRate.ts < end,
+    ).order_by(InterfaceRate.if_index, InterfaceRate.ts)
+
+    interfaces = {}
+    for if_index, ts, *rates in rows:
+        series = interfaces.get(if_index)
+        if series is None:
+            series = interfaces[if_index] = {'t': [], **{field: [] for field in RATE_FIELDS}}
+        series['t'].append(ts)
+        for field, rate in zip(RATE_FIELDS, rates):
+            series[field].append(rate)
+    return {'device_id': device_id, 'from': start, 'to': end, 'interfaces': interfaces}
+
+def evict_expired(now=None):
+    """
+    Delete raw samples, interface rates and rollups older than their retention period
+    """
+    now = int(now or time.time())
+    db.session.execute(delete(MetricSample).where(MetricSample.ts < now - RETENTION[RAW]))
+    db.session.execute(delete(InterfaceRate).where(InterfaceRate.ts < now - RETENTION[RAW]))
+    for resolution in RESOLUTIONS:
+        db.session.execute(delete(MetricRollup).where(
+            MetricRollup.resolution == resolution,
+            MetricRollup.bucket < now - RETENTION[resolution]))
+    db.session.commit()
+
+def delete_history(device_ids):
+    """
+    Delete all samples, interface rates and rollups of the given devices (caller commits)
+    """
+    db.session.execute(delete(MetricSample).where(MetricSample.device_id.in_(device_ids)))
+    db.session.execute(delete(InterfaceRate).where(InterfaceRate.device_id.in_(device_ids)))
+    db.session.execute(delete(MetricRollup).where(MetricRollup.device_id.in_(device_ids)))
+
+def choose_resolution(start, step, now=None):
+    """
+    Pick the coarsest stored resolution not coarser than step that still
+    covers start (older data only survives in coarser rollups)
+    """
+    now = int(now or time.time())
+    resolutions = (RAW,) + RESOLUTIONS
+    index = max(i for i, resolution in enumerate(resolutions) if resolution <= step)
+    while index < len(resolutions) - 1 and start < now - RETENTION[resolutions[index]]:
+        index += 1
+    return resolutions[index]
+
+def _stats(minimum, average, maximum):
+    return {'min': minimum, 'avg': None if average is None else round(average, 2), 'max': maximum}
+
+def query_metrics(device_id, start, end, step=None):
+    """
+    Return metric points for [start, end) aggregated into step-second buckets
+
+    Served from the rollup table whenever step >= 60 s; raw samples are only
+    read for fine-grained queries over recent data.
+    """
+    if not step:
+        step = max(1, (end - start) // DEFAULT_POINTS)
+    resolution = choose_resolution(start, step)
+    if resolution:
+        # Buckets must be whole multiples of the stored resolution
+        step = max(resolution, -(-step // resolution) * resolution)
+
+    if resolution == RAW:
+        bucket = MetricSample.ts - MetricSample.ts % step
+        rows = db.session.query(
+            bucket,
+            func.min(MetricSample.cpu_usage), func.avg(MetricSample.cpu_usage), func.max(MetricSample.cpu_usage),
+            func.min(MetricSample.memory_used), func.avg(MetricSample.memory_used), func.max(MetricSample.memory_used),
+            func.max(MetricSample.memory_total),
+        ).filter(
+            MetricSample.device_id == device_id,
+            MetricSample.ts >= start,
+            MetricSample.ts < end,
+        ).group_by(bucket).order_by(bucket)
+    else:
+        bucket = MetricRollup.bucket - MetricRollup.bucket % step
+        rows = db.session.query(
+            bucket,
+            func.min(MetricRollup.cpu_min),
+            func.sum(MetricRollup.cpu_sum) / func.nullif(func.sum(MetricRollup.cpu_count), 0),
+            func.max(MetricRollup.cpu_max),
+            func.min(MetricRollup.memory_min),
+            func.sum(MetricRollup.memory_sum) * 1.0 / func.nullif(func.sum(MetricRollup.memory_count), 0),
+            func.max(MetricRollup.memory_max),
+            func.max(MetricRollup.memory_total),
+        ).filter(
+            MetricRollup.device_id == device_id,
+            MetricRollup.resolution == resolution,
+            MetricRollup.bucket >= start - start % resolution,
+            MetricRollup.bucket < end,
+        ).group_by(bucket).order_by(bucket)
+
+    return {
+        'device_id': device_id,
+        'from': start,
+        'to': end,
+        'step': step,
+        'resolution': resolution or 'raw',
+        'points': [
+            {
+                't': row[0],
+                'cpu_usage': _stats(row[1], row[2], row[3]),
+                'memory_used': _stats(row[4], row[5], row[6]),
+                'memory_total': row[7],
+            }
+            for row in rows
+        ],
+    }
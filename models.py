@@ -0,0 +1,165 @@
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import validates
+import ipaddress
+import logging
+import sqlite3
+
+db = SQLAlchemy()
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """Tryb WAL: odczyty panelu nie blokują zapisów pollera (i odwrotnie)"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
+logger = logging.getLogger(__name__)
+
+# Adresy IPv4 zapisywane są jako adresy IPv4-mapped (::ffff:a.b.c.d), więc IPv4 i IPv6
+# mają wspólną, 16-bajtową przestrzeń kluczy sortowaną jak liczby
+_IPV4_MAPPED = bytes(10) + b'\xff\xff'
+
+def pack_ip(ip):
+    """Adres IP (tekst lub obiekt ipaddress) jako 16 bajtów; porządek bajtów = porządek adresów"""
+    address = ipaddress.ip_address(ip)
+    if address.version == 4:
+        return _IPV4_MAPPED + address.packed
+    return address.packed
+
+def unpack_ip(packed):
+    """Odwrotność pack_ip: tekstowa postać adresu"""
+    if packed.startswith(_IPV4_MAPPED):
+        return str(ipaddress.IPv4Address(packed[12:]))
+    return str(ipaddress.IPv6Address(packed))
+
+def normalize_ip(ip):
+    """Kanoniczna postać tekstowa adresu (IPv6 skrócony, IPv4-mapped jako IPv4)"""
+    return unpack_ip(pack_ip(ip))
+
+class Device(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    ip_address = db.Column(db.String(45), nullable=False)  # postać tekstowa (do wyświetlania)
+    ip_packed = db.Column(db.LargeBinary(16), nullable=False)  # pack_ip(ip_address): wyszukiwanie, sortowanie, podsieci
+    name = db.Column(db.String(100))
+    status = db.Column(db.String(20))
+    last_checked = db.Column(db.DateTime)  # czas ostatniego odpytania (brak - urządzenie jeszcze nie odpytane)
+    snmp_community = db.Column(db.String(50), default='public')
+    uptime = db.Column(db.String(50))
+    cpu_usage = db.Column(db.Float)
+    memory_used = db.Column(db.Integer)  # w MB
+    memory_total = db.Column(db.Integer)  # w MB
+    snmp_profile = db.Column(db.Text)  # profil możliwości SNMP (device_profile) jako JSON
+
+    __table_args__ = (
+        db.Index('ix_device_ip_packed', 'ip_packed', unique=True),
+        # filtr statusu w panelu (domyślnie sortowany po adresie) i lista nieaktywnych
+        # urządzeń od najdawniej sprawdzanych
+        db.Index('ix_device_status_ip_packed', 'status', 'ip_packed'),
+        db.Index('ix_device_status_last_checked', 'status', 'last_checked'),
+        db.Index('ix_device_last_checked', 'last_checked'),
+        db.Index('ix_device_name', 'name'),
+    )
+
+    @validates('ip_address')
+    def _pack_ip_address(self, key, ip):
+        self.ip_packed = pack_ip(ip)
+        return normalize_ip(ip)
+
+class MetricSample(db.Model):
+    """Surowa próbka metryk (tylko dopisywanie, czas jako sekundy epoki)"""
+    device_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ts = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cpu_usage = db.Column(db.Float)
+    memory_used = db.Column(db.Integer)  # w MB
+    memory_total = db.Column(db.Integer)  # w MB
+
+    __table_args__ = (db.Index('ix_metric_sample_ts', 'ts'),)
+
+class MetricRollup(db.Model):
+    """Agregat metryk urządzenia w przedziale o długości `resolution` sekund"""
+    device_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    resolution = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)  # początek przedziału
+    cpu_min = db.Column(db.Float)
+    cpu_max = db.Column(db.Float)
+    cpu_sum = db.Column(db.Float, default=0)
+    cpu_count = db.Column(db.Integer, default=0)
+    memory_min = db.Column(db.Integer)
+    memory_max = db.Column(db.Integer)
+    memory_sum = db.Column(db.Integer, default=0)
+    memory_count = db.Column(db.Integer, default=0)
+    memory_total = db.Column(db.Integer)
+
+    __table_args__ = (db.Index('ix_metric_rollup_resolution_bucket', 'resolution', 'bucket'),)
+
+class InterfaceRate(db.Model):
+    """Przepływność interfejsu wyliczona z dwóch kolejnych próbek liczników (same liczniki nie są zapisywane)"""
+    device_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    if_index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ts = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    in_bps = db.Column(db.Float)
+    out_bps = db.Column(db.Float)
+    in_pps = db.Column(db.Float)
+    out_pps = db.Column(db.Float)
+
+    __table_args__ = (db.Index('ix_interface_rate_ts', 'ts'),)
+
+class EventLog(db.Model):
+    """Zdarzenie szyny zdarzeń przekazywane między procesami (np. z pollera do serwera WWW)"""
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # zdarzenie jako JSON
+    origin = db.Column(db.String(16))  # proces, który zapisał zdarzenie (jego relay je pomija)
+
+class PollerLease(db.Model):
+    """Blokada lidera: odpytuje tylko proces, który ją trzyma i odnawia przed upływem `expires`"""
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    expires = db.Column(db.Float, nullable=False)  # sekundy epoki
+
+def upgrade_schema(batch_size=5000):
+    """
+    Migracja bazy sprzed spakowanych adresów: tabela device bez kolumny ip_packed jest
+    przemianowywana, tworzona od nowa (z indeksami) i wypełniana w partiach; brakujące kolumny
+    device.snmp_profile i event_log.origin są dodawane. Wywoływać przed db.create_all(); na aktualnej
+    lub pustej bazie nic nie robi
+    """
+    inspector = inspect(db.engine)
+    if inspector.has_table('event_log') and 'origin' not in {
+            column['name'] for column in inspector.get_columns('event_log')}:
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE event_log ADD COLUMN origin VARCHAR(16)'))
+        logger.info("Dodano kolumnę event_log.origin")
+    if not inspector.has_table('device'):
+        return False
+    columns = {column['name'] for column in inspector.get_columns('device')}
+    if 'ip_packed' in columns:
+        if 'snmp_profile' in columns:
+            return False
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE device ADD COLUMN snmp_profile TEXT'))
+        logger.info("Dodano kolumnę device.snmp_profile")
+        return True
+    logger.info("Migracja tabeli device: spakowane adresy IP i indeksy")
+    copied = [name for name in Device.__table__.columns.keys() if name in columns and name != 'ip_address']
+    insert = (f"INSERT INTO device (ip_address, ip_packed, {', '.join(copied)}) "
+              f"VALUES ({', '.join('?' * (len(copied) + 2))})")
+    with db.engine.begin() as connection:
+        connection.execute(text('ALTER TABLE device RENAME TO device_old'))
+        Device.__table__.create(connection)
+        # Pozostałe kolumny kopiowane są bez konwersji (surowe wartości sterownika SQLite)
+        rows = connection.exec_driver_sql(f"SELECT ip_address, {', '.join(copied)} FROM device_old")
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            connection.exec_driver_sql(insert, [(normalize_ip(row[0]), pack_ip(row[0])) + tuple(row[1:])
+                                                for row in batch])
+        connection.execute(text('DROP TABLE device_old'))
+    logger.info("Migracja tabeli device zakończona")
+    return True
@@ -0,0 +1,64 @@
+# Numeric OIDs of every MIB object nyo-snmp queries, so requests are built
+# without loading the pysnmp MIB modules. Generated by `python -m oid_table`:
+# add a (mib, name): None entry and run it to resolve it against the MIBs.
+
+OIDS = {
+    ('HOST-RESOURCES-MIB', 'hrProcessorLoad'): '1.3.6.1.2.1.25.3.3.1.2',
+    ('HOST-RESOURCES-MIB', 'hrStorageAllocationUnits'): '1.3.6.1.2.1.25.2.3.1.4',
+    ('HOST-RESOURCES-MIB', 'hrStorageDescr'): '1.3.6.1.2.1.25.2.3.1.3',
+    ('HOST-RESOURCES-MIB', 'hrStorageSize'): '1.3.6.1.2.1.25.2.3.1.5',
+    ('HOST-RESOURCES-MIB', 'hrStorageType'): '1.3.6.1.2.1.25.2.3.1.2',
+    ('HOST-RESOURCES-MIB', 'hrStorageUsed'): '1.3.6.1.2.1.25.2.3.1.6',
+    ('IF-MIB', 'ifDescr'): '1.3.6.1.2.1.2.2.1.2',
+    ('IF-MIB', 'ifHCInBroadcastPkts'): '1.3.6.1.2.1.31.1.1.1.9',
+    ('IF-MIB', 'ifHCInMulticastPkts'): '1.3.6.1.2.1.31.1.1.1.8',
+    ('IF-MIB', 'ifHCInOctets'): '1.3.6.1.2.1.31.1.1.1.6',
+    ('IF-MIB', 'ifHCInUcastPkts'): '1.3.6.1.2.1.31.1.1.1.7',
+    ('IF-MIB', 'ifHCOutBroadcastPkts'): '1.3.6.1.2.1.31.1.1.1.13',
+    ('IF-MIB', 'ifHCOutMulticastPkts'): '1.3.6.1.2.1.31.1.1.1.12',
+    ('IF-MIB', 'ifHCOutOctets'): '1.3.6.1.2.1.31.1.1.1.10',
+    ('IF-MIB', 'ifHCOutUcastPkts'): '1.3.6.1.2.1.31.1.1.1.11',
+    ('IF-MIB', 'ifHighSpeed'): '1.3.6.1.2.1.31.1.1.1.15',
+    ('IF-MIB', 'ifInErrors'): '1.3.6.1.2.1.2.2.1.14',
+    ('IF-MIB', 'ifInNUcastPkts'): '1.3.6.1.2.1.2.2.1.12',
+    ('IF-MIB', 'ifInOctets'): '1.3.6.1.2.1.2.2.1.10',
+    ('IF-MIB', 'ifInUcastPkts'): '1.3.6.1.2.1.2.2.1.11',
+    ('IF-MIB', 'ifName'): '1.3.6.1.2.1.31.1.1.1.1',
+    ('IF-MIB', 'ifOperStatus'): '1.3.6.1.2.1.2.2.1.8',
+    ('IF-MIB', 'ifOutErrors'): '1.3.6.1.2.1.2.2.1.20',
+    ('IF-MIB', 'ifOutNUcastPkts'): '1.3.6.1.2.1.2.2.1.18',
+    ('IF-MIB', 'ifOutOctets'): '1.3.6.1.2.1.2.2.1.16',
+    ('IF-MIB', 'ifOutUcastPkts'): '1.3.6.1.2.1.2.2.1.17',
+    ('IF-MIB', 'ifSpeed'): '1.3.6.1.2.1.2.2.1.5',
+    ('IF-MIB', 'ifType'): '1.3.6.1.2.1.2.2.1.3',
+    ('SNMPv2-MIB', 'sysDescr'): '1.3.6.1.2.1.1.1',
+    ('SNMPv2-MIB', 'sysLocation'): '1.3.6.1.2.1.1.6',
+    ('SNMPv2-MIB', 'sysName'): '1.3.6.1.2.1.1.5',
+    ('SNMPv2-MIB', 'sysObjectID'): '1.3.6.1.2.1.1.2',
+    ('SNMPv2-MIB', 'sysUpTime'): '1.3.6.1.2.1.1.3',
+    ('UCD-SNMP-MIB', 'memAvailReal'): '1.3.6.1.4.1.2021.4.6',
+    ('UCD-SNMP-MIB', 'memTotalReal'): '1.3.6.1.4.1.2021.4.5',
+    ('UCD-SNMP-MIB', 'ssCpuSystem'): '1.3.6.1.4.1.2021.11.10',
+    ('UCD-SNMP-MIB', 'ssCpuUser'): '1.3.6.1.4.1.2021.11.9',
+}
+
+def main():
+    import re
+
+    from pysnmp.smi import builder, view
+    from pysnmp.smi.rfc1902 import ObjectIdentity
+
+    mib_view = view.MibViewController(builder.MibBuilder())
+    resolved = {}
+    for mib, name in sorted(OIDS):
+        oid = ObjectIdentity(mib, name).resolveWithMib(mib_view).getOid()
+        resolved[(mib, name)] = '.'.join(map(str, oid))
+    with open(__file__) as f:
+        source = f.read()
+    table = 'OIDS = {\n' + ''.join(f'    {key!r}: {value!r},\n' for key, value in resolved.items()) + '}\n'
+    with open(__file__, 'w') as f:
+        f.write(re.sub(r'OIDS = \{\n.*?^\}\n', lambda _: table, source, count=1, flags=re.S | re.M))
+    print(f'Resolved {len(resolved)} objects')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+# Seconds a poll result is served to later callers; keep it below the
+# scheduler's RECHECK_DELAY so a confirming re-poll is never answered from cache
+DEFAULT_TTL = 10
+
+# Results kept; the least recently used are evicted first
+MAX_ENTRIES = 10000
+
+class PollCache:
+    """
+    Coalesce concurrent polls of the same target and serve recent results
+
+    Keys identify what is polled, e.g. (ip, community, OID set). A caller
+    claims the keys nobody else is polling and polls only those; keys
+    already in flight are awaited and keys polled less than ttl seconds ago
+    are answered from an LRU cache, so concurrent and repeated callers cost
+    one poll. Results are shared objects and must not be modified.
+    """
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._results = collections.OrderedDict()  # key -> (expires, result)
+        self._in_flight = {}  # key -> Future of the owner's result (None if it failed)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def fetch(self, keys, poll):
+        """
+        Results for keys as ({key: result}, set of shared keys)
+
+        poll(claimed keys) -> {key: result} is called only for the keys this
+        caller claimed. Shared keys were answered from the cache or by another
+        caller's poll (which is responsible for storing them). A key whose
+        poll failed is missing from the results; an exception raised by poll
+        propagates to the caller that claimed it.
+        """
+        results, waiting, claimed = {}, {}, []
+        with self._lock:
+            now = self.clock()
+            for key in keys:
+                entry = self._results.get(key)
+                if entry is not None and entry[0] > now:
+                    self._results.move_to_end(key)
+                    results[key] = entry[1]
+                elif key in self._in_flight:
+                    waiting[key] = self._in_flight[key]
+                else:
+                    self._in_flight[key] = Future()
+                    claimed.append(key)
+        shared = set(results) | set(waiting)
+
+        polled = {}
+        try:
+            if claimed:
+                polled = poll(claimed)
+        finally:
+            with self._lock:
+                expires = self.clock() + self.ttl
+                for key in claimed:
+                    result = polled.get(key)
+                    if result is not None:
+                        self._results[key] = (expires, result)
+                        self._results.move_to_end(key)
+                    self._in_flight.pop(key).set_result(result)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        results.update(polled)
+
+        for key, future in waiting.items():
+            result = future.result()
+            if result is not None:
+                results[key] = result
+        return results, shared
+
+    def invalidate(self, keys):
+        """
+        Drop cached results of keys (e.g. of a device that just rebooted); polls in flight are kept
+        """
+        with self._lock:
+            for key in keys:
+                self._results.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
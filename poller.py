@@ -0,0 +1,260 @@
+import argparse
+import atexit
+import http.server
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+import app as web
+import instrumentation
+import snmp_operations
+from models import db, PollerLease
+from sharded_poller import ShardedPoller
+from trap_receiver import TrapReceiver
+
+logger = logging.getLogger(__name__)
+
+# Seconds a leader lease stays valid without renewal (renewed every third of it)
+LEASE_TTL = 30
+
+# The leader stops polling this long before its lease runs out, so a leader
+# whose renewals fail has stopped before another instance can take over
+LEASE_MARGIN = 10
+
+class LeaderLease(threading.Thread):
+    """
+    Leader election through a lease row in the database
+
+    Every poller instance tries to take or renew the lease every ttl/3
+    seconds. The conditional UPDATE only succeeds for the current holder or
+    once the holder's lease has expired, so at most one instance leads; a
+    stopped leader releases the lease and the next instance takes over on
+    its next attempt, a crashed one after ttl.
+    """
+    def __init__(self, app, lease_name='poller', ttl=LEASE_TTL, margin=LEASE_MARGIN):
+        super().__init__(name='leader-lease', daemon=True)
+        self.app = app
+        self.lease_name = lease_name
+        self.ttl = ttl
+        self.margin = margin
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.valid_until = 0
+        self.changed = threading.Event()
+        self._stopped = threading.Event()
+
+    @property
+    def leader(self):
+        return time.time() < self.valid_until
+
+    def acquire(self):
+        """
+        Take or renew the lease; returns True if this instance holds it
+        """
+        now = time.time()
+        with self.app.app_context():
+            if db.session.get(PollerLease, self.lease_name) is None:
+                try:
+                    db.session.add(PollerLease(name=self.lease_name, holder='', expires=0))
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()  # another instance created it first
+            result = db.session.execute(
+                update(PollerLease)
+                .where(PollerLease.name == self.lease_name,
+                       or_(PollerLease.holder == self.holder, PollerLease.expires < now))
+                .values(holder=self.holder, expires=now + self.ttl))
+            db.session.commit()
+        if result.rowcount == 1:
+            self.valid_until = now + self.ttl - self.margin
+            return True
+        return False
+
+    def run(self):
+        while not self._stopped.is_set():
+            was_leader = self.leader
+            try:
+                self.acquire()
+            except Exception as e:
+                logger.error(f"Leader lease renewal failed: {str(e)}")
+            if self.leader != was_leader:
+                logger.info(f"{'Acquired' if self.leader else 'Lost'} the {self.lease_name} leader lease ({self.holder})")
+                self.changed.set()
+            self._stopped.wait(self.ttl / 3)
+
+    def stop(self):
+        """
+        Stop renewing and release a held lease so another instance takes over at once
+        """
+        self._stopped.set()
+        if self.valid_until:
+            self.valid_until = 0
+            self.changed.set()
+            try:
+                with self.app.app_context():
+                    db.session.execute(update(PollerLease)
+                                       .where(PollerLease.name == self.lease_name, PollerLease.holder == self.holder)
+                                       .values(expires=0))
+                    db.session.commit()
+            except Exception as e:
+                logger.error(f"Failed to release the leader lease: {str(e)}")
+
+def poll_loop(lease):
+    """
+    Poll devices on schedule while this instance holds the leader lease
+
+    Every device has its own next-due time, so the load is spread evenly
+    instead of one burst per interval. The device list and intervals are
+    re-read from the database and config.json every SCHEDULER_SYNC_INTERVAL.
+    """
+    logger.info(f"Poller started (default interval {web.current_check_interval}s)")
+    leading = False
+    next_sync = next_eviction = 0
+    while True:
+        try:
+            if not lease.leader:
+                if leading:
+                    logger.info("Polling paused: another instance holds the leader lease")
+                    leading = False
+                lease.changed.wait(lease.ttl / 3)
+                lease.changed.clear()
+                continue
+            if not leading:
+                # The device list may have changed while another instance was polling
+                leading = True
+                next_sync = 0
+                next_eviction = time.monotonic() + web.current_check_interval
+
+            now = time.monotonic()
+            if now >= next_sync:
+                web.sync_scheduler()
+                next_sync = now + web.SCHEDULER_SYNC_INTERVAL
+            if now >= next_eviction:
+                with web.app.app_context():
+                    web.evict_metrics_history()
+                next_eviction = now + web.current_check_interval
+
+            web.poll_due_devices()
+
+            # Sleep until the next due device, the next sync or the next lease renewal
+            wait = min(next_sync - time.monotonic(), lease.ttl / 3)
+            next_due = web.scheduler.next_due()
+            if next_due is not None:
+                wait = min(wait, next_due - time.monotonic())
+            web.scheduler_wakeup.wait(max(0, wait))
+            web.scheduler_wakeup.clear()
+        except Exception as e:
+            logger.error(f"Poller error: {str(e)}")
+            time.sleep(30)  # back off before retrying
+
+def _sharded_poller(workers):
+    return ShardedPoller(workers, concurrency=web.get_config_value('poll_concurrency'),
+                         deadline=web.get_config_value('poll_deadline'),
+                         counters=web.get_config_value('interface_rates'),
+                         port=snmp_operations.SNMP_PORT)
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the process's metrics registry at /metrics
+    """
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = instrumentation.REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', instrumentation.CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not worth a log line each
+
+def serve_metrics(port, host=''):
+    """
+    Expose /metrics of a standalone poller (the web process serves its own)
+    """
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics on port {server.server_address[1]}")
+    return server
+
+def start_trap_receiver(port):
+    """
+    Receive traps on a UDP port; matching devices are updated and re-polled
+    at once (app.handle_trap). Returns None if port is None or cannot be bound.
+    """
+    if port is None:
+        return None
+    try:
+        receiver = TrapReceiver(web.handle_trap, port)
+    except OSError as e:
+        logger.error(f"Cannot receive traps on UDP port {port}: {str(e)}")
+        return None
+    receiver.start()
+    return receiver
+
+def start_embedded():
+    """
+    Run the poller in a daemon thread of the web process (python app.py)
+
+    It still takes the leader lease, so it stays idle while a standalone
+    poller runs; its events go straight to the web process's bus, and
+    through the event log to the other web processes.
+    """
+    web.ensure_event_relay()
+    lease = LeaderLease(web.app)
+    lease.start()
+    atexit.register(lease.stop)
+    workers = web.get_config_value('poll_workers')
+    if workers:
+        web.poll_backend = _sharded_poller(workers).__enter__()
+        atexit.register(web.poll_backend.close)
+    receiver = start_trap_receiver(web.get_config_value('trap_port'))
+    if receiver is not None:
+        atexit.register(receiver.stop)
+    threading.Thread(target=poll_loop, args=(lease,), name='poller', daemon=True).start()
+    return lease
+
+def main():
+    parser = argparse.ArgumentParser(description='Poll the devices of the nyo-snmp database on schedule')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default: poll_workers from config.json; 0 polls in this process)')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics of this process at http://<host>:<port>/metrics')
+    parser.add_argument('--trap-port', type=int,
+                        help='receive SNMP traps and informs on this UDP port (default: trap_port from config.json)')
+    args = parser.parse_args()
+    web.configure_logging()
+    web.init_db()
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
+    workers = web.get_config_value('poll_workers') if args.workers is None else args.workers
+    receiver = start_trap_receiver(web.get_config_value('trap_port') if args.trap_port is None else args.trap_port)
+
+    lease = LeaderLease(web.app)
+    lease.start()
+    # The web processes learn about poll results from the event log
+    web.event_forwarder.start()
+    try:
+        if workers:
+            with _sharded_poller(workers) as sharded:
+                web.poll_backend = sharded
+                poll_loop(lease)
+        else:
+            poll_loop(lease)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if receiver is not None:
+            receiver.stop()
+        lease.stop()
+
+if __name__ == '__main__':
+    main()
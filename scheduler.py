@@ -0,0 +1,192 @@
+import heapq
+import ipaddress
+import itertools
+import random
+import threading
+import time
+
+# Random spread of every next-due time, as a fraction of the interval
+JITTER = 0.1
+
+# Delay of the confirming re-poll after a device changes state (seconds)
+RECHECK_DELAY = 15
+
+# Upper bound of the backoff for unreachable devices (seconds)
+MAX_BACKOFF = 3600
+
+class _Entry:
+    __slots__ = ('ip', 'interval', 'due', 'token', 'active', 'failures')
+
+    def __init__(self, ip, interval, active):
+        self.ip = ip
+        self.interval = interval
+        self.due = None
+        self.token = None
+        self.active = active
+        self.failures = 0
+
+class PollScheduler:
+    """
+    Per-device poll schedule kept in a heap of next-due times
+
+    Every device has its own interval (per device, per subnet group or the
+    default). First polls are spread uniformly over one interval and every
+    next-due time is jittered, so the poll load stays flat instead of arriving
+    in one burst per cycle. Unreachable devices back off exponentially and a
+    device that just changed state is re-polled quickly to confirm it.
+
+    Heap entries are invalidated lazily: an entry only counts if its token is
+    still the device's current one.
+    """
+    def __init__(self, default_interval, device_intervals=None, groups=None, jitter=JITTER,
+                 recheck_delay=RECHECK_DELAY, max_backoff=MAX_BACKOFF, clock=time.monotonic):
+        self.jitter = jitter
+        self.recheck_delay = recheck_delay
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._heap = []
+        self._entries = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self.configure(default_interval, device_intervals, groups)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def configure(self, default_interval, device_intervals=None, groups=None):
+        """
+        Set the default interval, {ip: seconds} overrides and {cidr: seconds}
+        group intervals (the most specific matching group wins)
+
+        Devices whose new interval ends before their current due time are
+        rescheduled within the new interval.
+        """
+        with self._lock:
+            self.default_interval = default_interval
+            self.device_intervals = dict(device_intervals or {})
+            self.groups = sorted(
+                ((ipaddress.ip_network(cidr, strict=False), interval) for cidr, interval in (groups or {}).items()),
+                key=lambda group: group[0].prefixlen, reverse=True)
+            now = self.clock()
+            for device_id, entry in self._entries.items():
+                entry.interval = self.interval_for(entry.ip)
+                if entry.due is not None and entry.due > now + entry.interval:
+                    self._push(device_id, entry, now + random.uniform(0, entry.interval))
+
+    def interval_for(self, ip):
+        if ip in self.device_intervals:
+            return self.device_intervals[ip]
+        address = ipaddress.ip_address(ip)
+        for network, interval in self.groups:
+            if address.version == network.version and address in network:
+                return interval
+        return self.default_interval
+
+    def _push(self, device_id, entry, due):
+        entry.due = due
+        entry.token = next(self._tokens)
+        heapq.heappush(self._heap, (due, entry.token, device_id))
+
+    def _jittered(self, delay):
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def sync(self, devices):
+        """
+        Reconcile the schedule with (device_id, ip, active) tuples
+
+        New devices get a random first due time within their interval;
+        devices missing from the list are dropped.
+        """
+        with self._lock:
+            now = self.clock()
+            seen = set()
+            for device_id, ip, active in devices:
+                seen.add(device_id)
+                if device_id in self._entries:
+                    continue
+                entry = self._entries[device_id] = _Entry(ip, self.interval_for(ip), active)
+                self._push(device_id, entry, now + random.uniform(0, entry.interval))
+            for device_id in set(self._entries) - seen:
+                del self._entries[device_id]
+
+    def pop_due(self, limit=None):
+        """
+        Take the ids of devices that are due; they stay off the heap until complete()
+        """
+        due = []
+        with self._lock:
+            now = self.clock()
+            while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+                _, token, device_id = heapq.heappop(self._heap)
+                entry = self._entries.get(device_id)
+                if entry is None or entry.token != token:
+                    continue
+                entry.due = entry.token = None
+                due.append(device_id)
+        return due
+
+    def complete(self, device_id, active):
+        """
+        Record a poll result and schedule the next poll; returns True if the
+        device changed state
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                return False
+            changed = active != entry.active
+            entry.active = active
+            entry.failures = 0 if active else entry.failures + 1
+            if changed:
+                delay = min(self.recheck_delay, entry.interval)
+            elif not active:
+                delay = min(entry.interval * 2 ** (entry.failures - 1), max(self.max_backoff, entry.interval))
+            else:
+                delay = entry.interval
+            self._push(device_id, entry, self.clock() + self._jittered(delay))
+            return changed
+
+    def release(self, device_ids):
+        """
+        Reschedule taken devices that never completed (e.g. the poll failed)
+        one interval from now
+        """
+        with self._lock:
+            now = self.clock()
+            for device_id in device_ids:
+                entry = self._entries.get(device_id)
+                if entry is not None and entry.token is None:
+                    self._push(device_id, entry, now + self._jittered(entry.interval))
+
+    def poll_now(self, device_id):
+        """
+        Make a scheduled device due at once (e.g. after a trap); returns False
+        for unknown devices and devices being polled right now
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None or entry.token is None:
+                return False
+            self._push(device_id, entry, self.clock())
+            return True
+
+    def overdue(self):
+        """
+        Number of devices past their due time that are not being polled
+        """
+        with self._lock:
+            now = self.clock()
+            return sum(1 for entry in self._entries.values() if entry.due is not None and entry.due < now)
+
+    def next_due(self):
+        """
+        Monotonic time of the earliest scheduled poll, or None
+        """
+        with self._lock:
+            while self._heap:
+                _, token, device_id = self._heap[0]
+                entry = self._entries.get(device_id)
+                if entry is not None and entry.token == token:
+                    return self._heap[0][0]
+                heapq.heappop(self._heap)
+            return None
@@ -0,0 +1,240 @@
+import bisect
+import collections
+import hashlib
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import threading
+import time
+
+import device_profile
+import instrumentation
+from async_poller import poll_devices
+
+logger = logging.getLogger(__name__)
+
+# Points per shard on the hash ring: more points spread devices more evenly
+RING_REPLICAS = 160
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys (device IPs) to shard numbers
+
+    Every shard owns `replicas` points on the ring and a key belongs to the
+    shard of the first point at or after the key's hash, so changing the
+    number of shards moves only about 1/N of the keys.
+    """
+    def __init__(self, shards, replicas=RING_REPLICAS):
+        points = sorted((_hash(f'{shard}:{replica}'), shard) for shard in range(shards) for replica in range(replicas))
+        self.shards = shards
+        self._hashes = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        position = bisect.bisect_left(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[position]
+
+def _worker(connection, options):
+    """
+    Shard process: keeps the (ip, community, capability profile) of the
+    devices assigned to it and answers ('poll', keys) messages with
+    poll_devices() results; the report carries the metrics recorded since the
+    previous poll under 'metrics'. Profiles learned by a poll are used from
+    the next poll on, before the coordinator assigns them back.
+    """
+    # Ctrl+C is handled by the coordinator, which stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    targets = {}
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        kind, payload = message
+        if kind == 'assign':
+            for key, (ip, community, profile) in payload.items():
+                targets[key] = (ip, community, device_profile.loads(profile))
+        elif kind == 'unassign':
+            for key in payload:
+                targets.pop(key, None)
+        elif kind == 'poll':
+            polled = [(key, *targets[key]) for key in payload if key in targets]
+            results, report = poll_devices(polled, **options)
+            for key, result in results.items():
+                if result.get('profile') is not None:
+                    targets[key] = targets[key][:2] + (result['profile'],)
+            report['metrics'] = instrumentation.REGISTRY.drain()
+            connection.send((results, report))
+
+def _weighted_median(values):
+    """
+    Median of (value, weight) pairs, ignoring None values
+    """
+    values = sorted((value, weight) for value, weight in values if value is not None)
+    half, seen = sum(weight for _, weight in values) / 2, 0
+    for value, weight in values:
+        seen += weight
+        if seen >= half:
+            return value
+    return None
+
+def merge_reports(reports, duration):
+    """
+    One cycle report from the reports of the shards that took part
+
+    The shards only report percentiles, so p50 is the device-weighted median
+    of the shard medians and p99 the worst shard's p99 (an upper bound).
+    """
+    p99 = [report['p99_latency'] for report in reports if report['p99_latency'] is not None]
+    return {
+        'devices': sum(report['devices'] for report in reports),
+        'duration': duration,
+        'p50_latency': _weighted_median((report['p50_latency'], report['devices']) for report in reports),
+        'p99_latency': max(p99) if p99 else None,
+        'timeouts': sum(report['timeouts'] for report in reports),
+        'errors': sum(report['errors'] for report in reports),
+        'concurrency': sum(report['concurrency'] for report in reports),
+        'shards': len(reports),
+    }
+
+class ShardedPoller:
+    """
+    Poll devices in worker processes, each owning the devices whose IP hashes
+    to its shard
+
+    SNMP encoding and decoding is CPU-bound, so one process tops out on one
+    core; N workers each run their own asyncio poller with poll_concurrency
+    requests in flight. assign() reconciles the set of polled devices (only
+    added, removed or changed devices are sent to the workers) and poll()
+    fans a batch of keys out to their shards and merges the results. A worker
+    that dies is restarted with its assignment on the next message; devices
+    it was polling are missing from that poll's results.
+
+    One thread at a time talks to the workers: assign(), poll() and close()
+    hold a lock for their whole exchange, because a worker's replies carry
+    no request id and would otherwise go to whichever caller reads first.
+    Concurrent polls (the poll loop, check jobs, request threads) queue up.
+    """
+    def __init__(self, workers, concurrency=100, deadline=5, timeout=1, retries=0, port=None, counters=False):
+        self.ring = HashRing(workers)
+        self.options = {'concurrency': concurrency, 'deadline': deadline, 'timeout': timeout,
+                        'retries': retries, 'port': port, 'counters': counters}
+        self.assignment = {}  # key -> (shard, ip, community, profile JSON)
+        # spawn: the coordinator runs threads (and holds database connections) that must not be forked
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = [None] * workers
+        self._connections = [None] * workers
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        with self._lock:
+            for shard in range(self.ring.shards):
+                self._start(shard)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start(self, shard):
+        if self._connections[shard] is not None:
+            self._connections[shard].close()
+        parent, child = self._context.Pipe()
+        process = self._context.Process(target=_worker, args=(child, self.options), daemon=True,
+                                        name=f'poller-shard-{shard}')
+        process.start()
+        child.close()
+        self._processes[shard] = process
+        self._connections[shard] = parent
+        assigned = {key: target[1:] for key, target in self.assignment.items() if target[0] == shard}
+        if assigned:
+            parent.send(('assign', assigned))
+
+    def _send(self, shard, message):
+        if self._processes[shard].is_alive():
+            try:
+                self._connections[shard].send(message)
+                return
+            except OSError:
+                pass
+        logger.warning(f"Poller shard {shard} exited (code {self._processes[shard].exitcode}), restarting")
+        self._start(shard)
+        # The restarted worker already got its whole assignment - only a poll has to be sent again
+        if message[0] == 'poll':
+            self._connections[shard].send(message)
+
+    def assign(self, targets):
+        """
+        Make (key, ip, community, profile JSON) targets the polled set and
+        return the number of assignments sent to the workers (0 when nothing
+        changed); a changed profile is sent again like a changed address
+        """
+        with self._lock:
+            wanted = {key: (self.ring.shard_for(ip), ip, community, profile)
+                      for key, ip, community, profile in targets}
+            assigned = collections.defaultdict(dict)
+            unassigned = collections.defaultdict(list)
+            for key, target in wanted.items():
+                current = self.assignment.get(key)
+                if current == target:
+                    continue
+                if current is not None and current[0] != target[0]:
+                    unassigned[current[0]].append(key)
+                assigned[target[0]][key] = target[1:]
+            for key in self.assignment.keys() - wanted.keys():
+                unassigned[self.assignment[key][0]].append(key)
+            self.assignment = wanted
+            for shard, keys in unassigned.items():
+                self._send(shard, ('unassign', keys))
+            for shard, items in assigned.items():
+                self._send(shard, ('assign', items))
+            return sum(len(keys) for keys in unassigned.values()) + sum(len(items) for items in assigned.values())
+
+    def poll(self, keys):
+        """
+        Poll assigned targets by key; returns (results, report) like
+        async_poller.poll_devices (unassigned keys are skipped)
+        """
+        with self._lock:
+            start = time.perf_counter()
+            batches = collections.defaultdict(list)
+            for key in keys:
+                if key in self.assignment:
+                    batches[self.assignment[key][0]].append(key)
+            pending = {}
+            for shard, batch in batches.items():
+                self._send(shard, ('poll', batch))
+                pending[self._connections[shard]] = shard
+            results, reports = {}, []
+            while pending:
+                for connection in multiprocessing.connection.wait(list(pending)):
+                    shard = pending.pop(connection)
+                    try:
+                        shard_results, report = connection.recv()
+                    except EOFError:
+                        logger.error(f"Poller shard {shard} exited while polling {len(batches[shard])} devices")
+                        self._start(shard)
+                        continue
+                    results.update(shard_results)
+                    instrumentation.REGISTRY.merge(report.pop('metrics', {}))
+                    reports.append(report)
+            return results, merge_reports(reports, time.perf_counter() - start)
+
+    def close(self):
+        with self._lock:
+            for shard, connection in enumerate(self._connections):
+                if connection is None:
+                    continue
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+                connection.close()
+                self._processes[shard].join(timeout=5)
+                if self._processes[shard].is_alive():
+                    self._processes[shard].terminate()
@@ -1,21 +1,588 @@
-from pysnmp.hlapi import *
+from pysnmp.proto import api, rfc1902, rfc1905
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.type import univ
+import collections
+import itertools
 import logging
 import subprocess
 import platform
-import concurrent.futures
-import ipaddress
+import queue
+import random
+import socket
+import threading
+from contextlib import contextmanager
 from datetime import timedelta
 
+from oid_table import OIDS
+
 logger = logging.getLogger(__name__)
 
+# SNMP agent port (benchmarks override it to run without root privileges)
+SNMP_PORT = 161
+
+# Default max-repetitions of GETBULK table walks
+MAX_REPETITIONS = 25
+
+# Sessions kept by the session pool (least recently used are dropped first);
+# an engine that has configured more targets than this is closed, not reused
+MAX_SESSIONS = 1024
+
+# (mib, name) -> numeric OID of the objects in oid_table; other names are
+# resolved against the pysnmp MIB modules, which are only loaded for them
+NUMERIC_OIDS = {key: tuple(int(part) for part in oid.split('.')) for key, oid in OIDS.items()}
+
+def _hlapi():
+    """
+    pysnmp's high-level API, imported on first use: it pulls in the MIB
+    compiler and most of pysnmp, which the raw-codec pollers never need
+    """
+    from pysnmp import hlapi
+    return hlapi
+
+class SnmpSession:
+    """
+    Cached SNMP parameters (auth data and transport target) for one device
+    """
+    def __init__(self, ip, community='public', timeout=1, retries=0, port=None):
+        self.ip = ip
+        self.community = community
+        hlapi = _hlapi()
+        self.auth_data = hlapi.CommunityData(community)
+        self.transport_target = hlapi.UdpTransportTarget((ip, port or SNMP_PORT), timeout=timeout, retries=retries)
+        self.context_data = hlapi.ContextData()
+
+    def get(self, *object_types):
+        """
+        Send a single GET request carrying all given object types
+
+        Returns the same (error_indication, error_status, error_index, var_binds)
+        tuple as pysnmp's getCmd.
+        """
+        with session_pool.engine() as engine:
+            return next(
+                _hlapi().getCmd(engine,
+                       self.auth_data,
+                       self.transport_target,
+                       self.context_data,
+                       *object_types,
+                       lookupMib=False)
+            )
+
+class SessionPool:
+    """
+    Module-wide pool of SNMP engines, sessions and resolved object types
+
+    SnmpEngine is not thread-safe, so an engine is checked out for the
+    duration of one request and returned to a free list afterwards. The
+    background checker, scan workers and (short-lived) request threads all
+    reuse the same few engines. Sessions and resolved object types are
+    immutable once built and are shared.
+
+    Every (ip, community, timeout, retries, port) gets its own session and
+    a target row in each engine that used it, so both are bounded by
+    max_sessions: sessions are kept in LRU order, and an engine whose
+    target table has outgrown the bound is closed instead of returned.
+    """
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._engines = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+        self._object_types = {}
+
+    @contextmanager
+    def engine(self):
+        """
+        Check out an SNMP engine for exclusive use by the calling thread
+        """
+        try:
+            engine = self._engines.get_nowait()
+        except queue.Empty:
+            engine = _hlapi().SnmpEngine()
+        try:
+            yield engine
+        finally:
+            if self._engine_targets(engine) > self.max_sessions:
+                engine.transportDispatcher.closeDispatcher()
+            else:
+                self._engines.put(engine)
+
+    @staticmethod
+    def _engine_targets(engine):
+        # Target addresses the hlapi has configured in this engine; they are
+        # added per distinct transport target and never removed
+        cache = engine.getUserContext('CommandGeneratorLcdConfigurator')
+        return len(cache['addr']) if cache else 0
+
+    def session(self, ip, community='public', timeout=1, retries=0, port=None):
+        """
+        Get the cached session for (ip, community) with given timeout settings
+        """
+        port = port or SNMP_PORT
+        key = (ip, community, timeout, retries, port)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = SnmpSession(ip, community, timeout, retries, port)
+                if len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(key)
+        return session
+
+    def object_type(self, mib, name, index=None):
+        """
+        Get an ObjectType for a symbolic MIB name, resolved once per process
+
+        Without an index the ObjectType names the object itself (e.g. a table column).
+        Objects of oid_table are built from their numeric OID without loading their MIB.
+        """
+        key = (mib, name, index)
+        object_type = self._object_types.get(key)
+        if object_type is None:
+            hlapi = _hlapi()
+            from pysnmp.hlapi.varbinds import CommandGeneratorVarBinds
+            with self.engine() as engine:
+                mib_view = CommandGeneratorVarBinds().getMibViewController(engine)
+                name_oid = _numeric_name(mib, name, index)
+                if name_oid is not None:
+                    identity = hlapi.ObjectIdentity(name_oid)
+                elif index is None:
+                    identity = hlapi.ObjectIdentity(mib, name)
+                else:
+                    identity = hlapi.ObjectIdentity(mib, name, index)
+                object_type = hlapi.ObjectType(identity).resolveWithMib(mib_view)
+            with self._lock:
+                object_type = self._object_types.setdefault(key, object_type)
+        return object_type
+
+    def invalidate(self, ip=None):
+        """
+        Drop cached sessions for one device (or all devices if ip is None)
+        """
+        with self._lock:
+            if ip is None:
+                self._sessions.clear()
+            else:
+                for key in [key for key in self._sessions if key[0] == ip]:
+                    del self._sessions[key]
+
+session_pool = SessionPool()
+
+def snmp_get(ip, community, *oids, timeout=1, retries=0, port=None):
+    """
+    GET one or more (mib, name, index) OIDs using the shared session pool
+    """
+    session = session_pool.session(ip, community, timeout, retries, port)
+    return session.get(*[session_pool.object_type(*oid) for oid in oids])
+
+def snmp_get_values(ip, community, oids, timeout=1, retries=0, port=None):
+    """
+    GET many (mib, name, index) OIDs in one request and map them to values
+
+    Returns (error, values). On a transport error (timeout) values is None;
+    on an SNMP error status values is an empty dict. OIDs the agent does not
+    have and OIDs that cannot be resolved against the MIBs map to None.
+    """
+    object_types = {}
+    for oid in oids:
+        try:
+            object_types[oid] = session_pool.object_type(*oid)
+        except Exception as e:
+            logger.debug(f"Skipping unresolvable OID {oid}: {str(e)}")
+
+    session = session_pool.session(ip, community, timeout, retries, port)
+    error_indication, error_status, error_index, var_binds = session.get(*object_types.values())
+    if error_indication:
+        return error_indication, None
+    if error_status:
+        return error_status.prettyPrint(), {}
+
+    values = dict.fromkeys(oids)
+    for oid, (_, value) in zip(object_types, var_binds):
+        if not isinstance(value, NO_VALUE_TYPES):
+            values[oid] = value
+    return None, values
+
+def _numeric_name(mib, name, index=None):
+    """
+    Numeric OID tuple of an oid_table object (with an integer index), else None
+    """
+    numeric = NUMERIC_OIDS.get((mib, name))
+    if numeric is None or not (index is None or isinstance(index, int)):
+        return None
+    return numeric if index is None else numeric + (index,)
+
+_names = {}
+
+def oid_name(oid):
+    """
+    Numeric ObjectName of a (mib, name) or (mib, name, index) OID
+
+    Objects of oid_table never touch the MIBs; other names load their MIB
+    module on first use. Results are cached per process.
+    """
+    name = _names.get(oid)
+    if name is None:
+        numeric = _numeric_name(*oid)
+        if numeric is None:
+            name = session_pool.object_type(*oid)[0].getOid()
+        else:
+            name = rfc1902.ObjectName(numeric)
+        _names[oid] = name
+    return name
+
+def resolve_names(oids):
+    """
+    Map OIDs to numeric ObjectNames; OIDs that cannot be resolved map to None
+    """
+    names = {}
+    for oid in oids:
+        try:
+            names[oid] = oid_name(oid)
+        except Exception as e:
+            logger.debug(f"Skipping unresolvable OID {oid}: {str(e)}")
+            names[oid] = None
+    return names
+
+# Raw SNMPv2c message codec, used where the hlapi command generators do not fit
+# (asyncio polling, sweeps and table walks)
+p_mod = api.protoModules[api.protoVersion2c]
+
+NO_VALUE_TYPES = (p_mod.NoSuchObject, p_mod.NoSuchInstance, p_mod.EndOfMibView)
+
+_request_ids = itertools.count(random.randrange(1, 1 << 30))
+
+def next_request_id():
+    return next(_request_ids) % 0x7fffffff or 1
+
+def encode_request(request_id, community, object_names, pdu_type='get', non_repeaters=0, max_repetitions=0):
+    """
+    Encode an SNMPv2c GetRequest, GetNextRequest or GetBulkRequest datagram
+    """
+    if pdu_type == 'getbulk':
+        pdu = p_mod.GetBulkRequestPDU()
+        p_mod.apiBulkPDU.setDefaults(pdu)
+        p_mod.apiBulkPDU.setNonRepeaters(pdu, non_repeaters)
+        p_mod.apiBulkPDU.setMaxRepetitions(pdu, max_repetitions)
+    else:
+        pdu = p_mod.GetNextRequestPDU() if pdu_type == 'getnext' else p_mod.GetRequestPDU()
+        p_mod.apiPDU.setDefaults(pdu)
+    p_mod.apiPDU.setRequestID(pdu, request_id)
+    p_mod.apiPDU.setVarBinds(pdu, [(name, p_mod.Null('')) for name in object_names])
+
+    message = p_mod.Message()
+    p_mod.apiMessage.setDefaults(message)
+    p_mod.apiMessage.setCommunity(message, community)
+    p_mod.apiMessage.setPDU(message, pdu)
+    return encoder.encode(message)
+
+def encode_get_request(request_id, community, object_names):
+    """
+    Encode an SNMPv2c GetRequest datagram for the given numeric OIDs
+    """
+    return encode_request(request_id, community, object_names)
+
+def decode_response(datagram):
+    """
+    Decode an SNMPv2c Response datagram into (request_id, error_status, var_binds)
+    """
+    message, _ = decoder.decode(datagram, asn1Spec=p_mod.Message())
+    pdu = p_mod.apiMessage.getPDU(message)
+    return (int(p_mod.apiPDU.getRequestID(pdu)),
+            int(p_mod.apiPDU.getErrorStatus(pdu)),
+            p_mod.apiPDU.getVarBinds(pdu))
+
+def error_status_name(error_status):
+    return rfc1905.errorStatus.clone(error_status).prettyPrint()
+
+class TableWalk:
+    """
+    Walk table columns (and optionally read scalars) with GETBULK or GETNEXT
+
+    Protocol-only state machine: request() encodes the next PDU, feed() consumes
+    its response, so the same walk runs over a blocking socket or asyncio.
+    Columns are walked side by side in one PDU and a column that has left its
+    subtree is dropped from the following requests. Scalars are sent once as
+    GETBULK non-repeaters (GETNEXT of the object yields its .0 instance), so a
+    device with small tables answers a whole poll in a single round trip.
+    A "scalar" may also be one cell of an integer-indexed table: GETNEXT of
+    the previous row yields it.
+    """
+    def __init__(self, columns, scalars=(), max_repetitions=MAX_REPETITIONS, bulk=True):
+        self.columns = list(columns)
+        self.scalars = list(scalars)
+        self.max_repetitions = max_repetitions
+        self.bulk = bulk
+        self.values = dict.fromkeys(self.scalars)
+        self.rows = {column: {} for column in self.columns}
+        self.pdus = 0
+        self._last = {column: column for column in self.columns}
+        self._active = list(self.columns)
+        self._pending_scalars = list(self.scalars)
+
+    @property
+    def done(self):
+        return not self._active and not self._pending_scalars
+
+    def request(self, request_id, community):
+        self.pdus += 1
+        names = [_predecessor(scalar) for scalar in self._pending_scalars]
+        names += [self._last[column] for column in self._active]
+        if self.bulk:
+            return encode_request(request_id, community, names, 'getbulk',
+                                  non_repeaters=len(self._pending_scalars),
+                                  max_repetitions=self.max_repetitions)
+        return encode_request(request_id, community, names, 'getnext')
+
+    def feed(self, var_binds):
+        scalars, self._pending_scalars = self._pending_scalars, []
+        for scalar, (name, value) in zip(scalars, var_binds):
+            if name == scalar and not isinstance(value, NO_VALUE_TYPES):
+                self.values[scalar] = value
+
+        active, finished = self._active, set()
+        repeated = var_binds[len(scalars):]
+        if not active or not repeated:
+            self._active = []
+            return
+        for position, (name, value) in enumerate(repeated):
+            column = active[position % len(active)]
+            if column in finished:
+                continue
+            # Stop at the end of the column (or the MIB) and on agents returning non-increasing OIDs
+            if (isinstance(value, NO_VALUE_TYPES) or not column.isPrefixOf(name)
+                    or name <= self._last[column]):
+                finished.add(column)
+                continue
+            self.rows[column][tuple(name[len(column):])] = value
+            self._last[column] = name
+        self._active = [column for column in active if column not in finished]
+
+def _predecessor(name):
+    """
+    OID whose GETNEXT answer is name: the object of a .0 scalar, else the previous row
+    """
+    return name[:-1] if name[-1] == 0 else name[:-1] + (name[-1] - 1,)
+
+def _index_key(index):
+    return index[0] if len(index) == 1 else '.'.join(map(str, index))
+
+def _python_value(value):
+    if value is None:
+        return None
+    if isinstance(value, univ.Integer):
+        return int(value)
+    return value.prettyPrint()
+
+def column_table(rows, columns):
+    """
+    Turn walked {column: {index: value}} rows into a compact column-oriented table
+
+    Returns {'index': [...], name: [...], ...} with one list entry per row
+    (None where a row has no value in a column); indexes are ints for
+    single-component indexes and dotted strings otherwise.
+    """
+    indexes = sorted(set().union(*(rows[column].keys() for column in columns)))
+    table = {'index': [_index_key(index) for index in indexes]}
+    for column, name in columns.items():
+        cells = rows[column]
+        table[name] = [_python_value(cells.get(index)) for index in indexes]
+    return table
+
+def run_walk(walk, ip, community, timeout=1, retries=0, port=None):
+    """
+    Drive a TableWalk over a blocking UDP socket
+
+    Returns (error_indication, error_status) like pysnmp: a transport error
+    message or the name of the SNMP error status (both None on success).
+    """
+    address = (ip, port or SNMP_PORT)
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        while not walk.done:
+            for _ in range(retries + 1):
+                request_id = next_request_id()
+                sock.sendto(walk.request(request_id, community), address)
+                response = _receive(sock, request_id, address)
+                if response is not None:
+                    break
+            else:
+                return 'No SNMP response received before timeout', None
+            error_status, var_binds = response
+            if error_status:
+                return None, error_status_name(error_status)
+            walk.feed(var_binds)
+    return None, None
+
+def _receive(sock, request_id, address):
+    while True:
+        try:
+            data, source = sock.recvfrom(65535)
+        except socket.timeout:
+            return None
+        if source[:2] != address:
+            continue
+        try:
+            response_id, error_status, var_binds = decode_response(data)
+        except Exception as e:
+            logger.debug(f"Dropping undecodable datagram from {source[0]}: {str(e)}")
+            continue
+        if response_id == request_id:
+            return error_status, var_binds
+
+def snmp_walk(ip, community, columns, scalars=(), max_repetitions=MAX_REPETITIONS, bulk=True,
+              timeout=1, retries=0, port=None):
+    """
+    Walk (mib, name) table columns and read (mib, name, 0) scalars in as few PDUs as possible
+
+    Returns (error, values, rows) like snmp_get_values: values maps every
+    scalar to its value (or None) and rows maps every column to {index: value}.
+    On a transport error values and rows are None, on an SNMP error status
+    they are empty.
+    """
+    column_names, scalar_names = resolve_names(columns), resolve_names(scalars)
+    walk = TableWalk([name for name in column_names.values() if name],
+                     [name for name in scalar_names.values() if name], max_repetitions, bulk)
+    error_indication, error_status = run_walk(walk, ip, community, timeout, retries, port)
+    return walk_result(error_indication, error_status, walk, column_names, scalar_names)
+
+def walk_result(error_indication, error_status, walk, column_names, scalar_names):
+    """
+    Map a finished TableWalk back to symbolic OIDs (see snmp_walk)
+    """
+    if error_indication:
+        return error_indication, None, None
+    if error_status:
+        return error_status, {}, {}
+    values = {scalar: walk.values.get(name) for scalar, name in scalar_names.items()}
+    rows = {column: walk.rows.get(name, {}) for column, name in column_names.items()}
+    return None, values, rows
+
+def walk_table(ip, community, columns, max_repetitions=MAX_REPETITIONS, bulk=True,
+               timeout=1, retries=0, port=None):
+    """
+    Walk the given (mib, name) columns of one table
+
+    Returns (error, table) where table is column-oriented (see column_table)
+    and keyed by the column names.
+    """
+    error, _, rows = snmp_walk(ip, community, columns, max_repetitions=max_repetitions, bulk=bulk,
+                               timeout=timeout, retries=retries, port=port)
+    if error:
+        return error, None
+    return None, column_table(rows, {column: column[1] for column in columns})
+
+# Table columns collected by the walkers
+IF_COLUMNS = [
+    ('IF-MIB', 'ifDescr'),
+    ('IF-MIB', 'ifType'),
+    ('IF-MIB', 'ifSpeed'),
+    ('IF-MIB', 'ifOperStatus'),
+    ('IF-MIB', 'ifInOctets'),
+    ('IF-MIB', 'ifOutOctets'),
+    ('IF-MIB', 'ifInErrors'),
+    ('IF-MIB', 'ifOutErrors')
+]
+IFX_COLUMNS = [
+    ('IF-MIB', 'ifName'),
+    ('IF-MIB', 'ifHCInOctets'),
+    ('IF-MIB', 'ifHCOutOctets'),
+    ('IF-MIB', 'ifHighSpeed')
+]
+HR_STORAGE_COLUMNS = [
+    ('HOST-RESOURCES-MIB', 'hrStorageType'),
+    ('HOST-RESOURCES-MIB', 'hrStorageDescr'),
+    ('HOST-RESOURCES-MIB', 'hrStorageAllocationUnits'),
+    ('HOST-RESOURCES-MIB', 'hrStorageSize'),
+    ('HOST-RESOURCES-MIB', 'hrStorageUsed')
+]
+HR_PROCESSOR_COLUMNS = [('HOST-RESOURCES-MIB', 'hrProcessorLoad')]
+
+# Interface counters sampled for rate computation, mapped to counter fields
+# (columns mapped to the same field are summed); 64-bit ifXTable first
+HC_COUNTER_COLUMNS = {
+    ('IF-MIB', 'ifHCInOctets'): 'in_octets',
+    ('IF-MIB', 'ifHCOutOctets'): 'out_octets',
+    ('IF-MIB', 'ifHCInUcastPkts'): 'in_ucast',
+    ('IF-MIB', 'ifHCInMulticastPkts'): 'in_nucast',
+    ('IF-MIB', 'ifHCInBroadcastPkts'): 'in_nucast',
+    ('IF-MIB', 'ifHCOutUcastPkts'): 'out_ucast',
+    ('IF-MIB', 'ifHCOutMulticastPkts'): 'out_nucast',
+    ('IF-MIB', 'ifHCOutBroadcastPkts'): 'out_nucast',
+    ('IF-MIB', 'ifHighSpeed'): 'speed'  # Mb/s
+}
+COUNTER_COLUMNS = {
+    ('IF-MIB', 'ifInOctets'): 'in_octets',
+    ('IF-MIB', 'ifOutOctets'): 'out_octets',
+    ('IF-MIB', 'ifInUcastPkts'): 'in_ucast',
+    ('IF-MIB', 'ifInNUcastPkts'): 'in_nucast',
+    ('IF-MIB', 'ifOutUcastPkts'): 'out_ucast',
+    ('IF-MIB', 'ifOutNUcastPkts'): 'out_nucast',
+    ('IF-MIB', 'ifSpeed'): 'speed'  # b/s
+}
+COUNTER_FIELDS = ('in_octets', 'out_octets', 'in_ucast', 'in_nucast', 'out_ucast', 'out_nucast')
+
+def interface_counters(values, rows, columns):
+    """
+    Compact counter sample of a device from walked HC_COUNTER_COLUMNS or COUNTER_COLUMNS
+
+    Returns {'uptime': ticks, 'width': 64 or 32, 'index': [...], field: [...]}
+    with plain ints (None where the agent has no value, speed in b/s), or None
+    if the agent returned no octet counters or no sysUpTime.
+    """
+    uptime = values.get(UPTIME_OID)
+    wide = ('IF-MIB', 'ifHCInOctets') in columns
+    octets = rows.get(('IF-MIB', 'ifHCInOctets' if wide else 'ifInOctets'))
+    if uptime is None or not octets:
+        return None
+
+    indexes = sorted(octets)
+    sample = {'uptime': int(uptime), 'width': 64 if wide else 32, 'index': [_index_key(index) for index in indexes]}
+    for field in COUNTER_FIELDS + ('speed',):
+        sample[field] = [0] * len(indexes)
+    for column, field in columns.items():
+        cells = rows.get(column, {})
+        cells_out = sample[field]
+        for position, index in enumerate(indexes):
+            value = cells.get(index)
+            if value is None or cells_out[position] is None:
+                cells_out[position] = None
+            else:
+                cells_out[position] += int(value)
+    if wide:
+        sample['speed'] = [None if speed is None else speed * 1000000 for speed in sample['speed']]
+    return sample
+
+def get_interfaces(ip, community='public', max_repetitions=MAX_REPETITIONS, timeout=1, retries=0):
+    """
+    ifTable and ifXTable counters of all interfaces (ifXTable shares ifIndex)
+    """
+    return walk_table(ip, community, IF_COLUMNS + IFX_COLUMNS, max_repetitions, timeout=timeout, retries=retries)
+
+def get_storage(ip, community='public', max_repetitions=MAX_REPETITIONS, timeout=1, retries=0):
+    """
+    The full hrStorageTable
+    """
+    return walk_table(ip, community, HR_STORAGE_COLUMNS, max_repetitions, timeout=timeout, retries=retries)
+
+def get_processor_loads(ip, community='public', max_repetitions=MAX_REPETITIONS, timeout=1, retries=0):
+    """
+    Every hrProcessorLoad row
+    """
+    return walk_table(ip, community, HR_PROCESSOR_COLUMNS, max_repetitions, timeout=timeout, retries=retries)
+
 def ping(ip, timeout=1):
     """
     Ping an IP address to check if it's active
     """
     try:
-        # Different ping commands for different OS
-        param = '-n' if platform.system().lower() == 'windows' else '-c'
-        command = ['ping', param, '1', '-w', str(timeout * 1000), str(ip)]
+        # Different ping commands for different OS (Windows -w is in ms, Linux -W in seconds)
+        if platform.system().lower() == 'windows':
+            command = ['ping', '-n', '1', '-w', str(timeout * 1000), str(ip)]
+        else:
+            command = ['ping', '-c', '1', '-W', str(timeout), str(ip)]
         
         result = subprocess.run(command, 
                               stdout=subprocess.PIPE, 
@@ -32,13 +599,7 @@ def scan_ip(ip, community='public', timeout=1):
     Scan a single IP address for SNMP availability
     """
     try:
-        error_indication, error_status, error_index, var_binds = next(
-            getCmd(SnmpEngine(),
-                  CommunityData(community),
-                  UdpTransportTarget((ip, 161), timeout=timeout, retries=0),
-                  ContextData(),
-                  ObjectType(ObjectIdentity('SNMPv2-MIB', 'sysDescr', 0)))
-        )
+        error_indication, error_status, error_index, var_binds = snmp_get(ip, community, ('SNMPv2-MIB', 'sysDescr', 0), timeout=timeout)
         
         if error_indication:
             logger.debug(f"SNMP error for {ip}: {error_indication}")
@@ -59,20 +620,17 @@ def check_device_status(ip, community='public', timeout=1):
     """
     return scan_ip(ip, community, timeout)
 
-def get_system_info(ip, community='public'):
+def get_system_info(ip, community='public', retries=0):
     """
     Get basic system information from a device
     """
     try:
-        error_indication, error_status, error_index, var_binds = next(
-            getCmd(SnmpEngine(),
-                  CommunityData(community),
-                  UdpTransportTarget((ip, 161)),
-                  ContextData(),
-                  ObjectType(ObjectIdentity('SNMPv2-MIB', 'sysDescr', 0)),
-                  ObjectType(ObjectIdentity('SNMPv2-MIB', 'sysName', 0)),
-                  ObjectType(ObjectIdentity('SNMPv2-MIB', 'sysLocation', 0)))
-        )
+        error_indication, error_status, error_index, var_binds = snmp_get(
+            ip, community,
+            ('SNMPv2-MIB', 'sysDescr', 0),
+            ('SNMPv2-MIB', 'sysName', 0),
+            ('SNMPv2-MIB', 'sysLocation', 0),
+            retries=retries)
         
         if error_indication:
             return None
@@ -93,13 +651,7 @@ def get_device_name(ip, community='public', timeout=1):
     Get device name via SNMP
     """
     try:
-        error_indication, error_status, error_index, var_binds = next(
-            getCmd(SnmpEngine(),
-                  CommunityData(community),
-                  UdpTransportTarget((ip, 161), timeout=timeout, retries=0),
-                  ContextData(),
-                  ObjectType(ObjectIdentity('SNMPv2-MIB', 'sysName', 0)))
-        )
+        error_indication, error_status, error_index, var_binds = snmp_get(ip, community, ('SNMPv2-MIB', 'sysName', 0), timeout=timeout)
         
         if error_indication is None and error_status == 0:
             for var_bind in var_binds:
@@ -111,162 +663,168 @@ def get_device_name(ip, community='public', timeout=1):
         logger.debug(f"Error getting device name for {ip}: {str(e)}")
         return None
 
-def find_active_ips(ip_range, max_workers=50):
-    """
-    Find all active IPs in a range using ping
-    """
-    try:
-        network = ipaddress.ip_network(ip_range, strict=False)
-        active_ips = []
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_ip = {executor.submit(ping, str(ip)): str(ip) for ip in network.hosts()}
-            
-            for future in concurrent.futures.as_completed(future_to_ip):
-                ip = future_to_ip[future]
-                try:
-                    if future.result():
-                        active_ips.append(ip)
-                except Exception as e:
-                    logger.error(f"Error checking {ip}: {str(e)}")
-        
-        return active_ips
-    except Exception as e:
-        logger.error(f"Error finding active IPs: {str(e)}")
-        return []
+# Metric sources: HOST-RESOURCES-MIB tables first, UCD-SNMP-MIB scalars as fallback
+UPTIME_OID = ('SNMPv2-MIB', 'sysUpTime', 0)
+CPU_OIDS = [
+    ('UCD-SNMP-MIB', 'ssCpuUser', 0),
+    ('UCD-SNMP-MIB', 'ssCpuSystem', 0)
+]
+UCD_MEMORY_OIDS = [
+    ('UCD-SNMP-MIB', 'memTotalReal', 0),
+    ('UCD-SNMP-MIB', 'memAvailReal', 0)
+]
+METRIC_SCALARS = [UPTIME_OID] + CPU_OIDS + UCD_MEMORY_OIDS
 
-def get_system_metrics(ip, community='public', timeout=1):
-    """
-    Get system metrics (uptime, CPU, memory) via SNMP
-    """
-    metrics = {
+HR_PROCESSOR_LOAD = ('HOST-RESOURCES-MIB', 'hrProcessorLoad')
+HR_STORAGE_TYPE = ('HOST-RESOURCES-MIB', 'hrStorageType')
+HR_STORAGE_UNITS = ('HOST-RESOURCES-MIB', 'hrStorageAllocationUnits')
+HR_STORAGE_SIZE = ('HOST-RESOURCES-MIB', 'hrStorageSize')
+HR_STORAGE_USED = ('HOST-RESOURCES-MIB', 'hrStorageUsed')
+METRIC_COLUMNS = [HR_PROCESSOR_LOAD, HR_STORAGE_TYPE, HR_STORAGE_UNITS, HR_STORAGE_SIZE, HR_STORAGE_USED]
+
+# hrStorageType of the physical memory row (HOST-RESOURCES-TYPES::hrStorageRam)
+HR_STORAGE_RAM = '1.3.6.1.2.1.25.2.1.2'
+
+SYS_DESCR_OID = ('SNMPv2-MIB', 'sysDescr', 0)
+SYS_NAME_OID = ('SNMPv2-MIB', 'sysName', 0)
+STATUS_OIDS = [SYS_DESCR_OID, SYS_NAME_OID]
+POLL_SCALARS = STATUS_OIDS + METRIC_SCALARS
+
+# Rows per column fetched by each poll PDU; typical agents fit in one response
+POLL_MAX_REPETITIONS = 10
+
+def _empty_metrics():
+    return {
         'uptime': None,
         'cpu_usage': None,
         'memory_used': None,
         'memory_total': None
     }
-    
+
+def _ram_storage(rows):
+    """
+    (used, total) bytes of the hrStorageRam row, or None
+    """
+    for index, storage_type in rows.get(HR_STORAGE_TYPE, {}).items():
+        if str(storage_type) != HR_STORAGE_RAM:
+            continue
+        units, size, used = (rows[column].get(index) for column in (HR_STORAGE_UNITS, HR_STORAGE_SIZE, HR_STORAGE_USED))
+        if units is not None and size and used is not None:
+            return int(used) * int(units), int(size) * int(units)
+    return None
+
+def _parse_metrics(ip, values, rows):
+    """
+    Apply the per-metric fallback logic to the scalars and table rows of a poll
+    """
+    metrics = _empty_metrics()
+
+    uptime_ticks = values.get(UPTIME_OID)
+    if uptime_ticks is not None:
+        uptime_ticks = int(uptime_ticks)
+        days = uptime_ticks // (24 * 60 * 60 * 100)
+        hours = (uptime_ticks % (24 * 60 * 60 * 100)) // (60 * 60 * 100)
+        minutes = (uptime_ticks % (60 * 60 * 100)) // (60 * 100)
+        metrics['uptime'] = f"{days}d {hours}h {minutes}m"
+        logging.info(f"Got uptime for {ip}: {metrics['uptime']}")
+    else:
+        logging.warning(f"Could not get uptime for {ip}")
+
+    # Average load over every hrProcessorLoad row, then UCD-SNMP-MIB as fallback
+    loads = [int(load) for load in rows.get(HR_PROCESSOR_LOAD, {}).values()]
+    if loads:
+        metrics['cpu_usage'] = round(sum(loads) / len(loads), 1)
+        logging.info(f"Got CPU usage for {ip} using HOST-RESOURCES-MIB ({len(loads)} processors): {metrics['cpu_usage']}%")
+    else:
+        for mib, oid, index in CPU_OIDS:
+            cpu_value = values.get((mib, oid, index))
+            if cpu_value is not None:
+                metrics['cpu_usage'] = float(int(cpu_value))
+                logging.info(f"Got CPU usage for {ip} using {mib}: {int(cpu_value)}%")
+                break
+
+    # First try the hrStorageRam row of HOST-RESOURCES-MIB, then UCD-SNMP-MIB as fallback
+    ram = _ram_storage(rows)
+    total_real, available_real = (values.get(oid) for oid in UCD_MEMORY_OIDS)
+    if ram:
+        metrics['memory_used'] = ram[0] // (1024 * 1024)  # Convert to MB
+        metrics['memory_total'] = ram[1] // (1024 * 1024)  # Convert to MB
+        logging.info(f"Got memory usage for {ip} using HOST-RESOURCES-MIB: {metrics['memory_used']}MB / {metrics['memory_total']}MB")
+    elif total_real and available_real is not None:
+        metrics['memory_total'] = int(total_real) // 1024  # Convert to MB
+        metrics['memory_used'] = (int(total_real) - int(available_real)) // 1024  # Convert to MB
+        logging.info(f"Got memory usage for {ip} using UCD-SNMP-MIB: {metrics['memory_used']}MB / {metrics['memory_total']}MB")
+    else:
+        logging.warning(f"Could not get memory usage for {ip}")
+
+    return metrics
+
+def get_system_metrics(ip, community='public', timeout=1, retries=0):
+    """
+    Get system metrics (uptime, CPU, memory) via SNMP
+
+    Scalars and the processor/storage tables travel in one GETBULK walk, so a
+    healthy device usually costs one round trip and a dead device one timeout
+    (retries + 1 timeouts when retries are requested).
+    """
     try:
-        # Get uptime
-        error_indication, error_status, error_index, var_binds = next(
-            getCmd(SnmpEngine(),
-                  CommunityData(community),
-                  UdpTransportTarget((ip, 161), timeout=timeout),
-                  ContextData(),
-                  ObjectType(ObjectIdentity('SNMPv2-MIB', 'sysUpTime', 0)))
-        )
-        
-        if error_indication:
-            logging.warning(f"Could not get uptime for {ip}: {error_indication}")
-        elif error_status:
-            logging.warning(f"Could not get uptime for {ip}: {error_status.prettyPrint()} at {error_index}")
-        else:
-            uptime_ticks = int(var_binds[0][1])
-            days = uptime_ticks // (24 * 60 * 60 * 100)
-            hours = (uptime_ticks % (24 * 60 * 60 * 100)) // (60 * 60 * 100)
-            minutes = (uptime_ticks % (60 * 60 * 100)) // (60 * 100)
-            metrics['uptime'] = f"{days}d {hours}h {minutes}m"
-            logging.info(f"Got uptime for {ip}: {metrics['uptime']}")
-        
-        # Try different OIDs for CPU usage
-        cpu_oids = [
-            ('HOST-RESOURCES-MIB', 'hrProcessorLoad', 0),  # Standard OID
-            ('UCD-SNMP-MIB', 'ssCpuUser', 0),             # Alternative OID
-            ('UCD-SNMP-MIB', 'ssCpuSystem', 0)            # Another alternative
-        ]
-        
-        for mib, oid, index in cpu_oids:
-            try:
-                error_indication, error_status, error_index, var_binds = next(
-                    getCmd(SnmpEngine(),
-                          CommunityData(community),
-                          UdpTransportTarget((ip, 161), timeout=timeout),
-                          ContextData(),
-                          ObjectType(ObjectIdentity(mib, oid, index)))
-                )
-                
-                if not error_indication and not error_status:
-                    cpu_value = int(var_binds[0][1])
-                    metrics['cpu_usage'] = float(cpu_value)
-                    logging.info(f"Got CPU usage for {ip} using {mib}: {cpu_value}%")
-                    break
-            except Exception as e:
-                continue
-        
-        # Try different OIDs for memory usage
-        memory_oids = [
-            # HOST-RESOURCES-MIB (standard)
-            ('HOST-RESOURCES-MIB', 'hrStorageUsed', 1),
-            ('HOST-RESOURCES-MIB', 'hrStorageSize', 1),
-            # UCD-SNMP-MIB (alternative)
-            ('UCD-SNMP-MIB', 'memTotalReal', 0),
-            ('UCD-SNMP-MIB', 'memAvailReal', 0)
-        ]
-        
-        # First try HOST-RESOURCES-MIB
-        try:
-            # Get used memory
-            error_indication, error_status, error_index, var_binds = next(
-                getCmd(SnmpEngine(),
-                      CommunityData(community),
-                      UdpTransportTarget((ip, 161), timeout=timeout),
-                      ContextData(),
-                      ObjectType(ObjectIdentity('HOST-RESOURCES-MIB', 'hrStorageUsed', 1)))
-            )
-            
-            if not error_indication and not error_status and var_binds[0][1]:
-                used_memory = int(var_binds[0][1])
-                
-                # Get total memory
-                error_indication, error_status, error_index, var_binds = next(
-                    getCmd(SnmpEngine(),
-                          CommunityData(community),
-                          UdpTransportTarget((ip, 161), timeout=timeout),
-                          ContextData(),
-                          ObjectType(ObjectIdentity('HOST-RESOURCES-MIB', 'hrStorageSize', 1)))
-                )
-                
-                if not error_indication and not error_status and var_binds[0][1]:
-                    total_memory = int(var_binds[0][1])
-                    metrics['memory_used'] = used_memory // (1024 * 1024)  # Convert to MB
-                    metrics['memory_total'] = total_memory // (1024 * 1024)  # Convert to MB
-                    logging.info(f"Got memory usage for {ip} using HOST-RESOURCES-MIB: {metrics['memory_used']}MB / {metrics['memory_total']}MB")
-        except (ValueError, TypeError) as e:
-            logging.warning(f"Could not get memory usage for {ip} using HOST-RESOURCES-MIB: {str(e)}")
-            
-            # Try UCD-SNMP-MIB as fallback
-            try:
-                # Get total memory
-                error_indication, error_status, error_index, var_binds = next(
-                    getCmd(SnmpEngine(),
-                          CommunityData(community),
-                          UdpTransportTarget((ip, 161), timeout=timeout),
-                          ContextData(),
-                          ObjectType(ObjectIdentity('UCD-SNMP-MIB', 'memTotalReal', 0)))
-                )
-                
-                if not error_indication and not error_status and var_binds[0][1]:
-                    total_memory = int(var_binds[0][1])
-                    
-                    # Get available memory
-                    error_indication, error_status, error_index, var_binds = next(
-                        getCmd(SnmpEngine(),
-                              CommunityData(community),
-                              UdpTransportTarget((ip, 161), timeout=timeout),
-                              ContextData(),
-                              ObjectType(ObjectIdentity('UCD-SNMP-MIB', 'memAvailReal', 0)))
-                    )
-                    
-                    if not error_indication and not error_status and var_binds[0][1]:
-                        available_memory = int(var_binds[0][1])
-                        metrics['memory_total'] = total_memory // 1024  # Convert to MB
-                        metrics['memory_used'] = (total_memory - available_memory) // 1024  # Convert to MB
-                        logging.info(f"Got memory usage for {ip} using UCD-SNMP-MIB: {metrics['memory_used']}MB / {metrics['memory_total']}MB")
-            except (ValueError, TypeError) as e:
-                logging.warning(f"Could not get memory usage for {ip} using UCD-SNMP-MIB: {str(e)}")
-        
-        return metrics
-        
+        error, values, rows = snmp_walk(ip, community, METRIC_COLUMNS, METRIC_SCALARS,
+                                        max_repetitions=POLL_MAX_REPETITIONS, timeout=timeout, retries=retries)
+        if error:
+            logging.warning(f"Could not get system metrics for {ip}: {error}")
+            return _empty_metrics()
+        return _parse_metrics(ip, values, rows)
     except Exception as e:
         logging.error(f"Error getting system metrics for {ip}: {str(e)}")
-        return metrics 
\ No newline at end of file
+        return _empty_metrics()
+
+def build_poll_result(ip, values, rows=None):
+    """
+    Build a poll_device() result from the scalars and table rows of a successful poll
+    """
+    result = {'active': True, 'name': None, 'description': None}
+    if values.get(SYS_DESCR_OID) is not None:
+        result['description'] = str(values[SYS_DESCR_OID])
+    name = values.get(SYS_NAME_OID)
+    if name is not None and str(name) and str(name) != '0':
+        result['name'] = str(name)
+    result['metrics'] = _parse_metrics(ip, values, rows or {})
+    return result
+
+def inactive_poll_result():
+    return {'active': False, 'name': None, 'description': None, 'metrics': _empty_metrics()}
+
+def poll_device(ip, community='public', timeout=1, retries=0, counters=False):
+    """
+    Poll status, name, description and system metrics of a device in one GETBULK walk
+
+    Returns a dict with 'active', 'name', 'description' and 'metrics' keys.
+    With counters=True the interface counters travel in the same walk and the
+    result also holds 'counters' (see interface_counters).
+    """
+    try:
+        columns = METRIC_COLUMNS + (list(HC_COUNTER_COLUMNS) if counters else [])
+        error, values, rows = snmp_walk(ip, community, columns, POLL_SCALARS,
+                                        max_repetitions=POLL_MAX_REPETITIONS, timeout=timeout, retries=retries)
+        if error and values is None:
+            logger.debug(f"SNMP error for {ip}: {error}")
+            return inactive_poll_result()
+        if error:
+            # Some agents reject the walk as a whole - fall back to a plain status probe
+            logger.debug(f"Poll walk rejected by {ip} ({error}), probing status only")
+            error, values = snmp_get_values(ip, community, STATUS_OIDS, timeout=timeout, retries=retries)
+            if error:
+                return inactive_poll_result()
+            rows = None
+        result = build_poll_result(ip, values, rows)
+        if counters and rows is not None:
+            result['counters'] = interface_counters(values, rows, HC_COUNTER_COLUMNS)
+            if result['counters'] is None:
+                # No ifXTable - fall back to the 32-bit ifTable counters
+                error, _, rows = snmp_walk(ip, community, COUNTER_COLUMNS, timeout=timeout, retries=retries)
+                if not error:
+                    result['counters'] = interface_counters(values, rows, COUNTER_COLUMNS)
+        return result
+    except Exception as e:
+        logger.debug(f"Error polling {ip}: {str(e)}")
+        return inactive_poll_result()
@@ -0,0 +1,134 @@
+import logging
+import socket
+import threading
+
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+
+from instrumentation import TRAPS_RECEIVED
+
+logger = logging.getLogger(__name__)
+
+# Standard SNMP trap port (binding it needs root; tests and unprivileged setups use another one)
+TRAP_PORT = 162
+
+# snmpTrapOID.0: the second var-bind of every SNMPv2 trap and inform
+SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)
+
+# SNMPv2-MIB snmpTraps and the SNMPv1 generic-trap numbers of the same events
+TRAP_TYPES = {
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 1): 'coldStart',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 2): 'warmStart',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 3): 'linkDown',
+    (1, 3, 6, 1, 6, 3, 1, 1, 5, 4): 'linkUp',
+}
+GENERIC_TRAPS = {0: 'coldStart', 1: 'warmStart', 2: 'linkDown', 3: 'linkUp'}
+
+# IF-MIB ifIndex, carried by linkDown/linkUp as ifIndex.<n>
+IF_INDEX = (1, 3, 6, 1, 2, 1, 2, 2, 1, 1)
+
+def decode_trap(datagram, address):
+    """
+    Decode an SNMPv1 Trap, SNMPv2c Trap or InformRequest datagram
+
+    Returns (trap, response): trap is a dict with 'ip' (the sender's address),
+    'agent_address' (the agent address an SNMPv1 trap claims, or None),
+    'community', 'type' (coldStart, warmStart, linkDown, linkUp, or the trap
+    OID of other traps) and 'if_index' (or None); response is the datagram
+    acknowledging an inform, else None. agent_address is not authenticated:
+    any sender can put any address there.
+    Other PDUs decode to (None, None); malformed datagrams raise.
+    """
+    version = int(api.decodeMessageVersion(datagram))
+    p_mod = api.protoModules[version]
+    message, _ = decoder.decode(datagram, asn1Spec=p_mod.Message())
+    pdu = p_mod.apiMessage.getPDU(message)
+    trap = {'ip': address[0], 'agent_address': None, 'community': str(p_mod.apiMessage.getCommunity(message)),
+            'if_index': None}
+    response = None
+
+    if version == api.protoVersion1:
+        if not pdu.isSameTypeWith(p_mod.TrapPDU()):
+            return None, None
+        agent_address = p_mod.apiTrapPDU.getAgentAddr(pdu).prettyPrint()
+        if agent_address != '0.0.0.0':
+            trap['agent_address'] = agent_address
+        generic = int(p_mod.apiTrapPDU.getGenericTrap(pdu))
+        trap['type'] = GENERIC_TRAPS.get(generic) or (
+            f"{p_mod.apiTrapPDU.getEnterprise(pdu).prettyPrint()}.{generic}.{int(p_mod.apiTrapPDU.getSpecificTrap(pdu))}")
+        var_binds = p_mod.apiTrapPDU.getVarBinds(pdu)
+    elif pdu.isSameTypeWith(p_mod.SNMPv2TrapPDU()) or pdu.isSameTypeWith(p_mod.InformRequestPDU()):
+        var_binds = p_mod.apiPDU.getVarBinds(pdu)
+        trap_oid = next((tuple(value) for name, value in var_binds if tuple(name) == SNMP_TRAP_OID), None)
+        trap['type'] = TRAP_TYPES.get(trap_oid) or ('.'.join(map(str, trap_oid)) if trap_oid else None)
+        if pdu.isSameTypeWith(p_mod.InformRequestPDU()):
+            # An inform is retransmitted until the Response echoing its var-binds arrives
+            response_message = p_mod.apiMessage.getResponse(message)
+            response_pdu = p_mod.apiMessage.getPDU(response_message)
+            p_mod.apiPDU.setErrorStatus(response_pdu, 0)
+            p_mod.apiPDU.setErrorIndex(response_pdu, 0)
+            p_mod.apiPDU.setVarBinds(response_pdu, var_binds)
+            response = encoder.encode(response_message)
+    else:
+        return None, None
+
+    for name, value in var_binds:
+        name = tuple(name)
+        if name[:len(IF_INDEX)] == IF_INDEX and len(name) == len(IF_INDEX) + 1:
+            trap['if_index'] = int(value)
+    return trap, response
+
+class TrapReceiver(threading.Thread):
+    """
+    Listen for traps and informs on a UDP port and pass each decoded trap
+    to handler(trap) (see decode_trap)
+
+    Informs are acknowledged before the handler runs, so a slow handler
+    does not make the agent retransmit. The handler runs on the receiver
+    thread; its exceptions, like failures to send an acknowledgement, are
+    logged and the next datagram is read.
+    """
+    def __init__(self, handler, port=TRAP_PORT, host=''):
+        super().__init__(name='trap-receiver', daemon=True)
+        self.handler = handler
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Bound here, so a port that is taken (or privileged) fails in the caller
+        self.sock.bind((host, port))
+        self.port = self.sock.getsockname()[1]
+        self._stopped = threading.Event()
+
+    def run(self):
+        logger.info(f"Receiving SNMP traps on UDP port {self.port}")
+        self.sock.settimeout(0.5)  # checks for stop() between datagrams
+        while not self._stopped.is_set():
+            try:
+                datagram, address = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # closed by stop()
+            try:
+                trap, response = decode_trap(datagram, address)
+            except Exception as e:
+                logger.debug(f"Dropping undecodable datagram from {address[0]}: {str(e)}")
+                TRAPS_RECEIVED.inc('invalid')
+                continue
+            if trap is None:
+                continue
+            if response is not None:
+                try:
+                    self.sock.sendto(response, address)
+                except OSError as e:
+                    # The agent retransmits the inform; the trap itself is still handled
+                    logger.error(f"Could not acknowledge inform from {address[0]}: {str(e)}")
+            TRAPS_RECEIVED.inc(trap['type'] if trap['type'] in GENERIC_TRAPS.values() else 'other')
+            try:
+                self.handler(trap)
+            except Exception as e:
+                logger.error(f"Error handling {trap['type']} trap from {trap['ip']}: {str(e)}")
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join(1)
+        self.sock.close()